@@ -0,0 +1,167 @@
+"""
+Benchmarks of nodes and upscaling engines on synthetic images.
+
+    pytest backend/benchmarks --bench-json results.json
+    pytest backend/benchmarks --bench-compare results.json --bench-max-regression 0.2
+
+The `benchmark` fixture calls a function repeatedly and records how long it took. The
+results of a session can be stored as JSON and compared against a previous session to
+find regressions, e.g. after upgrading a dependency.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("device", "cpu")
+os.environ.setdefault("isFp16", "False")
+os.environ.setdefault("killed", "False")
+
+MIN_ROUNDS = 3
+MAX_ROUNDS = 100
+MIN_SECONDS = 0.5
+"""Functions are called until they ran for at least this long, or `MAX_ROUNDS` times"""
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("chaiNNer benchmarks")
+    group.addoption(
+        "--bench-json", default=None, help="write the results to the given JSON file"
+    )
+    group.addoption(
+        "--bench-compare",
+        default=None,
+        help="compare the results to those in the given JSON file",
+    )
+    group.addoption(
+        "--bench-max-regression",
+        type=float,
+        default=None,
+        help="fail if a benchmark is slower than in --bench-compare by more than the given fraction (e.g. 0.2)",
+    )
+
+
+class BenchmarkResult:
+    def __init__(self, name: str, times: List[float], params: Dict[str, Any]):
+        self.name = name
+        self.times = times
+        self.params = params
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "params": self.params,
+            "rounds": len(self.times),
+            "min": min(self.times),
+            "median": statistics.median(self.times),
+            "mean": statistics.mean(self.times),
+            "stddev": statistics.stdev(self.times) if len(self.times) > 1 else 0,
+        }
+
+
+RESULTS: List[BenchmarkResult] = []
+SUMMARY: List[Dict[str, Any]] = []
+
+
+@pytest.fixture
+def benchmark(request) -> Callable[..., Any]:
+    """Returns a function that benchmarks calling `fn(*args, **kwargs)`"""
+
+    def run(fn: Callable[..., Any], *args, **kwargs) -> Any:
+        # The first call warms up caches (e.g. loaded models) and isn't measured
+        result = fn(*args, **kwargs)
+        times: List[float] = []
+        total = 0.0
+        while len(times) < MIN_ROUNDS or (
+            total < MIN_SECONDS and len(times) < MAX_ROUNDS
+        ):
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            times.append(elapsed)
+            total += elapsed
+
+        # Names don't depend on where pytest was started from, so they can be compared
+        module = os.path.relpath(str(request.node.fspath), os.path.dirname(__file__))
+        name = f"{module.replace(os.sep, '/')}::{request.node.name}"
+        callspec = getattr(request.node, "callspec", None)
+        params = (
+            {k: getattr(v, "__name__", v) for k, v in callspec.params.items()}
+            if callspec
+            else {}
+        )
+        RESULTS.append(BenchmarkResult(name, times, params))
+        return result
+
+    return run
+
+
+def get_machine_info() -> Dict[str, Any]:
+    return {
+        "python": sys.version,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if not RESULTS:
+        return
+    config = session.config
+    results = [result.to_dict() for result in RESULTS]
+
+    json_path = config.getoption("--bench-json")
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "machine": get_machine_info(),
+                    "timestamp": time.time(),
+                    "benchmarks": results,
+                },
+                f,
+                indent=2,
+            )
+
+    compare_path = config.getoption("--bench-compare")
+    max_regression = config.getoption("--bench-max-regression")
+    if compare_path:
+        with open(compare_path, "r", encoding="utf-8") as f:
+            baseline = {b["name"]: b for b in json.load(f)["benchmarks"]}
+        for result in results:
+            previous = baseline.get(result["name"], None)
+            if previous is None:
+                continue
+            # The median is less sensitive to a noisy machine than the mean
+            change = result["median"] / previous["median"] - 1
+            result["change"] = change
+            if max_regression is not None and change > max_regression:
+                result["regression"] = True
+                session.exitstatus = pytest.ExitCode.TESTS_FAILED
+
+    SUMMARY.extend(results)
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not SUMMARY:
+        return
+    terminalreporter.section("benchmarks (median)")
+    for result in SUMMARY:
+        line = f"{result['median'] * 1000:10.3f} ms  {result['name']}"
+        if "change" in result:
+            line += f"  ({result['change']:+.1%})"
+        if result.get("regression", False):
+            line += "  REGRESSION"
+        terminalreporter.write_line(line)
@@ -0,0 +1,21 @@
+import numpy as np
+
+SIZES = [256, 1024]
+"""The width and height of the synthetic images"""
+
+
+def synthetic_image(size: int, channels: int, seed: int = 0) -> np.ndarray:
+    """
+    Returns a float32 image with values in [0, 1], like the images nodes pass around.
+
+    The image is a mix of gradients and noise, so it neither compresses nor filters
+    unrealistically well.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    gradient = (x + y) / 2
+    shape = (size, size) if channels == 1 else (size, size, channels)
+    noise = rng.random(shape, dtype=np.float32)
+    if channels > 1:
+        gradient = gradient[:, :, None]
+    return np.clip(0.7 * gradient + 0.3 * noise, 0, 1).astype(np.float32)
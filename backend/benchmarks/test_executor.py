@@ -0,0 +1,96 @@
+"""
+Benchmarks of the executor itself.
+
+The images are tiny, so these mostly measure what it costs to schedule nodes, e.g. for
+every iteration of an iterator.
+"""
+
+import asyncio
+
+import cv2
+import numpy as np
+import pytest
+
+from chain import convert_to_usable_format
+from node_registry import get_node_schemas, import_node_modules
+from process import Executor
+
+ITERATIONS = 50
+
+ITERATOR = "00000000-0000-0000-0000-000000000001"
+LOAD = "00000000-0000-0000-0000-000000000002"
+BLUR = "00000000-0000-0000-0000-000000000003"
+SAVE = "00000000-0000-0000-0000-000000000004"
+
+
+@pytest.fixture(scope="module")
+def schemata():
+    import_node_modules()
+    return {schema["schemaId"]: schema for schema in get_node_schemas()}
+
+
+def edge(source, output_id, target, input_id):
+    return {
+        "source": source,
+        "target": target,
+        "sourceHandle": f"{source}-{output_id}",
+        "targetHandle": f"{target}-{input_id}",
+    }
+
+
+def child(node_id, schema_id, node_type, input_data):
+    return {
+        "id": node_id,
+        "type": node_type,
+        "parentNode": ITERATOR,
+        "data": {"schemaId": schema_id, "inputData": input_data},
+    }
+
+
+def test_image_iterator(benchmark, tmp_path, schemata):
+    input_dir = tmp_path / "in"
+    output_dir = tmp_path / "out"
+    input_dir.mkdir()
+    output_dir.mkdir()
+    for i in range(ITERATIONS):
+        cv2.imwrite(str(input_dir / f"{i}.png"), np.full((8, 8, 3), i, np.uint8))
+
+    content = {
+        "nodes": [
+            {
+                "id": ITERATOR,
+                "type": "iterator",
+                "data": {
+                    "schemaId": "chainner:image:file_iterator",
+                    "inputData": {"0": str(input_dir)},
+                },
+            },
+            child(LOAD, "chainner:image:file_iterator_load", "iteratorHelper", {}),
+            child(BLUR, "chainner:image:blur", "regularNode", {"1": 1, "2": 1}),
+            child(
+                SAVE,
+                "chainner:image:save",
+                "regularNode",
+                {"1": str(output_dir), "4": "png", "5": 95, "6": 1, "7": 5},
+            ),
+        ],
+        "edges": [
+            edge(LOAD, 0, BLUR, 0),
+            edge(BLUR, 0, SAVE, 0),
+            edge(LOAD, 3, SAVE, 3),
+        ],
+    }
+
+    def run():
+        nodes = convert_to_usable_format(content, schemata)
+        loop = asyncio.new_event_loop()
+        try:
+            executor = Executor(
+                nodes, loop, asyncio.Queue(), {}, has_subscribers=lambda: False
+            )
+            loop.run_until_complete(executor.run())
+        finally:
+            loop.close()
+
+    benchmark(run)
+    assert len(list(output_dir.iterdir())) == ITERATIONS
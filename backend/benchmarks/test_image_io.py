@@ -0,0 +1,34 @@
+import cv2
+import numpy as np
+import pytest
+
+from nodes.image_nodes import ImReadNode, ImWriteNode
+from synthetic import SIZES, synthetic_image
+
+FORMATS = [("png", np.uint8), ("png", np.uint16), ("jpg", np.uint8), ("webp", np.uint8)]
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("channels", [3, 4])
+@pytest.mark.parametrize("extension,dtype", FORMATS)
+def test_read(benchmark, tmp_path, size, channels, extension, dtype):
+    if extension == "jpg" and channels == 4:
+        pytest.skip("JPEG doesn't support transparency")
+    img = synthetic_image(size, channels)
+    path = str(tmp_path / f"image.{extension}")
+    cv2.imwrite(path, (img * np.iinfo(dtype).max).round().astype(dtype))
+
+    benchmark(ImReadNode().run, path)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("channels", [3, 4])
+@pytest.mark.parametrize("extension", ["png", "jpg", "webp", "tiff"])
+def test_write(benchmark, tmp_path, size, channels, extension):
+    img = synthetic_image(size, channels)
+    node = ImWriteNode()
+
+    def write():
+        node.run(img, str(tmp_path), None, "image", extension, 95, 1, 5).result()
+
+    benchmark(write)
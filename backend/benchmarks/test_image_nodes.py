@@ -0,0 +1,100 @@
+import pytest
+
+from nodes.image_chan_nodes import FillAlphaNode
+from nodes.image_dim_nodes import ImResizeByFactorNode, ImResizeToResolutionNode
+from nodes.image_filter_nodes import (
+    BlurNode,
+    ColorTransferNode,
+    GaussianBlurNode,
+    MedianBlurNode,
+)
+from nodes.image_util_nodes import ImageMetricsNode, ImBlend
+from nodes.properties.inputs.generic_inputs import AlphaFillMethod
+from nodes.utils.blend_modes import BlendModes
+from nodes.utils.image_utils import encode_preview
+from nodes.utils.pil_utils import InterpolationMethod
+from synthetic import SIZES, synthetic_image
+
+CHANNELS = [1, 3, 4]
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("channels", CHANNELS)
+@pytest.mark.parametrize(
+    "interpolation",
+    [InterpolationMethod.AUTO, InterpolationMethod.LINEAR, InterpolationMethod.CUBIC],
+)
+def test_resize_factor(benchmark, size, channels, interpolation):
+    img = synthetic_image(size, channels)
+    benchmark(ImResizeByFactorNode().run, img, 50.0, interpolation)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("channels", CHANNELS)
+def test_resize_resolution(benchmark, size, channels):
+    img = synthetic_image(size, channels)
+    node = ImResizeToResolutionNode()
+    benchmark(node.run, img, size * 2, size * 2, InterpolationMethod.AUTO)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("channels", CHANNELS)
+@pytest.mark.parametrize("node_class", [BlurNode, GaussianBlurNode])
+def test_blur(benchmark, size, channels, node_class):
+    img = synthetic_image(size, channels)
+    benchmark(node_class().run, img, 4.5, 4.5)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("channels", CHANNELS)
+def test_median_blur(benchmark, size, channels):
+    img = synthetic_image(size, channels)
+    benchmark(MedianBlurNode().run, img, 3)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("channels", [3, 4])
+@pytest.mark.parametrize(
+    "blend_mode", [BlendModes.NORMAL, BlendModes.MULTIPLY, BlendModes.OVERLAY]
+)
+def test_blend(benchmark, size, channels, blend_mode):
+    base = synthetic_image(size, channels, seed=0)
+    overlay = synthetic_image(size, 4, seed=1)
+    benchmark(ImBlend().run, base, overlay, blend_mode)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize(
+    "method", [AlphaFillMethod.EXTEND_TEXTURE, AlphaFillMethod.EXTEND_COLOR]
+)
+def test_fill_alpha(benchmark, size, method):
+    img = synthetic_image(size, 4)
+    # Make parts of the image transparent
+    img[::3, :, 3] = 0
+    img[:, size // 2 :, 3] = 0
+    # Fill alpha modifies its input
+    benchmark(lambda: FillAlphaNode().run(img.copy(), method))
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("colorspace", ["L*a*b*", "RGB"])
+def test_color_transfer(benchmark, size, colorspace):
+    img = synthetic_image(size, 3, seed=0)
+    ref = synthetic_image(size, 3, seed=1)
+    benchmark(ColorTransferNode().run, img, ref, colorspace, 1, 1)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("channels", [1, 3])
+def test_image_metrics(benchmark, size, channels):
+    img = synthetic_image(size, channels, seed=0)
+    other = synthetic_image(size, channels, seed=1)
+    benchmark(ImageMetricsNode().run, img, other)
+
+
+@pytest.mark.parametrize("size", SIZES + [2048])
+@pytest.mark.parametrize("channels", CHANNELS)
+def test_preview_encode(benchmark, size, channels):
+    img = synthetic_image(size, channels)
+    # `preview_encode` remembers the previews of images, so only the first call encodes
+    benchmark(encode_preview, img, 512)
@@ -0,0 +1,122 @@
+"""
+Benchmarks of the three upscaling engines with tiny models on the CPU.
+
+The models only upscale and barely compute anything, so these measure the overhead of
+tiling, blending, and converting images, which is what changes between versions.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from nodes.utils.tiler import TileBlend
+from synthetic import synthetic_image
+
+SCALE = 2
+SIZES = [256, 512]
+TILE_SIZES = [None, 128]
+"""None processes the whole image at once, unless that runs out of memory"""
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("tile_size", TILE_SIZES)
+@pytest.mark.parametrize("blend", [TileBlend.LINEAR, TileBlend.COSINE])
+def test_pytorch(benchmark, size, tile_size, blend):
+    torch = pytest.importorskip("torch")
+    from nodes.utils.pytorch_auto_split import auto_split_process
+    from nodes.utils.utils import np2tensor, tensor2np
+
+    model = torch.nn.Sequential(
+        torch.nn.Conv2d(3, 3 * SCALE * SCALE, 3, padding=1),
+        torch.nn.PixelShuffle(SCALE),
+    ).eval()
+    img = synthetic_image(size, 3)
+
+    @torch.inference_mode()
+    def upscale():
+        tensor = np2tensor(img, change_range=True)
+        tile = (tile_size, tile_size) if tile_size else None
+        output, _ = auto_split_process(tensor, model, tile_size=tile, blend=blend)
+        return tensor2np(output.detach(), change_range=False, imtype=np.float32)
+
+    output = benchmark(upscale)
+    assert output.shape == (size * SCALE, size * SCALE, 3)
+
+
+def get_onnx_model() -> bytes:
+    """Returns an ONNX model that upscales with nearest neighbor interpolation"""
+    onnx = pytest.importorskip("onnx")
+    from onnx import TensorProto, helper
+
+    graph = helper.make_graph(
+        [
+            helper.make_node(
+                "Resize", ["input", "", "scales"], ["output"], mode="nearest"
+            )
+        ],
+        "upscale",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["b", 3, "h", "w"])],
+        [
+            helper.make_tensor_value_info(
+                "output", TensorProto.FLOAT, ["b", 3, "h2", "w2"]
+            )
+        ],
+        [helper.make_tensor("scales", TensorProto.FLOAT, [4], [1, 1, SCALE, SCALE])],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    return model.SerializeToString()
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("tile_size", TILE_SIZES)
+def test_onnx(benchmark, size, tile_size):
+    pytest.importorskip("onnxruntime")
+    from nodes.utils.onnx_auto_split import onnx_auto_split_process
+    from nodes.utils.onnx_session import get_onnx_session
+    from nodes.utils.utils import np2nptensor, nptensor2np
+
+    session = get_onnx_session(get_onnx_model(), "cpu")
+    img = synthetic_image(size, 3)
+
+    def upscale():
+        tensor = np2nptensor(img, change_range=False)
+        tile = (tile_size, tile_size) if tile_size else None
+        output, _ = onnx_auto_split_process(tensor, session, tile_size=tile)
+        return nptensor2np(output, change_range=False, imtype=np.float32)
+
+    output = benchmark(upscale)
+    assert output.shape == (size * SCALE, size * SCALE, 3)
+
+
+NCNN_PARAM = """7767517
+2 2
+Input data 0 1 data
+Interp upscale 1 1 data output 0=1 1=2.0 2=2.0
+"""
+"""An NCNN model that upscales with nearest neighbor interpolation"""
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("tile_size", TILE_SIZES)
+def test_ncnn(benchmark, tmp_path, size, tile_size):
+    pytest.importorskip("ncnn_vulkan")
+    from ncnn_vulkan import ncnn
+
+    from nodes.utils.ncnn_auto_split import ncnn_auto_split_process
+
+    param_path = os.path.join(str(tmp_path), "upscale.param")
+    with open(param_path, "w", encoding="utf-8") as f:
+        f.write(NCNN_PARAM)
+    net = ncnn.Net()
+    net.load_param(param_path)
+    img = synthetic_image(size, 3)
+
+    def upscale():
+        tile = (tile_size, tile_size) if tile_size else None
+        output, _ = ncnn_auto_split_process(img, net, tile_size=tile)
+        return output
+
+    output = benchmark(upscale)
+    assert output.shape == (size * SCALE, size * SCALE, 3)
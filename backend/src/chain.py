@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import base64
+import json
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Set
+
+if TYPE_CHECKING:
+    from process import UsableData
+
+Schema = Dict[str, Any]
+
+
+class ChainError(Exception):
+    pass
+
+
+def parse_save_file(value: str) -> Dict[str, Any]:
+    """Returns the content (nodes and edges) of a .chn save file"""
+    if not value.lstrip().startswith("{"):
+        value = base64.b64decode(value).decode("utf-8")
+    data = json.loads(value)
+    if "version" in data:
+        return data["content"]
+    # Legacy files
+    return data
+
+
+def parse_handle(handle: str):
+    """Returns the node id and the input/output id of an edge handle"""
+    # node ids are uuids
+    return handle[:36], int(handle[37:])
+
+
+def get_filtered_node_ids(
+    nodes: List[Dict[str, Any]],
+    edges: List[Dict[str, Any]],
+    schemata: Dict[str, Schema],
+) -> Set[str]:
+    """
+    Returns the ids of all nodes that would be run by the frontend: nodes that are not
+    (effectively) disabled and that are needed by a node with side effects.
+    """
+    by_id = {node["id"]: node for node in nodes}
+    incoming: Dict[str, List[str]] = {}
+    outgoing: Dict[str, List[str]] = {}
+    for edge in edges:
+        if edge["source"] in by_id and edge["target"] in by_id:
+            incoming.setdefault(edge["target"], []).append(edge["source"])
+            outgoing.setdefault(edge["source"], []).append(edge["target"])
+
+    def memoize(fn: Callable[[str], bool]) -> Callable[[str], bool]:
+        cache: Dict[str, bool] = {}
+
+        def inner(node_id: str) -> bool:
+            if node_id not in cache:
+                cache[node_id] = fn(node_id)
+            return cache[node_id]
+
+        return inner
+
+    @memoize
+    def is_disabled(node_id: str) -> bool:
+        node = by_id[node_id]
+        if node["data"].get("isDisabled", False):
+            return True
+        parent = node.get("parentNode", None)
+        if parent in by_id and is_disabled(parent):
+            return True
+        return any(is_disabled(source) for source in incoming.get(node_id, []))
+
+    @memoize
+    def has_side_effects(node_id: str) -> bool:
+        if schemata[by_id[node_id]["data"]["schemaId"]]["hasSideEffects"]:
+            return True
+        return any(
+            has_side_effects(target)
+            for target in outgoing.get(node_id, [])
+            if not is_disabled(target)
+        )
+
+    return {
+        node_id
+        for node_id in by_id
+        if not is_disabled(node_id) and has_side_effects(node_id)
+    }
+
+
+def convert_to_usable_format(
+    content: Dict[str, Any], schemata: Dict[str, Schema]
+) -> Dict[str, UsableData]:
+    """
+    Converts the nodes and edges of a save file into the format `Executor` runs, the
+    same way the frontend does before sending a chain to /run.
+    """
+    for node in content["nodes"]:
+        schema_id = node["data"]["schemaId"]
+        if schema_id not in schemata:
+            raise ChainError(
+                f"Unknown node {schema_id}. The chain might have been saved by a newer "
+                "version of chaiNNer, or might need to be re-saved by the current one."
+            )
+
+    node_ids = get_filtered_node_ids(content["nodes"], content["edges"], schemata)
+    nodes = [node for node in content["nodes"] if node["id"] in node_ids]
+    edges = [
+        edge
+        for edge in content["edges"]
+        if edge["source"] in node_ids and edge["target"] in node_ids
+    ]
+
+    node_schemata = {node["id"]: schemata[node["data"]["schemaId"]] for node in nodes}
+
+    def convert_handle(handle: str, kind: str) -> Dict[str, Any]:
+        node_id, in_out_id = parse_handle(handle)
+        schema = node_schemata.get(node_id, None)
+        if schema is None:
+            raise ChainError(f"Invalid handle: The node id {node_id} is not valid")
+        for index, in_out in enumerate(schema[kind]):
+            if in_out["id"] == in_out_id:
+                return {"id": node_id, "index": index}
+        raise ChainError(
+            f"Invalid handle: There is no {kind[:-1]} with id {in_out_id} in {schema['name']}"
+        )
+
+    input_handles: Dict[str, Dict[int, Any]] = {}
+    output_handles: Dict[str, Dict[int, Any]] = {}
+    for edge in edges:
+        source_handle = edge.get("sourceHandle", None)
+        target_handle = edge.get("targetHandle", None)
+        if not source_handle or not target_handle:
+            continue
+        source_id, output_id = parse_handle(source_handle)
+        target_id, input_id = parse_handle(target_handle)
+        input_handles.setdefault(target_id, {})[input_id] = convert_handle(
+            source_handle, "outputs"
+        )
+        output_handles.setdefault(source_id, {})[output_id] = convert_handle(
+            target_handle, "inputs"
+        )
+
+    result: Dict[str, UsableData] = {}
+    for node in nodes:
+        node_id = node["id"]
+        schema = node_schemata[node_id]
+        input_data = node["data"].get("inputData", {})
+        usable: Dict[str, Any] = {
+            "schemaId": schema["schemaId"],
+            "id": node_id,
+            "inputs": [
+                input_handles.get(node_id, {}).get(
+                    schema_input["id"], input_data.get(str(schema_input["id"]), None)
+                )
+                for schema_input in schema["inputs"]
+            ],
+            "outputs": [
+                output_handles.get(node_id, {}).get(schema_output["id"], None)
+                for schema_output in schema["outputs"]
+            ],
+            "child": False,
+            "nodeType": node["type"],
+            "hasSideEffects": schema["hasSideEffects"],
+        }
+        if node["type"] == "iterator":
+            usable["children"] = []
+            usable["percent"] = 0
+        result[node_id] = usable  # type: ignore
+
+    for node in nodes:
+        parent = node.get("parentNode", None)
+        if parent:
+            result[parent]["children"].append(node["id"])
+            result[node["id"]]["child"] = True
+
+    return result
+
+
+def read_chain(path: str, schemata: Dict[str, Schema]) -> Dict[str, UsableData]:
+    """
+    Reads a chain to run from the given file.
+
+    The file may be a .chn save file, the body of a request to /run, or just the nodes
+    of such a request.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        value = f.read()
+    if path.lower().endswith(".chn"):
+        return convert_to_usable_format(parse_save_file(value), schemata)
+
+    data = json.loads(value)
+    if "data" in data and isinstance(data["data"], dict):
+        data = data["data"]
+    return data
+
+
+def parse_override_value(value: str) -> Any:
+    """Parses a value given on the command line. Anything that isn't JSON is a string."""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def apply_overrides(
+    nodes: Dict[str, UsableData],
+    schemata: Dict[str, Schema],
+    overrides: List[str],
+):
+    """
+    Replaces the values of node inputs.
+
+    Overrides have the form `<node id>:<input id>=<value>`, e.g. to change the directory
+    of an iterator. Values are parsed as JSON if possible, and used as strings otherwise.
+    """
+    for override in overrides:
+        target, sep, value = override.partition("=")
+        node_id, _, input_id = target.rpartition(":")
+        if not sep or not node_id or not input_id.isdigit():
+            raise ChainError(
+                f"Invalid override {override}, expected <node id>:<input id>=<value>"
+            )
+        node = nodes.get(node_id, None)
+        if node is None:
+            raise ChainError(f"Cannot override input of unknown node {node_id}")
+
+        schema_inputs = schemata[node["schemaId"]]["inputs"]
+        index = next(
+            (i for i, x in enumerate(schema_inputs) if x["id"] == int(input_id)),
+            None,
+        )
+        if index is None:
+            raise ChainError(
+                f"There is no input with id {input_id} in {schemata[node['schemaId']]['name']}"
+            )
+        current = node["inputs"][index]
+        if isinstance(current, dict) and current.get("id", None):
+            raise ChainError(
+                f"Input {input_id} of node {node_id} is connected and cannot be overridden"
+            )
+        node["inputs"][index] = parse_override_value(value)
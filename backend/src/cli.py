@@ -0,0 +1,201 @@
+"""
+Runs a saved chain without starting the server.
+
+    python backend/src/cli.py chain.chn --set <node id>:<input id>=<value> --workers 4
+
+A JSON summary of the run, including how long each node took, is printed to stdout.
+Logs go to stderr. The exit code is 0 if the chain ran successfully and 1 otherwise.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import platform
+import sys
+from json import dumps as stringify
+from typing import Any, Dict, List, Optional
+
+# pylint: disable=unused-import
+import cv2
+from sanic.log import logger
+
+# Remove broken QT env var
+if platform.system() == "Linux":
+    os.environ.pop("QT_QPA_PLATFORM_PLUGIN_PATH", None)
+
+# pylint: disable=wrong-import-position
+from chain import ChainError, apply_overrides, read_chain
+from node_registry import get_schema_cache_path, load_node_registry
+from persistent_cache import create_persistent_cache
+from process import Executor, NodeExecutionError, get_journal_directory
+
+
+def parse_args(args: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Runs a chaiNNer chain without starting the server."
+    )
+    parser.add_argument(
+        "chain",
+        help="a .chn save file, or a JSON file with the body of a request to /run",
+    )
+    parser.add_argument(
+        "--set",
+        dest="overrides",
+        action="append",
+        default=[],
+        metavar="NODE:INPUT=VALUE",
+        help="override the value of a node input, e.g. the directory of an iterator. "
+        "Values are parsed as JSON if possible. Can be given multiple times.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="how many nodes may run at the same time (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--iterations-in-flight",
+        type=int,
+        default=None,
+        help="how many iterations of an iterator may run at the same time (default: 1)",
+    )
+    parser.add_argument(
+        "--skip-finished",
+        action="store_true",
+        help="skip the files an image iterator finished in a previous run",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="skip the images of an image iterator whose saved images are newer than "
+        "them and the files (e.g. models) the chain reads",
+    )
+    parser.add_argument(
+        "--journal-dir",
+        default=get_journal_directory(),
+        help="where iterators record the files they finished "
+        "(default: iterator-journals in CHAINNER_CACHE_DIR, if set)",
+    )
+    parser.add_argument(
+        "--device",
+        choices=["auto", "cpu", "cuda"],
+        default="auto",
+        help="where PyTorch models run (default: cuda if a GPU can be used)",
+    )
+    parser.add_argument("--fp16", action="store_true", help="use half precision")
+    parser.add_argument(
+        "--verbose", action="store_true", help="log debug information to stderr"
+    )
+    return parser.parse_args(args)
+
+
+def get_default_device() -> str:
+    """Returns the device PyTorch models run on if none was chosen"""
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+async def drain(queue: asyncio.Queue):
+    """Discards the events the frontend would be sent"""
+    while True:
+        await queue.get()
+
+
+async def run_chain(
+    nodes: Dict[str, Any],
+    max_workers: Optional[int],
+    max_iterations_in_flight: Optional[int],
+    journal_directory: Optional[str] = None,
+    skip_finished: bool = False,
+    incremental: bool = False,
+) -> Dict[str, Any]:
+    """Runs the given nodes and returns a summary of the run"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    drain_task = loop.create_task(drain(queue))
+
+    executor = Executor(
+        nodes,
+        loop,
+        queue,
+        {},
+        max_workers=max_workers,
+        persistent_cache=create_persistent_cache(),
+        max_iterations_in_flight=max_iterations_in_flight,
+        # Nobody looks at previews
+        has_subscribers=lambda: False,
+        journal_directory=journal_directory,
+        skip_finished=skip_finished,
+        incremental=incremental,
+    )
+    error = None
+    try:
+        await executor.run()
+    except Exception as exception:
+        logger.error(exception, exc_info=True)
+        error = {"message": str(exception), "source": None}
+        if isinstance(exception, NodeExecutionError):
+            error["source"] = {
+                "nodeId": exception.node["id"],
+                "schemaId": exception.node["schemaId"],
+            }
+    finally:
+        drain_task.cancel()
+
+    metrics = executor.metrics.to_dict()
+    return {
+        "success": error is None,
+        "error": error,
+        "seconds": metrics["seconds"],
+        "nodes": [
+            {"id": node_id, "schemaId": nodes[node_id]["schemaId"], **node_metrics}
+            for node_id, node_metrics in metrics["nodes"].items()
+        ],
+    }
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    options = parse_args(args)
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG if options.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s: %(message)s",
+    )
+
+    os.environ["killed"] = "False"
+    os.environ["device"] = (
+        get_default_device() if options.device == "auto" else options.device
+    )
+    os.environ["isFp16"] = str(options.fp16)
+
+    schemata = {
+        schema["schemaId"]: schema
+        for schema in load_node_registry(get_schema_cache_path())
+    }
+    try:
+        nodes = read_chain(options.chain, schemata)
+        apply_overrides(nodes, schemata, options.overrides)
+    except (OSError, ValueError, ChainError) as e:
+        print(stringify({"success": False, "error": {"message": str(e)}}))
+        return 1
+
+    summary = asyncio.run(
+        run_chain(
+            nodes,
+            options.workers,
+            options.iterations_in_flight,
+            journal_directory=options.journal_dir,
+            skip_finished=options.skip_finished,
+            incremental=options.incremental,
+        )
+    )
+    print(stringify(summary))
+    return 0 if summary["success"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
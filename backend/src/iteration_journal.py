@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import json
+import os
+from typing import IO, Optional, Set
+
+from sanic.log import logger
+
+
+class IterationJournal:
+    """
+    Remembers which items (e.g. files) an iterator has finished, so a resumed or repeated
+    run can skip them, no matter in which order the items are found.
+
+    If a path is given, the journal is also written to disk, one JSON string per line,
+    so it survives restarts.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.finished: Set[str] = set()
+        self.__file: Optional[IO[str]] = None
+        if path is not None:
+            self.__load(path)
+
+    def __load(self, path: str):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            complete = data.rfind(b"\n") + 1
+            for line in data[:complete].splitlines():
+                try:
+                    self.finished.add(json.loads(line.decode("utf-8")))
+                except ValueError:
+                    pass
+            if complete < len(data):
+                # The last line is incomplete if the process was killed. It is removed,
+                # so the next item isn't appended to it.
+                with open(path, "r+b") as f:
+                    f.truncate(complete)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to read iteration journal {path}: {e}")
+
+    def __get_file(self) -> Optional[IO[str]]:
+        if self.__file is None and self.path is not None:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self.__file = open(self.path, "a", encoding="utf-8")
+            except OSError as e:
+                logger.warning(f"Failed to open iteration journal {self.path}: {e}")
+                self.path = None
+        return self.__file
+
+    def is_finished(self, item: str) -> bool:
+        return item in self.finished
+
+    def add(self, item: str):
+        """Records that the given item is finished"""
+        self.finished.add(item)
+        f = self.__get_file()
+        if f is not None:
+            f.write(json.dumps(item) + "\n")
+            f.flush()
+
+    def clear(self):
+        """Forgets all finished items, e.g. when an iterator starts over"""
+        self.finished.clear()
+        self.close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Failed to clear iteration journal {self.path}: {e}")
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
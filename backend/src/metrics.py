@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from persistent_cache import get_value_size
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+PAGE_SIZE = resource.getpagesize() if resource is not None else 4096
+
+
+def get_rss_bytes() -> Optional[int]:
+    """Returns the resident set size of the process, if it can be determined"""
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_peak_rss_bytes() -> Optional[int]:
+    """Returns the peak resident set size of the process, if it can be determined"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_peak_vram_bytes() -> Optional[int]:
+    """Returns the peak VRAM allocated by PyTorch, if PyTorch is using the GPU"""
+    # PyTorch is only imported by the nodes that use it
+    torch = sys.modules.get("torch", None)
+    if torch is None or not torch.cuda.is_initialized():
+        return None
+    return torch.cuda.max_memory_allocated()
+
+
+def get_output_size(output: Any) -> Optional[int]:
+    """Returns the size of the given node output, or None if it isn't data"""
+    # e.g. the work a node left running in the background
+    if output is None or isinstance(output, Future):
+        return None
+    return get_value_size(output)
+
+
+def get_delta(before: Optional[int], after: Optional[int]) -> Optional[int]:
+    if before is None or after is None:
+        return None
+    return after - before
+
+
+class NodeMetrics:
+    """
+    What running a node cost, summed over all of its runs (e.g. iterations).
+
+    Memory is measured for the whole process, so nodes running at the same time share
+    their peaks. The peak deltas are how much the peak of the process grew while the
+    node ran, so they point out the nodes that determine how much memory a chain needs.
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.wall_seconds = 0.0
+        self.thread_seconds = 0.0
+        self.output_bytes: Optional[int] = None
+        self.rss_delta_bytes: Optional[int] = None
+        self.peak_rss_delta_bytes: Optional[int] = None
+        self.peak_vram_delta_bytes: Optional[int] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "wallSeconds": self.wall_seconds,
+            "threadSeconds": self.thread_seconds,
+            "outputBytes": self.output_bytes,
+            "rssDeltaBytes": self.rss_delta_bytes,
+            "peakRssDeltaBytes": self.peak_rss_delta_bytes,
+            "peakVramDeltaBytes": self.peak_vram_delta_bytes,
+        }
+
+
+class IteratorMetrics:
+    """The throughput of an iterator"""
+
+    def __init__(self, total: int, start_index: int):
+        self.total = total
+        self.start_index = start_index
+        self.finished = start_index
+        self.start_time = time.perf_counter()
+
+    def items_per_second(self) -> Optional[float]:
+        elapsed = time.perf_counter() - self.start_time
+        done = self.finished - self.start_index
+        if done == 0 or elapsed <= 0:
+            return None
+        return done / elapsed
+
+    def eta_seconds(self) -> Optional[float]:
+        rate = self.items_per_second()
+        if rate is None:
+            return None
+        return (self.total - self.finished) / rate
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "finished": self.finished,
+            "total": self.total,
+            "itemsPerSecond": self.items_per_second(),
+            "etaSeconds": self.eta_seconds(),
+        }
+
+
+def max_optional(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+class MetricsRecorder:
+    """Collects the metrics of all nodes and iterators of a run"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.nodes: Dict[str, NodeMetrics] = {}
+        self.iterators: Dict[str, IteratorMetrics] = {}
+        # The children of iterators that only ran once for all iterations
+        self.hoisted: Dict[str, List[str]] = {}
+        self.start_time = time.perf_counter()
+
+    def __get(self, node_id: str) -> NodeMetrics:
+        metrics = self.nodes.get(node_id, None)
+        if metrics is None:
+            metrics = NodeMetrics()
+            self.nodes[node_id] = metrics
+        return metrics
+
+    def measure(self, node_id: str, fn: Callable[[], Any]) -> Any:
+        """Calls the given function, and records what it cost as a run of the node"""
+        rss = get_rss_bytes()
+        peak_rss = get_peak_rss_bytes()
+        peak_vram = get_peak_vram_bytes()
+        thread_start = time.thread_time()
+        wall_start = time.perf_counter()
+
+        output = fn()
+
+        wall = time.perf_counter() - wall_start
+        thread = time.thread_time() - thread_start
+        rss_delta = get_delta(rss, get_rss_bytes())
+        peak_rss_delta = get_delta(peak_rss, get_peak_rss_bytes())
+        peak_vram_delta = get_delta(peak_vram, get_peak_vram_bytes())
+        # Measuring large outputs takes a while, so it isn't done on the event loop
+        output_bytes = get_output_size(output)
+        with self.__lock:
+            metrics = self.__get(node_id)
+            metrics.runs += 1
+            metrics.output_bytes = output_bytes
+            metrics.wall_seconds += wall
+            metrics.thread_seconds += thread
+            metrics.rss_delta_bytes = max_optional(metrics.rss_delta_bytes, rss_delta)
+            metrics.peak_rss_delta_bytes = max_optional(
+                metrics.peak_rss_delta_bytes, peak_rss_delta
+            )
+            metrics.peak_vram_delta_bytes = max_optional(
+                metrics.peak_vram_delta_bytes, peak_vram_delta
+            )
+        return output
+
+    def add_wall_time(self, node_id: str, seconds: float):
+        """Records a run of a node that doesn't run on a worker thread (e.g. iterators)"""
+        with self.__lock:
+            metrics = self.__get(node_id)
+            metrics.runs += 1
+            metrics.wall_seconds += seconds
+
+    def set_output(self, node_id: str, output: Any):
+        """Records the size of an output that wasn't computed by `measure`"""
+        size = get_output_size(output)
+        with self.__lock:
+            self.__get(node_id).output_bytes = size
+
+    def start_iterator(self, iterator_id: str, total: int, start_index: int):
+        with self.__lock:
+            self.iterators[iterator_id] = IteratorMetrics(total, start_index)
+
+    def set_iterator_progress(self, iterator_id: str, finished: int, total: int):
+        with self.__lock:
+            iterator = self.iterators.get(iterator_id, None)
+            if iterator is not None:
+                iterator.finished = finished
+                iterator.total = total
+
+    def set_hoisted(self, iterator_id: str, node_ids: List[str]):
+        with self.__lock:
+            self.hoisted[iterator_id] = list(node_ids)
+
+    def __get_iterator(self, node_id: str) -> Optional[Dict[str, Any]]:
+        iterator = self.iterators.get(node_id, None)
+        if iterator is None:
+            return None
+        data = iterator.to_dict()
+        if node_id in self.hoisted:
+            data["hoistedNodes"] = self.hoisted[node_id]
+        return data
+
+    def get_node(self, node_id: str) -> Dict[str, Any]:
+        with self.__lock:
+            data = self.__get(node_id).to_dict()
+            iterator = self.__get_iterator(node_id)
+            if iterator is not None:
+                data["iterator"] = iterator
+            return data
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.__lock:
+            nodes = {}
+            for node_id, metrics in self.nodes.items():
+                nodes[node_id] = metrics.to_dict()
+            for node_id in self.iterators:
+                nodes.setdefault(node_id, NodeMetrics().to_dict())
+                nodes[node_id]["iterator"] = self.__get_iterator(node_id)
+            return {
+                "seconds": time.perf_counter() - self.start_time,
+                "nodes": nodes,
+            }
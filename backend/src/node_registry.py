@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import hashlib
+import importlib
+import importlib.metadata
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+from sanic.log import logger
+
+from nodes.categories import category_order
+from nodes.node_factory import NodeFactory
+
+# Bump this whenever the format of the schema cache changes
+SCHEMA_CACHE_VERSION = 1
+
+# Node modules in the order they are registered, with the backends they need
+NODE_MODULES: Dict[str, List[str]] = {
+    "nodes.image_adj_nodes": [],
+    "nodes.image_chan_nodes": [],
+    "nodes.image_dim_nodes": [],
+    "nodes.image_filter_nodes": [],
+    "nodes.image_iterator_nodes": [],
+    "nodes.image_nodes": [],
+    "nodes.image_util_nodes": [],
+    "nodes.pytorch_nodes": ["torch"],
+    "nodes.onnx_nodes": ["onnx", "onnxruntime"],
+    "nodes.ncnn_nodes": ["ncnn_vulkan"],
+    "nodes.utility_nodes": [],
+}
+
+# Installed packages whose version may change which nodes are available
+DISTRIBUTIONS = [
+    "torch",
+    "onnx",
+    "onnxruntime",
+    "onnxruntime-gpu",
+    "ncnn-vulkan",
+    "opencv-python",
+    "numpy",
+    "Pillow",
+]
+
+
+def import_node_modules() -> Dict[str, str]:
+    """
+    Imports all node modules. Modules whose backend is not installed are skipped.
+
+    Returns the module that has to be imported to register each node.
+    """
+    node_modules: Dict[str, str] = {}
+    for module, backends in NODE_MODULES.items():
+        # Decorators (e.g. `torch.inference_mode`) may change the `__module__` of node
+        # classes, so the nodes a module registered are found by comparing registries
+        before = set(NodeFactory.get_registry())
+        try:
+            for backend in backends:
+                importlib.import_module(backend)
+            importlib.import_module(module)
+        except Exception as e:
+            if len(backends) == 0:
+                raise
+            logger.warning(e)
+            logger.info(f"{', '.join(backends)} most likely not installed")
+        for schema_id in NodeFactory.get_registry():
+            if schema_id not in before:
+                node_modules[schema_id] = module
+    return node_modules
+
+
+def get_node_schema(schema_id: str) -> Dict[str, Any]:
+    """Returns the information about a node that the frontend needs"""
+    node_object = NodeFactory.create_node(schema_id)
+    node_dict = {
+        "schemaId": schema_id,
+        "name": node_object.get_name(),
+        "category": node_object.get_category(),
+        "inputs": [x.toDict() for x in node_object.get_inputs(with_implicit_ids=True)],
+        "outputs": [
+            x.toDict() for x in node_object.get_outputs(with_implicit_ids=True)
+        ],
+        "description": node_object.get_description(),
+        "icon": node_object.get_icon(),
+        "subcategory": node_object.get_sub_category(),
+        "nodeType": node_object.get_type(),
+        "hasSideEffects": node_object.get_has_side_effects(),
+    }
+    if node_object.get_type() == "iterator":
+        node_dict["defaultNodes"] = node_object.get_default_nodes()  # type: ignore
+    return node_dict
+
+
+def get_node_schemas() -> List[Dict[str, Any]]:
+    """Returns the schemas of all registered nodes, sorted in category order"""
+    schemas = [get_node_schema(schema_id) for schema_id in NodeFactory.get_registry()]
+    # sort nodes in category order
+    schemas.sort(key=lambda schema: category_order.index(schema["category"]))
+    return schemas
+
+
+def get_fingerprint() -> str:
+    """
+    Returns a hash of everything that determines the node schemas: the source code of
+    the backend and the versions of the installed packages.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(f"{SCHEMA_CACHE_VERSION} {sys.version}".encode("utf-8"))
+    for distribution in DISTRIBUTIONS:
+        try:
+            version = importlib.metadata.version(distribution)
+        except importlib.metadata.PackageNotFoundError:
+            version = None
+        hasher.update(f"{distribution}={version}".encode("utf-8"))
+
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(".py"):
+                stat = os.stat(os.path.join(root, name))
+                path = os.path.relpath(os.path.join(root, name), source_dir)
+                hasher.update(f"{path} {stat.st_mtime_ns} {stat.st_size}".encode())
+    return hasher.hexdigest()
+
+
+def load_schema_cache(path: str, fingerprint: str) -> Optional[List[Dict[str, Any]]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cache.get("fingerprint", None) != fingerprint:
+        return None
+    return cache["nodes"]
+
+
+def save_schema_cache(path: str, fingerprint: str, nodes: List[Dict[str, Any]]):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint, "nodes": nodes}, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning(f"Failed to write node schema cache: {e}")
+
+
+def get_user_cache_directory() -> str:
+    """Returns the directory of chaiNNer in the cache directory of the user"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", None) or os.path.expanduser(
+            "~\\AppData\\Local"
+        )
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", None) or os.path.expanduser("~/.cache")
+    return os.path.join(base, "chaiNNer")
+
+
+def get_schema_cache_path() -> Optional[str]:
+    """
+    Returns where the node schemas are cached, if anywhere. Setting
+    CHAINNER_SCHEMA_CACHE to an empty string turns the cache off.
+    """
+    if "CHAINNER_SCHEMA_CACHE" in os.environ:
+        return os.environ["CHAINNER_SCHEMA_CACHE"] or None
+    cache_dir = os.environ.get("CHAINNER_CACHE_DIR", None) or get_user_cache_directory()
+    return os.path.join(cache_dir, "node-schemas.json")
+
+
+def load_node_registry(cache_path: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Registers all nodes and returns their schemas.
+
+    If a schema cache from a previous start with the same source code and packages
+    exists, nodes are only registered lazily: their modules, and the backends they
+    need, are imported when a node is first created.
+    """
+    fingerprint = None
+    if cache_path is not None:
+        fingerprint = get_fingerprint()
+        cached = load_schema_cache(cache_path, fingerprint)
+        if cached is not None:
+            logger.info(f"Using node schema cache {cache_path}")
+            for node in cached:
+                NodeFactory.register_lazy(node["schemaId"], node["module"])
+            return [node["schema"] for node in cached]
+
+    node_modules = import_node_modules()
+    schemas = get_node_schemas()
+
+    if cache_path is not None and fingerprint is not None:
+        save_schema_cache(
+            cache_path,
+            fingerprint,
+            [
+                {
+                    "schemaId": schema["schemaId"],
+                    "module": node_modules[schema["schemaId"]],
+                    "schema": schema,
+                }
+                for schema in schemas
+            ],
+        )
+    return schemas
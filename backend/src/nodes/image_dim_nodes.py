@@ -11,6 +11,7 @@ from .node_factory import NodeFactory
 from .properties.inputs import *
 from .properties.outputs import *
 from .utils.fill_alpha import *
+from .utils.image_utils import COMPACT_DTYPES
 from .utils.tile_util import tile_image
 from .utils.pil_utils import *
 from .utils.utils import get_h_w_c
@@ -140,7 +141,7 @@ class CropNode(NodeBase):
         super().__init__()
         self.description = "Crop an image based on offset from the top-left corner, and the wanted resolution."
         self.inputs = [
-            ImageInput(),
+            ImageInput(accepted_dtypes=COMPACT_DTYPES),
             NumberInput("Top Offset", unit="px"),
             NumberInput("Left Offset", unit="px"),
             NumberInput("Height", unit="px"),
@@ -181,7 +182,7 @@ class BorderCropNode(NodeBase):
             "Crop an image based on a constant border margin around the entire image."
         )
         self.inputs = [
-            ImageInput(),
+            ImageInput(accepted_dtypes=COMPACT_DTYPES),
             NumberInput("Amount", unit="px"),
         ]
         self.outputs = [
@@ -219,7 +220,7 @@ class EdgeCropNode(NodeBase):
         super().__init__()
         self.description = "Crop an image using separate amounts from each edge."
         self.inputs = [
-            ImageInput(),
+            ImageInput(accepted_dtypes=COMPACT_DTYPES),
             NumberInput("Top", unit="px"),
             NumberInput("Left", unit="px"),
             NumberInput("Right", unit="px"),
@@ -310,7 +311,7 @@ class GetDimensionsNode(NodeBase):
             "Get the Height, Width, and number of Channels from an image."
         )
         self.inputs = [
-            ImageInput(),
+            ImageInput(accepted_dtypes=COMPACT_DTYPES),
         ]
         self.outputs = [
             NumberOutput("Width", output_type="Input0.width"),
@@ -1,20 +1,44 @@
 from __future__ import annotations
 
+import asyncio
 import math
 import os
+import threading
+from typing import (
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Set,
+    TypeVar,
+    Union,
+)
 
 import numpy as np
-from process import Executor, ExecutionContext
+from process import ExecutionContext
 from sanic.log import logger
 
 from .categories import IMAGE
-from .image_nodes import ImReadNode
+from .image_nodes import ImReadNode, split_image_path
 from .node_base import IteratorNodeBase, NodeBase
 from .node_factory import NodeFactory
 from .properties.inputs import *
 from .properties.outputs import *
-from .utils.image_utils import get_available_image_formats, normalize
+from .utils.image_utils import (
+    COMPACT_DTYPES,
+    compact,
+    get_available_image_formats,
+    to_uint8,
+)
 from .utils.utils import get_h_w_c
+from .utils.video_utils import (
+    FfmpegVideoBackend,
+    OpenCvVideoBackend,
+    VideoEncoder,
+    VideoReader,
+    VideoWriter,
+)
 
 IMAGE_ITERATOR_NODE_ID = "chainner:image:file_iterator_load"
 
@@ -24,6 +48,92 @@ VIDEO_ITERATOR_OUTPUT_NODE_ID = "chainner:image:simple_video_frame_iterator_save
 SPRITESHEET_ITERATOR_INPUT_NODE_ID = "chainner:image:spritesheet_iterator_load"
 SPRITESHEET_ITERATOR_OUTPUT_NODE_ID = "chainner:image:spritesheet_iterator_save"
 
+T = TypeVar("T")
+
+SCAN_CHUNK_SIZE = 256
+"""How many files are found before they are handed to the iterator"""
+
+
+def scan_files(
+    directory: str,
+    extensions: Set[str],
+    on_error: Callable[[OSError], None],
+) -> Iterator[List[str]]:
+    """
+    Finds all files with one of the given extensions in the directory and its
+    subdirectories, in the same order as `os.walk`.
+
+    Files are returned in chunks as they are found, so they can be processed before the
+    whole directory was scanned.
+    """
+    stack = [directory]
+    while stack:
+        root = stack.pop()
+        subdirectories: List[str] = []
+        chunk: List[str] = []
+        try:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    try:
+                        # Like os.walk, don't follow symbolic links to directories
+                        if entry.is_dir() and not entry.is_symlink():
+                            subdirectories.append(entry.path)
+                            continue
+                    except OSError:
+                        pass
+                    _base, ext = os.path.splitext(entry.name)
+                    if ext.lower() in extensions:
+                        chunk.append(entry.path)
+                        if len(chunk) >= SCAN_CHUNK_SIZE:
+                            yield chunk
+                            chunk = []
+        except OSError as e:
+            on_error(e)
+        if chunk:
+            yield chunk
+        stack.extend(reversed(subdirectories))
+
+
+class BackgroundIterator:
+    """Iterates over chunks of items on another thread, e.g. to find files"""
+
+    def __init__(self, chunks: Iterable[List[T]], loop: asyncio.AbstractEventLoop):
+        self.__queue: asyncio.Queue = asyncio.Queue()
+        self.__stopped = threading.Event()
+        self.__loop = loop
+        threading.Thread(target=self.__produce, args=(chunks,), daemon=True).start()
+
+    def __put(self, value):
+        try:
+            self.__loop.call_soon_threadsafe(self.__queue.put_nowait, value)
+        except RuntimeError:
+            # The event loop was closed
+            self.__stopped.set()
+
+    def __produce(self, chunks: Iterable[List[T]]):
+        try:
+            for chunk in chunks:
+                if self.__stopped.is_set():
+                    return
+                self.__put(chunk)
+        except Exception as e:
+            self.__put(e)
+        finally:
+            self.__put(None)
+
+    def stop(self):
+        self.__stopped.set()
+
+    async def __aiter__(self) -> AsyncIterator[T]:
+        while True:
+            chunk = await self.__queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            for item in chunk:
+                yield item
+
 
 @NodeFactory.register(IMAGE_ITERATOR_NODE_ID)
 class ImageFileIteratorLoadImageNode(NodeBase):
@@ -45,6 +155,12 @@ class ImageFileIteratorLoadImageNode(NodeBase):
 
         self.side_effects = True
 
+    def predict_outputs(
+        self, directory: str = "", root_dir: str = ""
+    ) -> Tuple[None, str, str, str]:
+        dirname, basename = split_image_path(directory)
+        return None, root_dir, os.path.relpath(dirname, root_dir), basename
+
     def run(
         self, directory: str = "", root_dir: str = ""
     ) -> Tuple[np.ndarray, str, str, str]:
@@ -92,62 +208,58 @@ class ImageFileIteratorNode(IteratorNodeBase):
             context.nodes[k]["child"] = False
         assert img_path_node_id is not None, "Unable to find image iterator helper node"
 
-        supported_filetypes = get_available_image_formats()
+        supported_filetypes = set(get_available_image_formats())
 
         def walk_error_handler(exception_instance):
             logger.warning(
                 f"Exception occurred during walk: {exception_instance} Continuing..."
             )
 
-        just_image_files = []
-        for root, _dirs, files in os.walk(
-            directory, topdown=True, onerror=walk_error_handler
-        ):
-            if context.executor.should_stop_running():
-                return
-
-            for name in files:
-                filepath = os.path.join(root, name)
-                _base, ext = os.path.splitext(filepath)
-                if ext.lower() in supported_filetypes:
-                    just_image_files.append(filepath)
-
-        file_len = len(just_image_files)
-        start_idx = math.ceil(float(context.percent) * file_len)
-        for idx, filepath in enumerate(just_image_files):
-            if context.executor.should_stop_running():
-                return
-            if idx >= start_idx:
-                await context.queue.put(
-                    {
-                        "event": "iterator-progress-update",
-                        "data": {
-                            "percent": idx / file_len,
-                            "iteratorId": context.iterator_id,
-                            "running": child_nodes,
-                        },
-                    }
-                )
-                # Replace the input filepath with the filepath from the loop
-                context.nodes[img_path_node_id]["inputs"] = [filepath, directory]
-                executor = Executor(
-                    context.nodes,
-                    context.loop,
-                    context.queue,
-                    context.cache.copy(),
-                    parent_executor=context.executor,
-                )
-                await executor.run()
-                await context.queue.put(
-                    {
-                        "event": "iterator-progress-update",
-                        "data": {
-                            "percent": (idx + 1) / file_len,
-                            "iteratorId": context.iterator_id,
-                            "running": None,
-                        },
-                    }
-                )
+        # Files that were finished before the run was paused (or by a previous run) are
+        # skipped no matter where they are found, so files may be added or removed
+        journal = context.get_journal(os.path.abspath(directory))
+        found = 0
+        skipped = 0
+        up_to_date = 0
+
+        async def iterations():
+            nonlocal found, skipped, up_to_date
+            files = BackgroundIterator(
+                scan_files(directory, supported_filetypes, walk_error_handler),
+                context.loop,
+            )
+            try:
+                async for filepath in files:
+                    if journal.is_finished(filepath):
+                        skipped += 1
+                        continue
+                    node_inputs = {img_path_node_id: [filepath, directory]}
+                    # Like make, images whose saved outputs are newer are skipped
+                    # without loading them
+                    if context.executor.incremental and context.is_up_to_date(
+                        node_inputs, [filepath]
+                    ):
+                        up_to_date += 1
+                        continue
+                    found += 1
+                    yield node_inputs
+            finally:
+                files.stop()
+
+        # Iterating starts as soon as the first image is found, so the number of images
+        # grows until the whole directory was scanned
+        await context.run_iterations(
+            iterations(),
+            lambda: found,
+            child_nodes,
+            on_finished=lambda node_inputs: journal.add(
+                node_inputs[img_path_node_id][0]
+            ),
+        )
+        if skipped > 0:
+            logger.info(f"Skipped {skipped} images that were already finished")
+        if up_to_date > 0:
+            logger.info(f"Skipped {up_to_date} images whose outputs are up to date")
 
 
 @NodeFactory.register(VIDEO_ITERATOR_INPUT_NODE_ID)
@@ -168,7 +280,7 @@ class VideoFrameIteratorFrameLoaderNode(NodeBase):
         self.side_effects = True
 
     def run(self, img: np.ndarray, idx: int) -> Tuple[np.ndarray, int]:
-        return normalize(img), idx
+        return compact(img), idx
 
 
 @NodeFactory.register(VIDEO_ITERATOR_OUTPUT_NODE_ID)
@@ -177,10 +289,13 @@ class VideoFrameIteratorFrameWriterNode(NodeBase):
         super().__init__()
         self.description = ""
         self.inputs = [
-            ImageInput("Frame"),
+            ImageInput("Frame", accepted_dtypes=COMPACT_DTYPES),
             DirectoryInput("Output Video Directory"),
             TextInput("Output Video Name"),
             VideoTypeDropdown(),
+            VideoEncoderDropdown(),
+            NumberInput("Quality (CRF, FFmpeg)", default=23, minimum=0, maximum=63),
+            VideoPixelFormatDropdown(),
         ]
         self.outputs = []
 
@@ -199,32 +314,40 @@ class VideoFrameIteratorFrameWriterNode(NodeBase):
         save_dir: str,
         video_name: str,
         video_type: str,
+        encoder: Union[str, None],
+        crf: int,
+        pixel_format: Union[str, None],
         writer,
         fps,
     ) -> None:
+        if video_type == "none":
+            return
+
         h, w, _ = get_h_w_c(img)
-        if writer["out"] is None and video_type != "none":
-            mp4_codec = "avc1"
-            avi_codec = "divx"
-            codec = mp4_codec if video_type == "mp4" else avi_codec
-            try:
-                logger.info(f"Trying to open writer with codec: {codec}")
-                fourcc = cv2.VideoWriter_fourcc(*codec)
-                video_save_path = os.path.join(save_dir, f"{video_name}.{video_type}")
-                logger.info(f"Writing new video to path: {video_save_path}")
-                writer["out"] = cv2.VideoWriter(
-                    filename=video_save_path,
-                    fourcc=fourcc,
-                    fps=fps,
-                    frameSize=(w, h),
+        if writer["out"] is None:
+            video_save_path = os.path.join(save_dir, f"{video_name}.{video_type}")
+            logger.info(f"Writing new video to path: {video_save_path}")
+            if encoder is None or encoder == VideoEncoder.OPENCV:
+                backend = OpenCvVideoBackend(video_save_path, video_type, fps, w, h)
+            else:
+                backend = FfmpegVideoBackend(
+                    video_save_path,
+                    fps,
+                    w,
+                    h,
+                    codec=encoder,
+                    crf=int(crf),
+                    pixel_format=pixel_format or "yuv420p",
                 )
-                logger.info(writer["out"])
-            except Exception as e:
-                logger.warning(
-                    f"Failed to open video writer with codec: {codec} because: {e}"
-                )
-        if video_type != "none":
-            writer["out"].write((img * 255).astype(np.uint8))
+            writer["out"] = VideoWriter(backend)
+
+        frame = to_uint8(img)
+        c = get_h_w_c(frame)[2]
+        if c == 1:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        elif c == 4:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+        writer["out"].write(frame)
 
 
 @NodeFactory.register("chainner:image:video_frame_iterator")
@@ -272,61 +395,36 @@ class SimpleVideoFrameIteratorNode(IteratorNodeBase):
         assert input_node_id is not None, "Unable to find video frame load helper node"
         assert output_node_id is not None, "Unable to find video frame save helper node"
 
-        # TODO: Open Video Buffer
-        cap = cv2.VideoCapture(path)
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
+        # Frames are decoded and encoded on background threads, so both overlap with
+        # running the nodes of the iterator
+        reader = VideoReader(path)
+        fps = reader.fps
+        frame_count = reader.frame_count
 
         writer = {"out": None}
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         start_idx = math.ceil(float(context.percent) * frame_count)
-        context.nodes[output_node_id]["inputs"].extend((writer, fps))
-        for idx in range(frame_count):
-            if context.executor.should_stop_running():
-                cap.release()
-                if writer["out"] is not None:
-                    writer["out"].release()
-                return
-            ret, frame = cap.read()
-            # if frame is read correctly ret is True
-            if not ret:
-                print("Can't receive frame (stream end?). Exiting ...")
-                break
-            if idx >= start_idx:
-                await context.queue.put(
-                    {
-                        "event": "iterator-progress-update",
-                        "data": {
-                            "percent": idx / frame_count,
-                            "iteratorId": context.iterator_id,
-                            "running": child_nodes,
-                        },
-                    }
-                )
-                context.nodes[input_node_id]["inputs"] = [frame, idx]
-                external_cache_copy = context.cache.copy()
-                executor = Executor(
-                    context.nodes,
-                    context.loop,
-                    context.queue,
-                    external_cache_copy,
-                    parent_executor=context.executor,
-                )
-                await executor.run()
-                del external_cache_copy
-                await context.queue.put(
-                    {
-                        "event": "iterator-progress-update",
-                        "data": {
-                            "percent": (idx + 1) / frame_count,
-                            "iteratorId": context.iterator_id,
-                            "running": None,
-                        },
-                    }
-                )
-
-        cap.release()
-        if writer["out"] is not None:
-            writer["out"].release()
+        writer_inputs = [*context.nodes[output_node_id]["inputs"], writer, fps]
+        try:
+            for idx in range(frame_count):
+                if context.executor.should_stop_running():
+                    return
+                frame = await context.loop.run_in_executor(None, reader.read)
+                if frame is None:
+                    logger.info("Can't receive frame (stream end?). Exiting ...")
+                    break
+                if idx >= start_idx:
+                    await context.put_progress(idx, frame_count, child_nodes)
+                    await context.run_iteration(
+                        {
+                            input_node_id: [frame, idx],
+                            output_node_id: writer_inputs,
+                        }
+                    )
+                    await context.put_progress(idx + 1, frame_count, None)
+        finally:
+            reader.close()
+            if writer["out"] is not None:
+                await context.loop.run_in_executor(None, writer["out"].close)
 
 
 @NodeFactory.register(SPRITESHEET_ITERATOR_INPUT_NODE_ID)
@@ -459,41 +557,18 @@ class ImageSpriteSheetIteratorNode(IteratorNodeBase):
         length = len(img_list)
 
         results = []
-        context.nodes[output_node_id]["inputs"].append(results)
+        output_inputs = [*context.nodes[output_node_id]["inputs"], results]
         for idx, img in enumerate(img_list):
             if context.executor.should_stop_running():
                 break
-            await context.queue.put(
-                {
-                    "event": "iterator-progress-update",
-                    "data": {
-                        "percent": idx / length,
-                        "iteratorId": context.iterator_id,
-                        "running": child_nodes,
-                    },
-                }
-            )
-            # Replace the input filepath with the filepath from the loop
-            context.nodes[img_loader_node_id]["inputs"] = [img]
-            # logger.info(nodes[output_node_id]["inputs"])
-            executor = Executor(
-                context.nodes,
-                context.loop,
-                context.queue,
-                context.cache.copy(),
-                parent_executor=context.executor,
-            )
-            await executor.run()
-            await context.queue.put(
+            await context.put_progress(idx, length, child_nodes)
+            await context.run_iteration(
                 {
-                    "event": "iterator-progress-update",
-                    "data": {
-                        "percent": (idx + 1) / length,
-                        "iteratorId": context.iterator_id,
-                        "running": None,
-                    },
+                    img_loader_node_id: [img],
+                    output_node_id: output_inputs,
                 }
             )
+            await context.put_progress(idx + 1, length, None)
         result_rows = []
         for i in range(rows):
             row = np.concatenate(results[i * columns : (i + 1) * columns], axis=1)
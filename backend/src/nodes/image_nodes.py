@@ -8,6 +8,7 @@ import os
 import platform
 import subprocess
 import time
+from concurrent.futures import Future
 from tempfile import mkdtemp
 
 import cv2
@@ -21,15 +22,35 @@ from .node_factory import NodeFactory
 from .properties.inputs import *
 from .properties.outputs import *
 from .utils.image_utils import (
+    COMPACT_DTYPES,
+    compact,
     get_opencv_formats,
     get_pil_formats,
-    normalize,
     preview_encode,
+    to_uint8,
 )
+from .utils.image_writer import get_encode_params, get_image_writer
 from .utils.pil_utils import *
 from .utils.utils import get_h_w_c
 
 
+def get_save_path(
+    base_directory: str,
+    relative_path: Union[str, None],
+    filename: str,
+    extension: str,
+) -> str:
+    if relative_path and relative_path != ".":
+        base_directory = os.path.join(base_directory, relative_path)
+    return os.path.join(base_directory, f"{filename}.{extension}")
+
+
+def split_image_path(path: str) -> Tuple[str, str]:
+    """Returns the directory and the name without extension of an image file"""
+    dirname, basename = os.path.split(os.path.splitext(path)[0])
+    return dirname, basename
+
+
 @NodeFactory.register("chainner:image:load")
 class ImReadNode(NodeBase):
     def __init__(self):
@@ -46,12 +67,9 @@ class ImReadNode(NodeBase):
         self.name = "Load Image"
         self.icon = "BsFillImageFill"
         self.sub = "Input & Output"
-        self.result = None
 
-    def get_extra_data(self) -> Dict:
-        assert self.result is not None
-
-        img, dirname, basename = self.result
+    def get_extra_data(self, output: Tuple[np.ndarray, str, str]) -> Dict:
+        img, dirname, basename = output
         h, w, c = get_h_w_c(img)
 
         base64_img = preview_encode(img)
@@ -69,6 +87,8 @@ class ImReadNode(NodeBase):
         """Reads an image from the specified path and return it as a numpy array"""
 
         logger.info(f"Reading image from path: {path}")
+        # The image may have been saved by this chain
+        get_image_writer().wait_for(path)
         _base, ext = os.path.splitext(path)
         if ext.lower() in get_opencv_formats():
             try:
@@ -104,11 +124,11 @@ class ImReadNode(NodeBase):
         #     alpha_channel = img[:, :, 1]
         #     img = np.dstack(color_channel, color_channel, color_channel, alpha_channel)
 
-        img = normalize(img)
+        # Images are only converted to float32 by the nodes that need it
+        img = compact(img)
 
-        dirname, basename = os.path.split(os.path.splitext(path)[0])
-        self.result = (img, dirname, basename)
-        return self.result
+        dirname, basename = split_image_path(path)
+        return img, dirname, basename
 
 
 @NodeFactory.register("chainner:image:save")
@@ -117,11 +137,14 @@ class ImWriteNode(NodeBase):
         super().__init__()
         self.description = "Save image to file at a specified directory."
         self.inputs = [
-            ImageInput(),
+            ImageInput(accepted_dtypes=COMPACT_DTYPES),
             DirectoryInput(has_handle=True),
             TextInput("Relative Path").make_optional(),
             TextInput("Image Name"),
             ImageExtensionDropdown(),
+            SliderInput("Quality (JPEG/WebP)", minimum=0, maximum=100, default=95),
+            SliderInput("PNG Compression", minimum=0, maximum=9, default=1),
+            TiffCompressionDropdown(),
         ]
         self.category = IMAGE
         self.name = "Save Image"
@@ -131,6 +154,17 @@ class ImWriteNode(NodeBase):
 
         self.side_effects = True
 
+    def get_written_files(
+        self,
+        _img: None,
+        base_directory: str,
+        relative_path: Union[str, None],
+        filename: str,
+        extension: str,
+        *_encoder_settings,
+    ) -> List[str]:
+        return [get_save_path(base_directory, relative_path, filename, extension)]
+
     def run(
         self,
         img: np.ndarray,
@@ -138,27 +172,23 @@ class ImWriteNode(NodeBase):
         relative_path: Union[str, None],
         filename: str,
         extension: str,
-    ) -> bool:
-        """Write an image to the specified path and return write status"""
+        quality: int,
+        png_compression: int,
+        tiff_compression: int,
+    ) -> Future:
+        """
+        Write an image to the specified path in the background and return the future of
+        the write
+        """
 
-        full_file = f"{filename}.{extension}"
-        if relative_path and relative_path != ".":
-            base_directory = os.path.join(base_directory, relative_path)
-        full_path = os.path.join(base_directory, full_file)
+        full_path = get_save_path(base_directory, relative_path, filename, extension)
 
         logger.info(f"Writing image to path: {full_path}")
 
-        # Put image back in int range
-        img = (np.clip(img, 0, 1) * 255).round().astype("uint8")
-
-        os.makedirs(base_directory, exist_ok=True)
-
-        status, buf_img = cv2.imencode(f".{extension}", img)
-        with open(full_path, "wb") as outf:
-            bytes_written = outf.write(buf_img)
-            status = status and bytes_written == len(buf_img)
-
-        return status
+        params = get_encode_params(
+            extension, int(quality), int(png_compression), int(tiff_compression)
+        )
+        return get_image_writer().write(full_path, img, extension, params)
 
 
 @NodeFactory.register("chainner:image:preview")
@@ -166,7 +196,7 @@ class ImOpenNode(NodeBase):
     def __init__(self):
         super().__init__()
         self.description = "Open the image in your default image viewer."
-        self.inputs = [ImageInput()]
+        self.inputs = [ImageInput(accepted_dtypes=COMPACT_DTYPES)]
         self.outputs = []
         self.category = IMAGE
         self.name = "Preview Image"
@@ -179,7 +209,7 @@ class ImOpenNode(NodeBase):
         """Show image"""
 
         # Put image back in int range
-        img = (np.clip(img, 0, 1) * 255).round().astype("uint8")
+        img = to_uint8(img)
 
         tempdir = mkdtemp(prefix="chaiNNer-")
         logger.info(f"Writing image to temp path: {tempdir}")
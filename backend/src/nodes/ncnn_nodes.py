@@ -5,9 +5,7 @@ from __future__ import annotations
 
 import os
 import re
-import struct
-import tempfile
-from typing import Tuple
+from typing import Tuple, Union
 
 import numpy as np
 from ncnn_vulkan import ncnn
@@ -19,7 +17,9 @@ from .node_factory import NodeFactory
 from .properties.inputs import *
 from .properties.outputs import *
 from .utils.ncnn_auto_split import ncnn_auto_split_process
-from .utils.ncnn_parsers import FLAG_FLOAT_16, FLAG_FLOAT_32, parse_ncnn_bin_from_buffer
+from .utils.ncnn_net_pool import PooledNet, net_pool, pack_ncnn_bin
+from .utils.ncnn_parsers import parse_ncnn_bin_from_buffer
+from .utils.tiler import TileBlend, check_tile_overlap
 from .utils.utils import get_h_w_c, convenient_upscale
 
 
@@ -132,12 +132,8 @@ class NcnnSaveNode(NodeBase):
         full_param_path = os.path.join(directory, full_param)
 
         logger.info(f"Writing NCNN model to paths: {full_bin_path} {full_param_path}")
-        is_fp16 = net.bin_data.dtype == np.float16
-        flag = FLAG_FLOAT_16 if is_fp16 else FLAG_FLOAT_32
-        dtype = np.float16 if is_fp16 else np.float32
-        packed = struct.pack("<I", flag) + net.bin_data.astype(dtype).tobytes("F")
         with open(full_bin_path, "wb") as binary_file:
-            binary_file.write(packed)
+            binary_file.write(pack_ncnn_bin(net.bin_data))
         with open(full_param_path, "w", encoding="utf-8") as param_file:
             with open(net.param_path, "r", encoding="utf-8") as original_param_file:
                 param_file.write(original_param_file.read())
@@ -149,11 +145,15 @@ class NcnnSaveNode(NodeBase):
 class NcnnUpscaleImageNode(NodeBase):
     def __init__(self):
         super().__init__()
-        self.description = "Upscale an image with NCNN. Unlike PyTorch, NCNN has GPU support on all devices, assuming your drivers support Vulkan."
+        self.description = "Upscale an image with NCNN. Unlike PyTorch, NCNN has GPU support on all devices, assuming your drivers support Vulkan. \
+            The image is upscaled in tiles of the given size, which overlap and are blended together. \
+            Setting the tile size to 0 will split the image automatically."
         self.inputs = [
             NcnnNetInput(),
             ImageInput(),
-            NumberInput("Tile Size Target", default=0, minimum=0, maximum=None),
+            NumberInput("Tile Size", default=0, minimum=0, maximum=None, unit="px"),
+            NumberInput("Tile Overlap", default=16, minimum=0, maximum=None, unit="px"),
+            TileBlendInput(),
         ]
         self.outputs = [
             ImageOutput(
@@ -170,25 +170,28 @@ class NcnnUpscaleImageNode(NodeBase):
     def upscale(
         self,
         img: np.ndarray,
-        net,
+        net: PooledNet,
         input_name: str,
         output_name: str,
-        split_factor: Union[int, None],
+        tile_size: Union[Tuple[int, int], None],
+        overlap: int,
+        blend: str,
     ):
         # Try/except block to catch errors
         try:
-            vkdev = ncnn.get_gpu_device(ncnn.get_default_gpu_index())
-            blob_vkallocator = ncnn.VkBlobAllocator(vkdev)
-            staging_vkallocator = ncnn.VkStagingAllocator(vkdev)
-            output, _ = ncnn_auto_split_process(
-                img,
-                net,
-                input_name=input_name,
-                output_name=output_name,
-                blob_vkallocator=blob_vkallocator,
-                staging_vkallocator=staging_vkallocator,
-                max_depth=split_factor,
-            )
+            with net.lock:
+                output, _ = ncnn_auto_split_process(
+                    img,
+                    net.net,
+                    input_name=input_name,
+                    output_name=output_name,
+                    blob_vkallocator=net.blob_vkallocator,
+                    staging_vkallocator=net.staging_vkallocator,
+                    model=net,
+                    overlap=overlap,
+                    tile_size=tile_size,
+                    blend=blend,
+                )
             # blob_vkallocator.clear() # this slows stuff down
             # staging_vkallocator.clear() # as does this
             # net.clear() # don't do this, it makes chaining break
@@ -199,46 +202,26 @@ class NcnnUpscaleImageNode(NodeBase):
             raise RuntimeError("An unexpected error occurred during NCNN processing.")
 
     def run(
-        self, net_data: NcnnNetData, img: np.ndarray, tile_size_target: int
+        self,
+        net_data: NcnnNetData,
+        img: np.ndarray,
+        tile_size: int,
+        overlap: int,
+        blend: str,
     ) -> np.ndarray:
-        h, w, _ = get_h_w_c(img)
-
-        if tile_size_target > 0:
-            # Calculate split factor using a tile size target
-            # Example: w == 1280, tile_size_target == 512
-            # 1280 / 512 = 2.5, ceil makes that 3, so split_factor == 3
-            # This effectively makes the tile size for the image 426
-            w_split_factor = int(np.ceil(w / tile_size_target))
-            h_split_factor = int(np.ceil(h / tile_size_target))
-            split_factor = max(w_split_factor, h_split_factor, 1)
-        else:
-            split_factor = None
-
-        net = ncnn.Net()
-
-        # Use vulkan compute
-        net.opt.use_vulkan_compute = True
-        net.set_vulkan_device(ncnn.get_default_gpu_index())
-
-        # Load model param and bin
-        net.load_param(net_data.param_path)
-
-        with tempfile.TemporaryDirectory(prefix="chaiNNer-") as tempdir:
-            is_fp16 = net_data.bin_data.dtype == np.float16
-            flag = FLAG_FLOAT_16 if is_fp16 else FLAG_FLOAT_32
-            dtype = np.float16 if is_fp16 else np.float32
-            packed = struct.pack("<I", flag) + net_data.bin_data.astype(dtype).tobytes(
-                "F"
-            )
-            temp_file = os.path.join(tempdir, "ncnn.bin")
-            with open(temp_file, "wb") as binary_file:
-                binary_file.write(packed)
-            net.load_model(temp_file)
+        check_tile_overlap(tile_size, overlap)
+        net = net_pool.get_net(net_data.param_path, net_data.bin_data)
 
         def upscale(i: np.ndarray) -> np.ndarray:
             i = cv2.cvtColor(i, cv2.COLOR_BGR2RGB)
             i = self.upscale(
-                i, net, net_data.input_name, net_data.output_name, split_factor
+                i,
+                net,
+                net_data.input_name,
+                net_data.output_name,
+                (tile_size, tile_size) if tile_size > 0 else None,
+                overlap,
+                blend,
             )
             assert (
                 get_h_w_c(i)[2] == 3
@@ -298,8 +281,12 @@ class NcnnInterpolateModelsNode(NodeBase):
     def check_can_interp(self, a: NcnnNetData, b: NcnnNetData):
         interp_50 = self.perform_interp(a.bin_data, b.bin_data, 50)
         fake_img = np.ones((3, 3, 3), dtype=np.float32, order="F")
-        new_net = NcnnNetData(a.param_path, interp_50, a.input_name, a.output_name)
-        result = NcnnUpscaleImageNode().run(new_net, fake_img, 0)
+        # The net is only used once, so it is loaded outside of the pool. Otherwise it
+        # would evict a net that is likely to be used again, or even in use right now.
+        new_net = PooledNet(a.param_path, interp_50, ncnn.get_default_gpu_index())
+        result = NcnnUpscaleImageNode().upscale(
+            fake_img, new_net, a.input_name, a.output_name, None, 0, TileBlend.LINEAR
+        )
         del interp_50, new_net
 
         mean_color = np.mean(result)
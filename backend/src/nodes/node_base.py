@@ -1,5 +1,5 @@
 from abc import ABCMeta, abstractmethod
-from typing import Any, List, Union
+from typing import Any, List, Optional, Union
 
 from .properties.inputs.base_input import BaseInput
 from .properties.outputs.base_output import BaseOutput
@@ -32,10 +32,25 @@ class NodeBase(metaclass=ABCMeta):
         """Abstract method to run a node's logic"""
         return
 
-    def get_extra_data(self) -> Any:
-        """Abstract method for getting extra data the frontend needs"""
+    def get_extra_data(self, output: Any) -> Any:
+        """Abstract method for getting extra data the frontend needs about the output of `run`"""
         return
 
+    def predict_outputs(self, *args) -> Any:
+        """
+        Abstract method returning what `run` would output without loading any data, e.g.
+        the name of an image but not the image itself. The outputs that aren't known are
+        None. Returns None if the node cannot predict its outputs.
+        """
+        return None
+
+    def get_written_files(self, *args) -> Optional[List[str]]:
+        """
+        Abstract method returning the files `run` writes for the given inputs, or None if
+        the node doesn't (only) write files. Inputs that are data (e.g. images) are None.
+        """
+        return None
+
     def get_inputs(self, with_implicit_ids=False):
         if with_implicit_ids:
             assign_implicit_ids(self.inputs)
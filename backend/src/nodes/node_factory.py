@@ -1,3 +1,4 @@
+import importlib
 from typing import Callable, Dict
 
 from sanic.log import logger
@@ -12,10 +13,17 @@ class NodeFactory:
     registry = {}
     """ Internal registry for available nodes """
 
+    lazy_registry: Dict[str, str] = {}
+    """ Modules of nodes that are available, but have not been imported yet """
+
     @classmethod
     def create_node(cls, schema_id: str) -> NodeBase:
         """Factory command to create the node"""
 
+        if schema_id not in cls.registry and schema_id in cls.lazy_registry:
+            module = cls.lazy_registry[schema_id]
+            logger.info(f"Importing {module} for node {schema_id}")
+            importlib.import_module(module)
         node_class = cls.registry[schema_id]
         node = node_class()
         return node
@@ -31,6 +39,11 @@ class NodeFactory:
 
         return inner_wrapper
 
+    @classmethod
+    def register_lazy(cls, schema_id: str, module: str):
+        """Registers a node that will be imported from the given module once it is needed"""
+        cls.lazy_registry[schema_id] = module
+
     @classmethod
     def get_registry(cls) -> Dict:
         return cls.registry
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import os
-from typing import Tuple
+from typing import List, Tuple, Union
 
 import numpy as np
 import onnx
@@ -14,6 +14,8 @@ from .node_factory import NodeFactory
 from .properties.inputs import *
 from .properties.outputs import *
 from .utils.onnx_auto_split import onnx_auto_split_process
+from .utils.onnx_session import get_onnx_session
+from .utils.tiler import check_tile_overlap
 from .utils.utils import get_h_w_c, np2nptensor, nptensor2np, convenient_upscale
 
 
@@ -84,13 +86,15 @@ class OnnxImageUpscaleNode(NodeBase):
     def __init__(self):
         super().__init__()
         self.description = "Upscales an image using an ONNX Super-Resolution model. \
-            ONNX does not support automatic out-of-memory handling via automatic tiling. \
-            Therefore, you must set a tile size target yourself. If you get an out-of-memory error, try decreasing this number by a large amount. \
-            Setting it to 0 will disable tiling."
+            The image is upscaled in tiles of the given size, which overlap and are blended together. \
+            If you get an out-of-memory error, try decreasing the tile size by a large amount. \
+            Setting it to 0 will upscale the whole image at once and split it automatically if it runs out of memory."
         self.inputs = [
             OnnxModelInput(),
             ImageInput(),
-            NumberInput("Tile Size Target", default=0, minimum=0, maximum=None),
+            NumberInput("Tile Size", default=0, minimum=0, maximum=None, unit="px"),
+            NumberInput("Tile Overlap", default=16, minimum=0, maximum=None, unit="px"),
+            TileBlendInput(),
         ]
         self.outputs = [
             ImageOutput(
@@ -108,42 +112,50 @@ class OnnxImageUpscaleNode(NodeBase):
 
     def upscale(
         self,
-        img: np.ndarray,
+        imgs: List[np.ndarray],
         session: ort.InferenceSession,
-        split_factor: int,
+        tile_size: Union[Tuple[int, int], None],
+        overlap: int,
+        blend: str,
         change_shape: bool,
-    ) -> np.ndarray:
+    ) -> List[np.ndarray]:
+        """Upscales images of the same size as a single batch"""
         logger.info("Upscaling image")
         is_fp16_model = session.get_inputs()[0].type == "tensor(float16)"
-        img = np2nptensor(img, change_range=False)
+        img = np.concatenate([np2nptensor(img, change_range=False) for img in imgs])
         logger.info(img.shape)
         out, _ = onnx_auto_split_process(
             img.astype(np.float16) if is_fp16_model else img,
             session,
-            max_depth=split_factor,
+            overlap=overlap,
+            tile_size=tile_size,
+            blend=blend,
             change_shape=change_shape,
         )
         logger.info(out.shape)
-        out = nptensor2np(out, change_range=False, imtype=np.float32)
+        imgs_out = [
+            nptensor2np(out[i : i + 1], change_range=False, imtype=np.float32)
+            for i in range(len(imgs))
+        ]
         del session
         logger.info("Done upscaling")
-        return out
+        return imgs_out
 
     def run(
-        self, onnx_model: bytes, img: np.ndarray, tile_size_target: int
+        self,
+        onnx_model: bytes,
+        img: np.ndarray,
+        tile_size: int,
+        overlap: int,
+        blend: str,
     ) -> np.ndarray:
         """Upscales an image with a pretrained model"""
 
+        check_tile_overlap(tile_size, overlap)
+
         logger.info(f"Upscaling image...")
 
-        session = ort.InferenceSession(
-            onnx_model,
-            providers=[
-                "CPUExecutionProvider"
-                if os.environ["device"] == "cpu"
-                else "CUDAExecutionProvider"
-            ],
-        )
+        session = get_onnx_session(onnx_model, os.environ["device"])
 
         index, in_nc = [
             (i, x)
@@ -156,19 +168,23 @@ class OnnxImageUpscaleNode(NodeBase):
         h, w, c = get_h_w_c(img)
         logger.debug(f"Image is {h}x{w}x{c}")
 
-        if tile_size_target > 0:
-            # Calculate split factor using a tile size target
-            # Example: w == 1280, tile_size_target == 512
-            # 1280 / 512 = 2.5, ceil makes that 3, so split_factor == 3
-            # This effectively makes the tile size for the image 426
-            w_split_factor = int(np.ceil(w / tile_size_target))
-            h_split_factor = int(np.ceil(h / tile_size_target))
-            split_factor = max(w_split_factor, h_split_factor, 1)
-        else:
-            split_factor = 1
+        # Models with a fixed batch size of 1 cannot upscale multiple images at once
+        batch_dim = session.get_inputs()[0].shape[0]
+        supports_batch = not isinstance(batch_dim, int)
+
+        def upscale_batch(imgs: List[np.ndarray]) -> List[np.ndarray]:
+            return self.upscale(
+                imgs,
+                session,
+                (tile_size, tile_size) if tile_size > 0 else None,
+                overlap,
+                blend,
+                change_shape,
+            )
 
         return convenient_upscale(
             img,
             in_nc,
-            lambda i: self.upscale(i, session, split_factor, change_shape),
+            lambda i: upscale_batch([i])[0],
+            upscale_batch if supports_batch else None,
         )
@@ -5,6 +5,8 @@ from .. import expression
 from .base_input import BaseInput
 from ...utils.blend_modes import BlendModes as bm
 from ...utils.image_utils import FillColor
+from ...utils.image_writer import TiffCompression
+from ...utils.video_utils import VideoEncoder
 
 
 class DropDownInput(BaseInput):
@@ -191,6 +193,47 @@ def VideoTypeDropdown() -> DropDownInput:
     )
 
 
+def VideoEncoderDropdown() -> DropDownInput:
+    """Video Encoder option dropdown"""
+    return DropDownInput(
+        input_type="VideoEncoder",
+        label="Video Encoder",
+        options=[
+            {"option": "OpenCV", "value": VideoEncoder.OPENCV},
+            {"option": "FFmpeg H.264", "value": VideoEncoder.LIBX264},
+            {"option": "FFmpeg H.265", "value": VideoEncoder.LIBX265},
+            {"option": "FFmpeg VP9", "value": VideoEncoder.LIBVPX_VP9},
+        ],
+    )
+
+
+def VideoPixelFormatDropdown() -> DropDownInput:
+    """FFmpeg output pixel format option dropdown"""
+    return DropDownInput(
+        input_type="VideoPixelFormat",
+        label="Pixel Format (FFmpeg)",
+        options=[
+            {"option": "YUV 4:2:0", "value": "yuv420p"},
+            {"option": "YUV 4:4:4", "value": "yuv444p"},
+            {"option": "YUV 4:2:0 10-bit", "value": "yuv420p10le"},
+        ],
+    )
+
+
+def TiffCompressionDropdown() -> DropDownInput:
+    """TIFF compression option dropdown"""
+    return DropDownInput(
+        input_type="TiffCompression",
+        label="TIFF Compression",
+        options=[
+            {"option": "LZW", "value": TiffCompression.LZW},
+            {"option": "Deflate", "value": TiffCompression.DEFLATE},
+            {"option": "PackBits", "value": TiffCompression.PACKBITS},
+            {"option": "None", "value": TiffCompression.NONE},
+        ],
+    )
+
+
 def FlipAxisInput() -> DropDownInput:
     return DropDownInput(
         input_type="FlipAxis",
@@ -3,6 +3,7 @@ import cv2
 # pylint: disable=relative-beyond-top-level
 from ...utils.pil_utils import InterpolationMethod, RotateExpandCrop
 from ...utils.tile_util import TileMode
+from ...utils.tiler import TileBlend
 from .generic_inputs import DropDownInput
 
 
@@ -266,6 +267,23 @@ def TileModeInput():
     )
 
 
+def TileBlendInput():
+    return DropDownInput(
+        input_type="TileBlend",
+        label="Tile Blending",
+        options=[
+            {
+                "option": "Linear",
+                "value": TileBlend.LINEAR,
+            },
+            {
+                "option": "Cosine",
+                "value": TileBlend.COSINE,
+            },
+        ],
+    )
+
+
 def GammaOptionInput():
     return DropDownInput(
         input_type="GammaOption",
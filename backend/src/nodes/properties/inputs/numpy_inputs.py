@@ -1,6 +1,10 @@
 # pylint: disable=relative-beyond-top-level
 
-from ...utils.image_utils import normalize
+from typing import Iterable, Optional
+
+import numpy as np
+
+from ...utils.image_utils import compact, normalize
 from .base_input import BaseInput
 from .. import expression
 
@@ -13,16 +17,26 @@ class AudioInput(BaseInput):
 
 
 class ImageInput(BaseInput):
-    """Input a 2D Image NumPy array"""
+    """
+    Input a 2D Image NumPy array
+
+    Nodes get a float32 copy of the image with values in [0, 1], which they may modify.
+    Nodes that only read the image and can handle other dtypes can list them in
+    `accepted_dtypes` (a subset of `COMPACT_DTYPES`) to get the image without a copy.
+    """
 
     def __init__(
         self,
         label: str = "Image",
         image_type: expression.ExpressionJson = "Image",
+        accepted_dtypes: Optional[Iterable[type]] = None,
     ):
         super().__init__(image_type, label)
+        self.accepted_dtypes = [np.dtype(d) for d in accepted_dtypes or []]
 
-    def enforce(self, value):
+    def enforce(self, value: np.ndarray):
+        if value.dtype in self.accepted_dtypes:
+            return compact(value)
         return normalize(value)
 
 
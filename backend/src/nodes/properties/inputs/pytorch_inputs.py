@@ -1,9 +1,5 @@
-try:
-    import torch
-except:
-    torch = None
-
 import os
+import sys
 
 from .base_input import BaseInput
 
@@ -15,6 +11,8 @@ class ModelInput(BaseInput):
         super().__init__("PyTorchModel", label)
 
     def enforce(self, value):
+        # torch is only imported by the nodes that use it. A model can't exist without it.
+        torch = sys.modules.get("torch", None)
         if torch is not None:
             assert isinstance(value, torch.nn.Module), "Expected a PyTorch model"
         return value
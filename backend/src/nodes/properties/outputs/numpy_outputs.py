@@ -1,4 +1,4 @@
-from ...utils.image_utils import preview_encode
+from ...utils.image_utils import get_preview
 from ...utils.utils import get_h_w_c
 from .base_output import BaseOutput
 from .. import expression
@@ -29,10 +29,9 @@ class ImageOutput(NumPyOutput):
         img = value
         h, w, c = get_h_w_c(img)
 
-        base64_img = preview_encode(img, 64)
-
         return {
-            "image": base64_img,
+            # The executor replaces the encoded preview with a reference to it
+            "image": get_preview(img, 64),
             "height": h,
             "width": w,
             "channels": c,
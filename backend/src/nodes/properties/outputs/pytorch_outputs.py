@@ -1,7 +1,12 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
 from .. import expression
 from .base_output import BaseOutput
 
-from ...utils.torch_types import PyTorchModel
+if TYPE_CHECKING:
+    from ...utils.torch_types import PyTorchModel
 
 
 class ModelOutput(BaseOutput):
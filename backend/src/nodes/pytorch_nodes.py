@@ -6,7 +6,7 @@ from __future__ import annotations
 
 from io import BytesIO
 import os
-from typing import Any, OrderedDict, Union
+from typing import Any, List, OrderedDict, Union
 
 import numpy as np
 import torch
@@ -22,6 +22,8 @@ from .utils.architecture.SPSR import SPSRNet as SPSR
 from .utils.architecture.SRVGG import SRVGGNetCompact as RealESRGANv2
 from .utils.architecture.SwiftSRGAN import Generator as SwiftSRGAN
 from .utils.pytorch_auto_split import auto_split_process
+from .utils.pytorch_model_cache import prepared_models, use_channels_last
+from .utils.tiler import check_tile_overlap
 from .utils.utils import get_h_w_c, np2tensor, tensor2np, convenient_upscale
 
 
@@ -79,28 +81,24 @@ class LoadModelNode(NodeBase):
         self.icon = "PyTorch"
         self.sub = "Input & Output"
 
-        # Defined in run
-        self.model = None
-        self.basename = None
+    def get_extra_data(self, output: Tuple[PyTorchModel, str]) -> Dict:
+        model, basename = output
 
-    def get_extra_data(self) -> Dict:
-        assert self.model is not None
-
-        if "SRVGG" in self.model.model_type:
-            size = [f"{self.model.num_feat}nf", f"{self.model.num_conv}nc"]
+        if "SRVGG" in model.model_type:
+            size = [f"{model.num_feat}nf", f"{model.num_conv}nc"]
         else:
             size = [
-                f"{self.model.num_filters}nf",
-                f"{self.model.num_blocks}nb",
+                f"{model.num_filters}nf",
+                f"{model.num_blocks}nb",
             ]
 
         return {
-            "modelType": self.model.model_type,
-            "inNc": self.model.in_nc,
-            "outNc": self.model.out_nc,
+            "modelType": model.model_type,
+            "inNc": model.in_nc,
+            "outNc": model.out_nc,
             "size": size,
-            "scale": self.model.scale,
-            "name": self.basename,
+            "scale": model.scale,
+            "name": basename,
         }
 
     def run(self, path: str) -> Tuple[PyTorchModel, str]:
@@ -116,16 +114,16 @@ class LoadModelNode(NodeBase):
         logger.info(f"Reading state dict from path: {path}")
         state_dict = torch.load(path, map_location=torch.device(os.environ["device"]))
 
-        self.model = load_state_dict(state_dict)
+        model = load_state_dict(state_dict)
 
-        for _, v in self.model.named_parameters():
+        for _, v in model.named_parameters():
             v.requires_grad = False
-        self.model.eval()
-        self.model = self.model.to(torch.device(os.environ["device"]))
+        model.eval()
+        model = model.to(torch.device(os.environ["device"]))
 
-        self.basename = os.path.splitext(os.path.basename(path))[0]
+        basename = os.path.splitext(os.path.basename(path))[0]
 
-        return self.model, self.basename
+        return model, basename
 
 
 @NodeFactory.register("chainner:pytorch:upscale_image")
@@ -133,8 +131,16 @@ class LoadModelNode(NodeBase):
 class ImageUpscaleNode(NodeBase):
     def __init__(self):
         super().__init__()
-        self.description = "Upscales an image using a PyTorch Super-Resolution model."
-        self.inputs = [ModelInput(), ImageInput()]
+        self.description = "Upscales an image using a PyTorch Super-Resolution model. \
+            The image is upscaled in tiles, which overlap and are blended together. \
+            If the tile size is 0, it is chosen automatically based on free memory."
+        self.inputs = [
+            ModelInput(),
+            ImageInput(),
+            NumberInput("Tile Size", default=0, minimum=0, maximum=None, unit="px"),
+            NumberInput("Tile Overlap", default=16, minimum=0, maximum=None, unit="px"),
+            TileBlendInput(),
+        ]
         self.outputs = [
             ImageOutput(
                 "Upscaled Image",
@@ -153,55 +159,59 @@ class ImageUpscaleNode(NodeBase):
         self.icon = "PyTorch"
         self.sub = "Processing"
 
-    def upscale(self, img: np.ndarray, model: torch.nn.Module, scale: int):
+    def upscale(
+        self,
+        imgs: List[np.ndarray],
+        model: torch.nn.Module,
+        tile_size: Union[Tuple[int, int], None],
+        overlap: int,
+        blend: str,
+    ) -> List[np.ndarray]:
+        """Upscales images of the same size as a single batch"""
         with torch.no_grad():
             # Borrowed from iNNfer
             logger.info("Converting image to tensor")
-            img_tensor = np2tensor(img, change_range=True)
-            if os.environ["isFp16"] == "True":
-                model = model.half()
-                img_tensor = img_tensor.half()
-            else:
-                model = model.float()
-                img_tensor = img_tensor.float()
+            img_tensor = torch.cat([np2tensor(img, change_range=True) for img in imgs])
+            model = prepared_models.get(
+                model,
+                torch.device(os.environ["device"]),
+                fp16=os.environ["isFp16"] == "True",
+                channels_last=use_channels_last(),
+            )
             logger.info("Upscaling image")
 
-            if os.environ["device"] == "cuda":
-                GB_AMT = 1024**3
-                free, total = torch.cuda.mem_get_info(0)  # type: ignore
-                img_bytes = img_tensor.numel() * img_tensor.element_size()
-                model_bytes = sum(
-                    p.numel() * p.element_size() for p in model.parameters()
-                )
-                mem_required_estimation = (model_bytes / (1024 * 52)) * img_bytes
-                split_estimation = 1
-                x = mem_required_estimation
-                while x > free:
-                    x /= 4
-                    split_estimation += 1
-                logger.info(
-                    f"Estimating memory required: {mem_required_estimation/GB_AMT:.2f} GB, {free/GB_AMT:.2f} GB free, {total/GB_AMT:.2f} GB total. Estimated Split depth: {split_estimation}"
-                )
-
-            t_out, depth = auto_split_process(
+            t_out, tile_size = auto_split_process(
                 img_tensor,
                 model,
-                scale,
+                overlap=overlap,
+                tile_size=tile_size,
+                blend=blend,
             )
-            if os.environ["device"] == "cuda":
-                logger.info(f"Actual Split depth: {depth}")
+            logger.info(f"Actual tile size: {tile_size[0]}x{tile_size[1]}")
             del img_tensor, model
             logger.info("Converting tensor to image")
-            img_out = tensor2np(t_out.detach(), change_range=False, imtype=np.float32)
+            imgs_out = [
+                tensor2np(t, change_range=False, imtype=np.float32)
+                for t in t_out.detach()
+            ]
             logger.info("Done upscaling")
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
             del t_out
-            return img_out
-
-    def run(self, model: PyTorchModel, img: np.ndarray) -> np.ndarray:
+            return imgs_out
+
+    def run(
+        self,
+        model: PyTorchModel,
+        img: np.ndarray,
+        tile_size: int,
+        overlap: int,
+        blend: str,
+    ) -> np.ndarray:
         """Upscales an image with a pretrained model"""
 
+        check_tile_overlap(tile_size, overlap)
+
         check_env()
 
         logger.info(f"Upscaling image...")
@@ -215,10 +225,20 @@ class ImageUpscaleNode(NodeBase):
             f"Upscaling a {h}x{w}x{c} image with a {scale}x model (in_nc: {in_nc}, out_nc: {out_nc})"
         )
 
+        def upscale_batch(imgs: List[np.ndarray]) -> List[np.ndarray]:
+            return self.upscale(
+                imgs,
+                model,
+                (tile_size, tile_size) if tile_size > 0 else None,
+                overlap,
+                blend,
+            )
+
         return convenient_upscale(
             img,
             in_nc,
-            lambda i: self.upscale(i, model, model.scale),
+            lambda i: upscale_batch([i])[0],
+            upscale_batch,
         )
 
 
@@ -1,5 +1,9 @@
 import base64
-from typing import Tuple
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
 
 import cv2
 import numpy as np
@@ -118,13 +122,51 @@ def convert_from_BGRA(img: np.ndarray, c: int) -> np.ndarray:
     return img.copy()
 
 
+COMPACT_DTYPES = (np.uint8, np.uint16, np.float16, np.float32)
+"""
+The dtypes images may have before they are converted to float32 by `normalize`.
+Integer images use the full range of their type, float images the range [0, 1].
+"""
+
+
 def normalize(img: np.ndarray) -> np.ndarray:
+    """Returns a float32 copy of the image with values in [0, 1]"""
     dtype_max = 1
     try:
         dtype_max = np.iinfo(img.dtype).max
     except:
         logger.debug("img dtype is not int")
-    return np.clip(img.astype(np.float32) / dtype_max, 0, 1)
+    # Converting creates the only copy, everything else is done in place
+    result = img.astype(np.float32)
+    if dtype_max != 1:
+        result /= dtype_max
+    if img.dtype.kind != "u":
+        np.clip(result, 0, 1, out=result)
+    return result
+
+
+def compact(img: np.ndarray) -> np.ndarray:
+    """
+    Returns the image as one of `COMPACT_DTYPES`, e.g. to keep an 8 bit image 4 times
+    smaller than its float32 version. Images that already are are returned as is, and
+    float images are only copied if values have to be clipped.
+    """
+    if img.dtype == np.uint8 or img.dtype == np.uint16:
+        return img
+    if img.dtype == np.float16 or img.dtype == np.float32:
+        if img.size == 0 or (img.min() >= 0 and img.max() <= 1):
+            return img
+        return np.clip(img, 0, 1)
+    return normalize(img)
+
+
+def to_uint8(img: np.ndarray) -> np.ndarray:
+    """Converts an image to 8 bit, e.g. to write it to a file"""
+    if img.dtype == np.uint8:
+        return img
+    if img.dtype != np.float32:
+        img = normalize(img)
+    return (np.clip(img, 0, 1) * 255).round().astype(np.uint8)
 
 
 def normalize_normals(
@@ -235,18 +277,97 @@ def calculate_ssim(img1: np.ndarray, img2: np.ndarray) -> float:
     return float(np.mean(ssim_map))
 
 
-def preview_encode(img: np.ndarray, target_size: int = 512) -> str:
-    """
-    resize the image, so the preview loads faster and doesn't lag the UI
-    512 was chosen as the target because a 512x512 RGBA 8bit PNG is at most 1MB in size
-    """
+PREVIEW_FORMAT = os.environ.get("CHAINNER_PREVIEW_FORMAT", "jpg").lower()
+"""The format of previews of opaque images: jpg, webp, or png. Transparent images always use PNG."""
+PREVIEW_QUALITY = int(os.environ.get("CHAINNER_PREVIEW_QUALITY", "90"))
+"""The quality (0-100) of JPEG and WebP previews"""
+PREVIEW_PNG_COMPRESSION: Optional[int] = (
+    int(os.environ["CHAINNER_PREVIEW_PNG_COMPRESSION"])
+    if "CHAINNER_PREVIEW_PNG_COMPRESSION" in os.environ
+    else None
+)
+"""The compression level (0-9) of PNG previews. OpenCV's default is used if not set."""
+
+
+class EncodedPreview(NamedTuple):
+    data: bytes
+    mime: str
+
+    def to_data_url(self) -> str:
+        base64_img = base64.b64encode(self.data).decode("utf8")
+        return f"data:{self.mime};base64,{base64_img}"
+
+
+PREVIEW_MEMO_SIZE = 32
+preview_memo: "OrderedDict[Tuple[int, int], Tuple[weakref.ref, EncodedPreview]]" = (
+    OrderedDict()
+)
+preview_memo_lock = threading.Lock()
+
+
+def get_preview_format(img: np.ndarray) -> Tuple[str, np.ndarray, List[int]]:
+    """Returns the extension, image, and parameters to encode the given 8 bit image with"""
+    c = get_h_w_c(img)[2]
+    if c == 4 and img[:, :, 3].min() == 255:
+        img = img[:, :, :3]
+        c = 3
+
+    if c != 4 and PREVIEW_FORMAT in ("jpg", "jpeg"):
+        return ".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, PREVIEW_QUALITY]
+    if c != 4 and PREVIEW_FORMAT == "webp":
+        return ".webp", img, [cv2.IMWRITE_WEBP_QUALITY, PREVIEW_QUALITY]
+    if PREVIEW_PNG_COMPRESSION is not None:
+        return ".png", img, [cv2.IMWRITE_PNG_COMPRESSION, PREVIEW_PNG_COMPRESSION]
+    return ".png", img, []
+
+
+def encode_preview(img: np.ndarray, target_size: int) -> EncodedPreview:
+    if img.dtype not in (np.uint8, np.uint16, np.float32):
+        # OpenCV can't resize other types
+        img = normalize(img)
     h, w, _ = get_h_w_c(img)
 
     max_size = target_size * 1.2
     if w > max_size or h > max_size:
         f = max(w / target_size, h / target_size)
+        # Area interpolation of large images is slow. Skipping pixels first is fast and
+        # barely visible as long as the image is still twice as large as the preview.
+        step = int(f / 2)
+        if step > 1:
+            img = img[::step, ::step]
         img = cv2.resize(img, (int(w / f), int(h / f)), interpolation=cv2.INTER_AREA)
 
-    _, encoded_img = cv2.imencode(".png", (img * 255).astype("uint8"))  # type: ignore
-    base64_img = base64.b64encode(encoded_img).decode("utf8")
-    return f"data:image/png;base64,{base64_img}"
+    ext, img, params = get_preview_format(to_uint8(img))
+    _, encoded_img = cv2.imencode(ext, img, params)
+    mime = "image/jpeg" if ext == ".jpg" else f"image/{ext[1:]}"
+    return EncodedPreview(encoded_img.tobytes(), mime)  # type: ignore
+
+
+def get_preview(img: np.ndarray, target_size: int = 512) -> EncodedPreview:
+    """
+    resize the image, so the preview loads faster and doesn't lag the UI
+    512 was chosen as the target because a 512x512 RGBA 8bit PNG is at most 1MB in size
+
+    Opaque images are encoded as `PREVIEW_FORMAT` and transparent ones as PNG. Images
+    are not modified after they were output by a node, so the previews of the last few
+    images are remembered and the same image (e.g. a cached output) is only encoded once.
+    """
+    key = (id(img), target_size)
+    with preview_memo_lock:
+        memo = preview_memo.get(key, None)
+        if memo is not None and memo[0]() is img:
+            preview_memo.move_to_end(key)
+            return memo[1]
+
+    preview = encode_preview(img, target_size)
+
+    with preview_memo_lock:
+        preview_memo[key] = (weakref.ref(img), preview)
+        while len(preview_memo) > PREVIEW_MEMO_SIZE:
+            preview_memo.popitem(last=False)
+    return preview
+
+
+def preview_encode(img: np.ndarray, target_size: int = 512) -> str:
+    """Returns the preview of the given image as a data URL"""
+    return get_preview(img, target_size).to_data_url()
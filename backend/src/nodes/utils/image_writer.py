@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from .image_utils import to_uint8
+
+IMAGE_WRITER_THREADS = int(
+    os.environ.get("CHAINNER_IMAGE_WRITER_THREADS", min(4, os.cpu_count() or 1))
+)
+"""How many images are encoded and written at the same time"""
+
+
+class TiffCompression:
+    NONE = 1
+    LZW = 5
+    DEFLATE = 8
+    PACKBITS = 32773
+
+
+def get_encode_params(
+    extension: str, quality: int, png_compression: int, tiff_compression: int
+) -> List[int]:
+    """
+    Returns the parameters of `cv2.imencode` for the given format.
+
+    WebP images with a quality of 100 are lossless. PNG images with a compression level
+    of 1 use OpenCV's defaults, which are tuned for speed.
+    """
+    if extension in ("jpg", "jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if extension == "webp":
+        # OpenCV encodes WebP losslessly above 100
+        return [cv2.IMWRITE_WEBP_QUALITY, 101 if quality >= 100 else max(quality, 1)]
+    if extension == "png":
+        if png_compression == 1:
+            return []
+        return [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    if extension in ("tif", "tiff"):
+        return [cv2.IMWRITE_TIFF_COMPRESSION, tiff_compression]
+    return []
+
+
+def write_image(path: str, img: np.ndarray, extension: str, params: List[int]):
+    img = to_uint8(img)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    status, buf_img = cv2.imencode(f".{extension}", img, params)
+    if not status:
+        raise RuntimeError(f'Unable to encode image as "{extension}" for {path}')
+    with open(path, "wb") as outf:
+        outf.write(buf_img)
+
+
+class ImageWriter:
+    """
+    Encodes and writes images on a pool of background threads.
+
+    `write` only blocks if too many images are waiting to be written, so encoding
+    overlaps with processing the next images. It returns a future that fails if the
+    image couldn't be written.
+    """
+
+    def __init__(self, max_workers: int, max_pending: Optional[int] = None):
+        self.__pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="image-writer"
+        )
+        self.__slots = threading.BoundedSemaphore(max_pending or 2 * max_workers)
+        self.__lock = threading.Lock()
+        self.__pending: Dict[str, Future] = {}
+
+    def write(
+        self, path: str, img: np.ndarray, extension: str, params: List[int]
+    ) -> Future:
+        # Writes to the same file happen in order
+        self.wait_for(path)
+        self.__slots.acquire()
+        try:
+            future = self.__pool.submit(write_image, path, img, extension, params)
+        except:
+            self.__slots.release()
+            raise
+        with self.__lock:
+            self.__pending[path] = future
+        future.add_done_callback(lambda f: self.__on_done(path, f))
+        return future
+
+    def __on_done(self, path: str, future: Future):
+        self.__slots.release()
+        with self.__lock:
+            if self.__pending.get(path, None) is future:
+                del self.__pending[path]
+
+    def wait_for(self, path: str):
+        """Waits until the given file was written, if it is being written"""
+        with self.__lock:
+            future = self.__pending.get(path, None)
+        if future is not None:
+            wait([future])
+
+
+_image_writer: Optional[ImageWriter] = None
+_image_writer_lock = threading.Lock()
+
+
+def get_image_writer() -> ImageWriter:
+    global _image_writer
+    with _image_writer_lock:
+        if _image_writer is None:
+            _image_writer = ImageWriter(IMAGE_WRITER_THREADS)
+        return _image_writer
@@ -1,12 +1,13 @@
 from __future__ import annotations
 
-import gc
-from typing import Tuple, Union
+from typing import Any, Tuple, Union
 
 import numpy as np
 from ncnn_vulkan import ncnn
 from sanic.log import logger
 
+from .tiler import TileBlend, auto_split
+
 
 def fix_dtype_range(img):
     dtype_max = 1
@@ -23,49 +24,42 @@ def fix_dtype_range(img):
     return img
 
 
+def is_out_of_memory_error(e: Exception) -> bool:
+    return "failed" in str(e)
+
+
 # NCNN version of the 'auto_split_upscale' function
 def ncnn_auto_split_process(
     lr_img: np.ndarray,
     net,
     overlap: int = 16,
-    max_depth: Union[int, None] = None,
-    current_depth: int = 1,
+    tile_size: Union[Tuple[int, int], None] = None,
+    blend: str = TileBlend.LINEAR,
     input_name: str = "data",
     output_name: str = "output",
     blob_vkallocator=None,
     staging_vkallocator=None,
-) -> Tuple[np.ndarray, int]:
+    model: Any = None,
+) -> Tuple[np.ndarray, Tuple[int, int]]:
     """
-    Run NCNN upscaling with automatic recursive tile splitting based on ability to process with current size
-    """
-    # Original code: https://github.com/JoeyBallentine/ESRGAN/blob/master/utils/dataops.py
-
-    # if os.environ["killed"] == "True":
-    #     ncnn.destroy_gpu_instance()
-    #     gc.collect()
-    #     raise RuntimeError("Upscaling killed mid-processing")
+    Run NCNN upscaling with automatic tile splitting based on ability to process with current size
 
-    logger.debug(
-        f"auto_split_process: overlap={overlap}, max_depth={max_depth}, current_depth={current_depth}"
-    )
-
-    logger.info(f"{max_depth=} {current_depth=}")
+    If `model` is given, the tile size that worked is remembered for it.
+    """
 
-    # Prevent splitting from causing an infinite out-of-vram loop
-    if current_depth > 15:
-        # ncnn.destroy_gpu_instance()
-        gc.collect()
-        raise RuntimeError("Splitting stopped to prevent infinite loop")
+    def clear_allocators():
+        if blob_vkallocator is not None and staging_vkallocator is not None:
+            blob_vkallocator.clear()
+            staging_vkallocator.clear()
 
-    # Attempt to upscale if unknown depth or if reached known max depth
-    if max_depth is None or max_depth == current_depth:
+    def upscale(tile: np.ndarray) -> np.ndarray:
         ex = net.create_extractor()
         ex.set_blob_vkallocator(blob_vkallocator)
         ex.set_workspace_vkallocator(blob_vkallocator)
         ex.set_staging_vkallocator(staging_vkallocator)
         # ex.set_light_mode(True)
         try:
-            lr_img_fix = fix_dtype_range(lr_img.copy())
+            lr_img_fix = fix_dtype_range(tile)
             mat_in = ncnn.Mat.from_pixels(
                 lr_img_fix,
                 ncnn.Mat.PixelType.PIXEL_RGB,
@@ -78,102 +72,25 @@ def ncnn_auto_split_process(
             ex.input(input_name, mat_in)
             _, mat_out = ex.extract(output_name)
             result = np.array(mat_out).transpose(1, 2, 0).astype(np.float32)
-            if blob_vkallocator is not None and staging_vkallocator is not None:
-                blob_vkallocator.clear()
-                staging_vkallocator.clear()
+            clear_allocators()
             del ex, mat_in, mat_out
-            # # Clear VRAM
-            return result.copy(), current_depth
+            return result
         except Exception as e:
             # Check to see if its actually the NCNN out of memory error
-            if "failed" in str(e):
+            if is_out_of_memory_error(e):
                 # clear VRAM
-                logger.info(
-                    f"NCNN out of VRAM, clearing VRAM and splitting. Current depth: {current_depth}"
-                )
-                if blob_vkallocator is not None and staging_vkallocator is not None:
-                    blob_vkallocator.clear()
-                    staging_vkallocator.clear()
+                logger.info("NCNN out of VRAM, clearing VRAM and splitting.")
+                clear_allocators()
                 del ex
-                gc.collect()
-            else:
-                # Re-raise the exception if not an OOM error
-                raise
-
-    h, w = lr_img.shape[:2]
-    if lr_img.ndim > 2:
-        c = lr_img.shape[2]
-    else:
-        c = 1
+            raise
 
-    # Split image into 4ths
-    top_left = lr_img[: h // 2 + overlap, : w // 2 + overlap, ...]
-    top_right = lr_img[: h // 2 + overlap, w // 2 - overlap :, ...]
-    bottom_left = lr_img[h // 2 - overlap :, : w // 2 + overlap, ...]
-    bottom_right = lr_img[h // 2 - overlap :, w // 2 - overlap :, ...]
-
-    # Recursively upscale the quadrants
-    # After we go through the top left quadrant, we know the maximum depth and no longer need to test for out-of-memory
-    top_left_rlt, depth = ncnn_auto_split_process(
-        top_left,
-        net,
+    return auto_split(
+        lr_img,
+        upscale,
+        is_out_of_memory_error,
+        tile_size=tile_size,
         overlap=overlap,
-        max_depth=max_depth,
-        current_depth=current_depth + 1,
-        blob_vkallocator=blob_vkallocator,
-        staging_vkallocator=staging_vkallocator,
+        blend=blend,
+        model=model,
+        model_key=(overlap,),
     )
-    top_right_rlt, _ = ncnn_auto_split_process(
-        top_right,
-        net,
-        overlap=overlap,
-        max_depth=depth,
-        current_depth=current_depth + 1,
-        blob_vkallocator=blob_vkallocator,
-        staging_vkallocator=staging_vkallocator,
-    )
-    bottom_left_rlt, _ = ncnn_auto_split_process(
-        bottom_left,
-        net,
-        overlap=overlap,
-        max_depth=depth,
-        current_depth=current_depth + 1,
-        blob_vkallocator=blob_vkallocator,
-        staging_vkallocator=staging_vkallocator,
-    )
-    bottom_right_rlt, _ = ncnn_auto_split_process(
-        bottom_right,
-        net,
-        overlap=overlap,
-        max_depth=depth,
-        current_depth=current_depth + 1,
-        blob_vkallocator=blob_vkallocator,
-        staging_vkallocator=staging_vkallocator,
-    )
-
-    tl_h, _ = top_left.shape[:2]
-    up_h, _ = top_left_rlt.shape[:2]
-    scale = int(up_h / tl_h)
-
-    # Define output shape
-    out_h = h * scale
-    out_w = w * scale
-
-    # Create blank output image
-    output_img = np.zeros((out_h, out_w, c), dtype=np.float32)
-
-    # Fill output image with tiles, cropping out the overlaps
-    output_img[: out_h // 2, : out_w // 2, ...] = top_left_rlt[
-        : out_h // 2, : out_w // 2, ...
-    ]
-    output_img[: out_h // 2, -out_w // 2 :, ...] = top_right_rlt[
-        : out_h // 2, -out_w // 2 :, ...
-    ]
-    output_img[-out_h // 2 :, : out_w // 2, ...] = bottom_left_rlt[
-        -out_h // 2 :, : out_w // 2, ...
-    ]
-    output_img[-out_h // 2 :, -out_w // 2 :, ...] = bottom_right_rlt[
-        -out_h // 2 :, -out_w // 2 :, ...
-    ]
-
-    return output_img.copy(), depth
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+from ncnn_vulkan import ncnn
+from sanic.log import logger
+
+from .ncnn_parsers import FLAG_FLOAT_16, FLAG_FLOAT_32
+
+
+def pack_ncnn_bin(bin_data: np.ndarray) -> bytes:
+    """Returns the contents of the .bin file for the given weights"""
+    is_fp16 = bin_data.dtype == np.float16
+    flag = FLAG_FLOAT_16 if is_fp16 else FLAG_FLOAT_32
+    dtype = np.float16 if is_fp16 else np.float32
+    return struct.pack("<I", flag) + bin_data.astype(dtype).tobytes("F")
+
+
+class PooledNet:
+    """
+    A loaded NCNN net together with the Vulkan allocators used to run it.
+
+    The allocators are not safe to share between threads, so `lock` has to be held
+    while the net is used.
+    """
+
+    def __init__(self, param_path: str, bin_data: np.ndarray, gpu_index: int):
+        self.lock = threading.Lock()
+
+        self.net = ncnn.Net()
+        # Use vulkan compute
+        self.net.opt.use_vulkan_compute = True
+        self.net.set_vulkan_device(gpu_index)
+
+        # Load model param and bin
+        self.net.load_param(param_path)
+        packed = pack_ncnn_bin(bin_data)
+        if hasattr(self.net, "load_model_mem"):
+            self.net.load_model_mem(packed)
+        else:
+            # Older versions of ncnn_vulkan can only load weights from a file
+            with tempfile.TemporaryDirectory(prefix="chaiNNer-") as tempdir:
+                temp_file = os.path.join(tempdir, "ncnn.bin")
+                with open(temp_file, "wb") as binary_file:
+                    binary_file.write(packed)
+                self.net.load_model(temp_file)
+
+        vkdev = ncnn.get_gpu_device(gpu_index)
+        self.blob_vkallocator = ncnn.VkBlobAllocator(vkdev)
+        self.staging_vkallocator = ncnn.VkStagingAllocator(vkdev)
+
+
+NetKey = Tuple[str, int, str, int, str]
+
+
+class NcnnNetPool:
+    """
+    Keeps the most recently used NCNN nets loaded.
+
+    Nets are keyed by their param file, a hash of their weights, the GPU they run on,
+    and the precision of their weights, so running the same model on many images only
+    loads it once.
+    """
+
+    def __init__(self, max_nets: int):
+        self.max_nets = max_nets
+
+        self.__lock = threading.Lock()
+        self.__nets: OrderedDict[NetKey, PooledNet] = OrderedDict()
+        # Hashing the weights for every image adds up, so the hash of the weight
+        # arrays seen most recently is remembered. The array is kept alive by the
+        # entry, so its id stays unique.
+        self.__weight_hashes: OrderedDict[int, Tuple[np.ndarray, str]] = OrderedDict()
+
+    def __hash_weights(self, bin_data: np.ndarray) -> str:
+        entry = self.__weight_hashes.get(id(bin_data), None)
+        if entry is not None and entry[0] is bin_data:
+            self.__weight_hashes.move_to_end(id(bin_data))
+            return entry[1]
+
+        digest = hashlib.sha256(np.ascontiguousarray(bin_data).data).hexdigest()
+        self.__weight_hashes[id(bin_data)] = (bin_data, digest)
+        while len(self.__weight_hashes) > self.max_nets:
+            self.__weight_hashes.popitem(last=False)
+        return digest
+
+    def get_net(self, param_path: str, bin_data: np.ndarray) -> PooledNet:
+        """Returns the loaded net for the given model, loading it if necessary"""
+        gpu_index = ncnn.get_default_gpu_index()
+        with self.__lock:
+            key: NetKey = (
+                param_path,
+                os.stat(param_path).st_mtime_ns,
+                self.__hash_weights(bin_data),
+                gpu_index,
+                str(bin_data.dtype),
+            )
+
+            net = self.__nets.get(key, None)
+            if net is not None:
+                self.__nets.move_to_end(key)
+                return net
+
+            logger.info(f"Loading NCNN net {param_path}")
+            net = PooledNet(param_path, bin_data, gpu_index)
+            self.__nets[key] = net
+            # Nets that are still in use by another thread stay alive until that
+            # thread is done with them
+            while len(self.__nets) > self.max_nets:
+                self.__nets.popitem(last=False)
+            return net
+
+    def clear(self):
+        with self.__lock:
+            self.__nets.clear()
+            self.__weight_hashes.clear()
+
+
+net_pool = NcnnNetPool(max_nets=int(os.environ.get("CHAINNER_NCNN_NETS", "4")))
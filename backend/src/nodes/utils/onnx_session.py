@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import onnxruntime as ort
+from sanic.log import logger
+
+
+def get_onnx_providers(device: str) -> List[str]:
+    return ["CPUExecutionProvider" if device == "cpu" else "CUDAExecutionProvider"]
+
+
+class OnnxSessionCache:
+    """
+    A process-wide LRU cache of ONNX inference sessions.
+
+    Sessions are keyed by a hash of the model bytes, the execution providers, and the
+    session options, so the same model is only parsed, optimized, and allocated once.
+    The cache is bounded by the number of sessions and by the size of their models.
+
+    If a directory is given, the optimized graph of every new session is written to it,
+    and later sessions for the same key (e.g. after a restart) load the optimized graph
+    and skip graph optimization.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int,
+        max_bytes: int,
+        optimized_model_directory: Optional[str] = None,
+    ):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.optimized_model_directory = optimized_model_directory
+
+        self.__lock = threading.Lock()
+        self.__sessions: OrderedDict[
+            str, Tuple[ort.InferenceSession, int]
+        ] = OrderedDict()
+        self.__bytes = 0
+        # Hashing large models for every image adds up, so the hash of the model
+        # objects seen most recently is remembered. The model is kept alive by the
+        # entry, so its id stays unique.
+        self.__model_hashes: OrderedDict[int, Tuple[bytes, str]] = OrderedDict()
+
+        if self.optimized_model_directory is not None:
+            os.makedirs(self.optimized_model_directory, exist_ok=True)
+
+    def __hash_model(self, model: bytes) -> str:
+        entry = self.__model_hashes.get(id(model), None)
+        if entry is not None and entry[0] is model:
+            self.__model_hashes.move_to_end(id(model))
+            return entry[1]
+
+        digest = hashlib.sha256(model).hexdigest()
+        self.__model_hashes[id(model)] = (model, digest)
+        while len(self.__model_hashes) > self.max_sessions:
+            self.__model_hashes.popitem(last=False)
+        return digest
+
+    def get_session(
+        self,
+        model: bytes,
+        providers: List[str],
+        session_config: Optional[Dict[str, str]] = None,
+    ) -> ort.InferenceSession:
+        """Returns a session for the given model, creating it if necessary"""
+        options = session_config or {}
+        with self.__lock:
+            model_hash = self.__hash_model(model)
+            key = hashlib.sha256(
+                repr(
+                    (ort.__version__, model_hash, providers, sorted(options.items()))
+                ).encode("utf-8")
+            ).hexdigest()
+
+            entry = self.__sessions.get(key, None)
+            if entry is not None:
+                self.__sessions.move_to_end(key)
+                return entry[0]
+
+            session = self.__create_session(key, model, providers, options)
+
+            size = len(model)
+            self.__sessions[key] = (session, size)
+            self.__bytes += size
+            while len(self.__sessions) > 1 and (
+                len(self.__sessions) > self.max_sessions
+                or self.__bytes > self.max_bytes
+            ):
+                _, (_, old_size) = self.__sessions.popitem(last=False)
+                self.__bytes -= old_size
+            return session
+
+    def __create_session(
+        self,
+        key: str,
+        model: bytes,
+        providers: List[str],
+        options: Dict[str, str],
+    ) -> ort.InferenceSession:
+        session_options = ort.SessionOptions()
+        for name, value in options.items():
+            session_options.add_session_config_entry(name, value)
+
+        if self.optimized_model_directory is None:
+            return ort.InferenceSession(
+                model, sess_options=session_options, providers=providers
+            )
+
+        optimized_path = os.path.join(self.optimized_model_directory, f"{key}.onnx")
+        if os.path.isfile(optimized_path):
+            try:
+                session_options.graph_optimization_level = (
+                    ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+                )
+                return ort.InferenceSession(
+                    optimized_path, sess_options=session_options, providers=providers
+                )
+            except Exception as e:
+                logger.warning(f"Failed to load optimized ONNX model, ignoring it: {e}")
+                os.remove(optimized_path)
+                session_options.graph_optimization_level = (
+                    ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                )
+
+        # ONNX Runtime writes the file itself, so it is moved into place afterwards to
+        # never leave incomplete models behind
+        temp_path = f"{optimized_path}.{os.getpid()}.tmp"
+        session_options.optimized_model_filepath = temp_path
+        session = ort.InferenceSession(
+            model, sess_options=session_options, providers=providers
+        )
+        try:
+            os.replace(temp_path, optimized_path)
+        except OSError as e:
+            logger.warning(f"Failed to store optimized ONNX model: {e}")
+        return session
+
+    def clear(self):
+        with self.__lock:
+            self.__sessions.clear()
+            self.__model_hashes.clear()
+            self.__bytes = 0
+
+
+session_cache = OnnxSessionCache(
+    max_sessions=int(os.environ.get("CHAINNER_ONNX_SESSIONS", "4")),
+    max_bytes=int(os.environ.get("CHAINNER_ONNX_SESSION_CACHE_MB", "2048")) * 1024**2,
+    optimized_model_directory=os.path.join(os.environ["CHAINNER_CACHE_DIR"], "onnx")
+    if "CHAINNER_CACHE_DIR" in os.environ
+    else None,
+)
+
+
+def get_onnx_session(model: bytes, device: str) -> ort.InferenceSession:
+    return session_cache.get_session(model, get_onnx_providers(device))
@@ -2,152 +2,156 @@ from __future__ import annotations
 
 import gc
 import os
-from functools import reduce
-from operator import mul
 from typing import Tuple, Union
 
 import torch
 from sanic.log import logger
 from torch import Tensor
 
+from .pytorch_model_cache import prepared_models
+from .tiler import (
+    TileBlend,
+    TileBlender,
+    TileGrid,
+    get_min_tile_size,
+    reduce_tile_size,
+    split_memory,
+)
 
-def torch_center_crop(tensor, crop_x, crop_y):
-    x, y = tensor.size()[-2:]
-    start_x = x // 2 - (crop_x // 2)
-    start_y = y // 2 - (crop_y // 2)
-    return tensor[..., start_x : start_x + crop_x, start_y : start_y + crop_y]
 
+def is_out_of_memory_error(e: RuntimeError) -> bool:
+    return "allocate" in str(e) or "CUDA" in str(e)
 
-def torch_center_replace(tensor, crop_x, crop_y, replacement):
-    x, y = tensor.size()[-2:]
-    start_x = x // 2 - (crop_x // 2)
-    start_y = y // 2 - (crop_y // 2)
-    tensor[..., start_x : start_x + crop_x, start_y : start_y + crop_y] = replacement
-    return tensor
+
+def estimate_tile_bytes(model: torch.nn.Module, tile_bytes: int) -> float:
+    """Estimates the memory required to upscale a tile of the given size"""
+    model_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+    return (model_bytes / (1024 * 52)) * tile_bytes
+
+
+def get_max_batch_size(
+    model: torch.nn.Module, device: torch.device, tile_bytes: int
+) -> int:
+    """Returns the number of tiles that should fit into free memory at once"""
+    if device.type == "cuda":
+        free, _ = torch.cuda.mem_get_info(device)  # type: ignore
+        return max(1, int(free // estimate_tile_bytes(model, tile_bytes)))
+    # Larger batches barely help on the CPU, but still cost memory
+    return 4
+
+
+@torch.inference_mode()
+def process_tiles(
+    lr_img: Tensor,
+    model: torch.nn.Module,
+    grid: TileGrid,
+    blend: str,
+    batch_size: int,
+) -> Tensor:
+    """
+    Upscales the image tiles of the given grid, `batch_size` tiles at a time.
+
+    The tiles are written into a preallocated output and their overlaps are blended.
+    """
+    device = torch.device(os.environ["device"])
+    dtype = next(model.parameters()).dtype
+    b = lr_img.shape[0]
+
+    blender = TileBlender(grid, blend, channels_first=True)
+    for batch_start in range(0, len(grid.tiles), batch_size):
+        batch_tiles = grid.tiles[batch_start : batch_start + batch_size]
+        d_batch = torch.cat(
+            [lr_img[(..., *grid.get_slices(tile))] for tile in batch_tiles]
+        ).to(device, dtype)
+        if prepared_models.is_channels_last(model):
+            d_batch = d_batch.to(memory_format=torch.channels_last)  # type: ignore
+        result = model(d_batch).float().cpu().numpy()
+        del d_batch
+
+        for i, tile in enumerate(batch_tiles):
+            blender.add(tile, result[i * b : (i + 1) * b])
+        del result
+
+    return torch.from_numpy(blender.finish())
 
 
 @torch.inference_mode()
 def auto_split_process(
     lr_img: Tensor,
     model: torch.nn.Module,
-    scale: int = 4,
     overlap: int = 16,
-    max_depth: Union[int, None] = None,
-    current_depth: int = 1,
-) -> Tuple[Tensor, int]:
+    tile_size: Union[Tuple[int, int], None] = None,
+    blend: str = TileBlend.LINEAR,
+) -> Tuple[Tensor, Tuple[int, int]]:
     """
-    Run PyTorch upscaling with automatic recursive tile splitting based on ability to process with current size
+    Run PyTorch upscaling with automatic tile splitting based on ability to process with current size.
+
+    The image is upscaled as a grid of equally-sized tiles that are processed in batches
+    sized to fit into free memory. If no tile size is given, the tile and batch size
+    that last worked for this model and images of similar size are used, or else the
+    largest tile size that is estimated to fit. If the device runs out of memory anyway, the batch size
+    and then the tile size are reduced until the image can be processed.
+
+    Returns the upscaled image and the tile size used.
     """
-    # Original code: https://github.com/JoeyBallentine/ESRGAN/blob/master/utils/dataops.py
-
-    # if os.environ["killed"] == "True":
-    #     torch.cuda.empty_cache()
-    #     gc.collect()
-    #     raise RuntimeError("Upscaling killed mid-processing")
-
-    logger.debug(
-        f"auto_split_process: scale={scale}, overlap={overlap}, max_depth={max_depth}, current_depth={current_depth}"
-    )
-
-    # Prevent splitting from causing an infinite out-of-vram loop
-    if current_depth > 15:
-        torch.cuda.empty_cache()
-        gc.collect()
-        raise RuntimeError("Splitting stopped to prevent infinite loop")
-
-    # Attempt to upscale if unknown depth or if reached known max depth
-    if max_depth is None or max_depth == current_depth:
-        d_img = None
+    device = torch.device(os.environ["device"])
+    b, c, h, w = lr_img.shape
+    tile_h, tile_w = tile_size or (h, w)
+    element_size = next(model.parameters()).element_size()
+    min_tile_size = get_min_tile_size(overlap)
+    batch_size: Union[int, None] = None
+
+    # The split that worked for the previous image of a similar size likely works for
+    # this one too
+    remember = tile_size is None
+    memory_key = (str(device), next(model.parameters()).dtype, b, c, overlap)
+    remembered = split_memory.get(model, memory_key, h, w) if remember else None
+    if remembered is not None:
+        tile_h, tile_w, batch_size = remembered
+    elif tile_size is None and device.type == "cuda":
+        # Start with the largest tile size that is estimated to fit
+        free, _ = torch.cuda.mem_get_info(device)  # type: ignore
+        while (
+            max(tile_h, tile_w) > min_tile_size
+            and estimate_tile_bytes(model, b * c * tile_h * tile_w * element_size)
+            > free
+        ):
+            tile_h, tile_w = reduce_tile_size((tile_h, tile_w))
+
+    while True:
+        grid = TileGrid(h, w, (tile_h, tile_w), overlap)
+        if batch_size is None:
+            tile_bytes = b * c * grid.tile_h * grid.tile_w * element_size
+            batch_size = min(
+                len(grid.tiles), get_max_batch_size(model, device, tile_bytes)
+            )
+
+        logger.debug(
+            f"auto_split_process: overlap={overlap}, tile_size={grid.tile_h}x{grid.tile_w}, batch_size={batch_size}"
+        )
         try:
-            device = torch.device(os.environ["device"])
-            d_img = lr_img.to(device)
-            if os.environ["isFp16"] == "True":
-                model = model.half()
-                d_img = d_img.half()
-            else:
-                model = model.float()
-                d_img = d_img.float()
-            result = model(d_img)
-            result = result.detach().cpu()
-            del d_img
-            return result, current_depth
+            output = process_tiles(lr_img, model, grid, blend, batch_size)
+            if remember:
+                split_memory.set(
+                    model,
+                    memory_key,
+                    h,
+                    w,
+                    (grid.tile_h, grid.tile_w, batch_size),
+                )
+            return output, (grid.tile_h, grid.tile_w)
         except RuntimeError as e:
-            # Check to see if its actually the CUDA out of memory error
-            if "allocate" in str(e) or "CUDA" in str(e):
-                # Collect garbage (clear VRAM)
-                gc.collect()
-                if d_img is not None:
-                    d_img.detach().cpu()
-                    del d_img
-                torch.cuda.empty_cache()
             # Re-raise the exception if not an OOM error
-            else:
+            if not is_out_of_memory_error(e):
                 raise
-
-    b, c, h, w = lr_img.shape
-
-    # Split image into 4ths
-    top_left = lr_img[..., : h // 2 + overlap, : w // 2 + overlap]
-    top_right = lr_img[..., : h // 2 + overlap, w // 2 - overlap :]
-    bottom_left = lr_img[..., h // 2 - overlap :, : w // 2 + overlap]
-    bottom_right = lr_img[..., h // 2 - overlap :, w // 2 - overlap :]
-
-    # Recursively upscale the quadrants
-    # After we go through the top left quadrant, we know the maximum depth and no longer need to test for out-of-memory
-    top_left_rlt, depth = auto_split_process(
-        top_left,
-        model,
-        scale=scale,
-        overlap=overlap,
-        max_depth=max_depth,
-        current_depth=current_depth + 1,
-    )
-    top_right_rlt, _ = auto_split_process(
-        top_right,
-        model,
-        scale=scale,
-        overlap=overlap,
-        max_depth=depth,
-        current_depth=current_depth + 1,
-    )
-    bottom_left_rlt, _ = auto_split_process(
-        bottom_left,
-        model,
-        scale=scale,
-        overlap=overlap,
-        max_depth=depth,
-        current_depth=current_depth + 1,
-    )
-    bottom_right_rlt, _ = auto_split_process(
-        bottom_right,
-        model,
-        scale=scale,
-        overlap=overlap,
-        max_depth=depth,
-        current_depth=current_depth + 1,
-    )
-
-    # Define output shape
-    out_h = h * scale
-    out_w = w * scale
-
-    # Create blank output image
-    output_img = torch.empty(
-        (b, c, out_h, out_w), dtype=lr_img.dtype, device=lr_img.device
-    )
-
-    # Fill output image with tiles, cropping out the overlaps
-    output_img[..., : out_h // 2, : out_w // 2] = top_left_rlt[
-        ..., : out_h // 2, : out_w // 2
-    ]
-    output_img[..., : out_h // 2, -out_w // 2 :] = top_right_rlt[
-        ..., : out_h // 2, -out_w // 2 :
-    ]
-    output_img[..., -out_h // 2 :, : out_w // 2] = bottom_left_rlt[
-        ..., -out_h // 2 :, : out_w // 2
-    ]
-    output_img[..., -out_h // 2 :, -out_w // 2 :] = bottom_right_rlt[
-        ..., -out_h // 2 :, -out_w // 2 :
-    ]
-
-    return output_img, depth
+            # Collect garbage (clear VRAM)
+            gc.collect()
+            torch.cuda.empty_cache()
+
+        if batch_size > 1:
+            batch_size //= 2
+        elif max(grid.tile_h, grid.tile_w) > min_tile_size:
+            tile_h, tile_w = reduce_tile_size((grid.tile_h, grid.tile_w))
+            batch_size = None
+        else:
+            raise RuntimeError("Unable to upscale the image with the available memory")
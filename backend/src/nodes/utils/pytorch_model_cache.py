@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import copy
+import os
+import threading
+import weakref
+from typing import Dict, Tuple
+
+import torch
+from sanic.log import logger
+
+PreparedKey = Tuple[str, torch.dtype, bool]
+
+
+def use_channels_last() -> bool:
+    return os.environ.get("CHAINNER_CHANNELS_LAST", "0") == "1"
+
+
+class PreparedModelCache:
+    """
+    Keeps copies of models converted for a specific device, precision, and memory format.
+
+    The given models are never modified. If a model needs to be converted, the converted
+    copy is created once and kept for as long as the original model is alive, so repeated
+    upscales neither re-cast all parameters nor affect other users of the same model.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__prepared: weakref.WeakKeyDictionary[
+            torch.nn.Module, Dict[PreparedKey, torch.nn.Module]
+        ] = weakref.WeakKeyDictionary()
+        self.__channels_last: weakref.WeakSet[torch.nn.Module] = weakref.WeakSet()
+
+    def get(
+        self,
+        model: torch.nn.Module,
+        device: torch.device,
+        fp16: bool,
+        channels_last: bool = False,
+    ) -> torch.nn.Module:
+        """Returns a version of the given model on the given device and in the given precision"""
+        dtype = torch.float16 if fp16 else torch.float32
+        parameter = next(model.parameters())
+        on_device = parameter.device.type == device.type and (
+            device.index is None or parameter.device.index == device.index
+        )
+        if on_device and parameter.dtype == dtype and not channels_last:
+            return model
+
+        key: PreparedKey = (str(device), dtype, channels_last)
+        with self.__lock:
+            prepared = self.__prepared.setdefault(model, {})
+            if key not in prepared:
+                logger.info(f"Preparing model for {device} ({dtype})")
+                model_copy = copy.deepcopy(model).to(device, dtype)
+                if channels_last:
+                    model_copy = model_copy.to(memory_format=torch.channels_last)  # type: ignore
+                    self.__channels_last.add(model_copy)
+                model_copy.eval()
+                prepared[key] = model_copy
+            return prepared[key]
+
+    def is_channels_last(self, model: torch.nn.Module) -> bool:
+        """Returns whether the given model was prepared with the channels last format"""
+        return model in self.__channels_last
+
+
+prepared_models = PreparedModelCache()
@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import gc
+import math
+import threading
+import weakref
+from typing import Any, Callable, Dict, Hashable, List, Tuple, Union
+
+import numpy as np
+from sanic.log import logger
+
+
+class TileBlend:
+    LINEAR = "linear"
+    COSINE = "cosine"
+
+
+def get_max_overlap(tile_size: int) -> int:
+    """Tiles overlap by at most half their size, so every tile covers new pixels"""
+    return tile_size // 2
+
+
+def check_tile_overlap(tile_size: int, overlap: int):
+    """Raises an error if tiles of the given size (0 for automatic) can't overlap that much"""
+    if tile_size > 0 and overlap > get_max_overlap(tile_size):
+        raise ValueError(
+            f"The tile overlap ({overlap}px) must be at most half of the tile size ({tile_size}px)."
+        )
+
+
+def get_tile_starts(size: int, tile_size: int, overlap: int) -> List[int]:
+    """
+    Returns the start positions of equally-sized tiles covering `size` pixels.
+
+    Neighboring tiles overlap by at least `overlap` pixels, but at most by half a tile,
+    e.g. if the tile size was reduced automatically. The tiles are spread evenly, so no
+    tile extends past the edge of the image and no padding is necessary.
+    """
+    if tile_size >= size:
+        return [0]
+    overlap = min(overlap, get_max_overlap(tile_size))
+    count = math.ceil((size - tile_size) / (tile_size - overlap)) + 1
+    return [round(i * (size - tile_size) / (count - 1)) for i in range(count)]
+
+
+def get_blend_ramp(length: int, blend: str) -> np.ndarray:
+    """Returns the weights for blending in a tile over `length` pixels"""
+    x = (np.arange(length, dtype=np.float32) + 0.5) / length
+    if blend == TileBlend.COSINE:
+        return 0.5 - 0.5 * np.cos(np.pi * x)
+    assert blend == TileBlend.LINEAR, f"Invalid tile blend {blend}"
+    return x
+
+
+def get_overlap_weights(overlap: int, blend: str) -> np.ndarray:
+    """
+    Returns the weights for blending in a tile over an overlap of `overlap` pixels.
+
+    The pixels at the edge of a tile are affected by the padding of the model, so the
+    outer quarter of the overlap is ignored and the tile is blended in over the middle
+    half. In the inner quarter, only this tile is used.
+    """
+    margin = overlap // 4
+    weights = np.ones(overlap, dtype=np.float32)
+    weights[:margin] = 0
+    weights[margin : overlap - margin] = get_blend_ramp(overlap - 2 * margin, blend)
+    return weights
+
+
+def get_tile_weights(
+    starts: List[int], index: int, tile_size: int, scale: int, blend: str
+) -> np.ndarray:
+    """
+    Returns the 1D blend weights of the tile at `starts[index]` in output space.
+
+    The weights ramp up/down over the overlap with the previous/next tile.
+    """
+    weights = np.ones(tile_size * scale, dtype=np.float32)
+    if index > 0:
+        overlap = (starts[index - 1] + tile_size - starts[index]) * scale
+        if overlap > 0:
+            weights[:overlap] *= get_overlap_weights(overlap, blend)
+    if index < len(starts) - 1:
+        overlap = (starts[index] + tile_size - starts[index + 1]) * scale
+        if overlap > 0:
+            weights[-overlap:] *= get_overlap_weights(overlap, blend)[::-1]
+    return weights
+
+
+class TileGrid:
+    """A grid of equally-sized, overlapping tiles covering an image"""
+
+    def __init__(self, h: int, w: int, tile_size: Tuple[int, int], overlap: int):
+        self.h = h
+        self.w = w
+        self.tile_h = min(tile_size[0], h)
+        self.tile_w = min(tile_size[1], w)
+        self.overlap = overlap
+
+        self.y_starts = get_tile_starts(h, self.tile_h, overlap)
+        self.x_starts = get_tile_starts(w, self.tile_w, overlap)
+        self.tiles: List[Tuple[int, int]] = [
+            (y, x) for y in range(len(self.y_starts)) for x in range(len(self.x_starts))
+        ]
+
+    def get_slices(self, tile: Tuple[int, int]) -> Tuple[slice, slice]:
+        """Returns the row and column slices of the given tile"""
+        y, x = tile
+        return (
+            slice(self.y_starts[y], self.y_starts[y] + self.tile_h),
+            slice(self.x_starts[x], self.x_starts[x] + self.tile_w),
+        )
+
+
+class TileBlender:
+    """
+    Assembles the upscaled tiles of a `TileGrid` into a single image.
+
+    Tiles are written into a preallocated output, weighted by a window that ramps over
+    their overlaps. The upscale factor is derived from the first tile.
+    """
+
+    def __init__(self, grid: TileGrid, blend: str, channels_first: bool):
+        self.grid = grid
+        self.blend = blend
+        self.channels_first = channels_first
+
+        self.scale = 0
+        self.output: Union[np.ndarray, None] = None
+        self.__y_weights: List[np.ndarray] = []
+        self.__x_weights: List[np.ndarray] = []
+
+    def __init_output(self, result: np.ndarray):
+        grid = self.grid
+        if self.channels_first:
+            # (..., C, H, W)
+            self.scale = result.shape[-1] // grid.tile_w
+            shape = (
+                *result.shape[:-2],
+                grid.h * self.scale,
+                grid.w * self.scale,
+            )
+        else:
+            # (H, W, ...)
+            self.scale = result.shape[1] // grid.tile_w
+            shape = (grid.h * self.scale, grid.w * self.scale, *result.shape[2:])
+        self.output = np.zeros(shape, dtype=np.float32)
+
+        self.__y_weights = [
+            get_tile_weights(grid.y_starts, y, grid.tile_h, self.scale, self.blend)
+            for y in range(len(grid.y_starts))
+        ]
+        self.__x_weights = [
+            get_tile_weights(grid.x_starts, x, grid.tile_w, self.scale, self.blend)
+            for x in range(len(grid.x_starts))
+        ]
+
+    def add(self, tile: Tuple[int, int], result: np.ndarray):
+        """Adds the upscaled result of the given tile"""
+        if self.output is None:
+            self.__init_output(result)
+        assert self.output is not None
+
+        y, x = tile
+        weights = self.__y_weights[y][:, None] * self.__x_weights[x][None, :]
+        y_slice, x_slice = self.grid.get_slices(tile)
+        y_slice = slice(y_slice.start * self.scale, y_slice.stop * self.scale)
+        x_slice = slice(x_slice.start * self.scale, x_slice.stop * self.scale)
+        if self.channels_first:
+            self.output[..., y_slice, x_slice] += result * weights
+        else:
+            if result.ndim == 3:
+                weights = weights[:, :, None]
+            self.output[y_slice, x_slice, ...] += result * weights
+
+    def finish(self) -> np.ndarray:
+        """Returns the assembled image"""
+        assert self.output is not None
+        grid = self.grid
+
+        # Normalize the blended overlaps. The weights of every tile are the product of a
+        # row and a column weight, so their sum is too.
+        y_total = np.zeros(grid.h * self.scale, dtype=np.float32)
+        for y, start in enumerate(grid.y_starts):
+            y_total[
+                start * self.scale : (start + grid.tile_h) * self.scale
+            ] += self.__y_weights[y]
+        x_total = np.zeros(grid.w * self.scale, dtype=np.float32)
+        for x, start in enumerate(grid.x_starts):
+            x_total[
+                start * self.scale : (start + grid.tile_w) * self.scale
+            ] += self.__x_weights[x]
+        total = y_total[:, None] * x_total[None, :]
+        if self.channels_first:
+            self.output /= total
+        else:
+            self.output /= total if self.output.ndim == 2 else total[:, :, None]
+        return self.output
+
+
+def reduce_tile_size(tile_size: Tuple[int, int]) -> Tuple[int, int]:
+    """Halves the longer side of the given tile size"""
+    tile_h, tile_w = tile_size
+    if tile_h > tile_w:
+        return math.ceil(tile_h / 2), tile_w
+    return tile_h, math.ceil(tile_w / 2)
+
+
+def get_min_tile_size(overlap: int) -> int:
+    return 2 * overlap + 16
+
+
+def get_resolution_bucket(h: int, w: int) -> Tuple[int, int]:
+    """Rounds the given image size up to the next powers of 2"""
+    return 1 << max(h - 1, 0).bit_length(), 1 << max(w - 1, 0).bit_length()
+
+
+class SplitMemory:
+    """
+    Remembers how images were split successfully.
+
+    Entries are stored per model, per additional key (e.g. the device), and per
+    resolution bucket, so images of similar size can start with a split that is known
+    to work instead of discovering it through out-of-memory errors. Models are
+    referenced weakly, so their entries disappear together with them.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__entries: weakref.WeakKeyDictionary[
+            Any, Dict[Tuple[Hashable, Tuple[int, int]], Any]
+        ] = weakref.WeakKeyDictionary()
+
+    def get(self, model: Any, key: Hashable, h: int, w: int) -> Union[Any, None]:
+        with self.__lock:
+            entries = self.__entries.get(model, None)
+            if entries is None:
+                return None
+            return entries.get((key, get_resolution_bucket(h, w)), None)
+
+    def set(self, model: Any, key: Hashable, h: int, w: int, value: Any):
+        with self.__lock:
+            entries = self.__entries.setdefault(model, {})
+            entries[(key, get_resolution_bucket(h, w))] = value
+
+
+split_memory = SplitMemory()
+
+
+def auto_split(
+    img: np.ndarray,
+    upscale: Callable[[np.ndarray], np.ndarray],
+    is_out_of_memory_error: Callable[[Exception], bool],
+    tile_size: Union[Tuple[int, int], None] = None,
+    overlap: int = 16,
+    blend: str = TileBlend.LINEAR,
+    channels_first: bool = False,
+    model: Any = None,
+    model_key: Hashable = None,
+) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Upscales the given image tile by tile.
+
+    If no tile size is given, the tile size that last worked for `model` and images of
+    similar size is used, or the whole image is tried first. If `upscale` runs out of
+    memory, the tile size is halved until the image can be processed.
+
+    Returns the upscaled image and the tile size used.
+    """
+    h, w = img.shape[-2:] if channels_first else img.shape[:2]
+    remember = tile_size is None and model is not None
+    if remember:
+        tile_size = split_memory.get(model, model_key, h, w)
+    tile_h, tile_w = tile_size or (h, w)
+
+    while True:
+        grid = TileGrid(h, w, (tile_h, tile_w), overlap)
+        blender = TileBlender(grid, blend, channels_first)
+        logger.debug(
+            f"auto_split: overlap={overlap}, tile_size={grid.tile_h}x{grid.tile_w}, tiles={len(grid.tiles)}"
+        )
+        try:
+            for tile in grid.tiles:
+                y_slice, x_slice = grid.get_slices(tile)
+                if channels_first:
+                    blender.add(tile, upscale(img[..., y_slice, x_slice]))
+                else:
+                    blender.add(tile, upscale(img[y_slice, x_slice, ...]))
+            if remember:
+                split_memory.set(model, model_key, h, w, (grid.tile_h, grid.tile_w))
+            return blender.finish(), (grid.tile_h, grid.tile_w)
+        except Exception as e:
+            # Re-raise the exception if not an OOM error
+            if not is_out_of_memory_error(e):
+                raise
+            del blender
+            gc.collect()
+
+        if max(grid.tile_h, grid.tile_w) <= get_min_tile_size(overlap):
+            raise RuntimeError(
+                "Upscaling stopped due to an out of memory error. Try setting a tile size, or using a smaller one if already set."
+            )
+        tile_h, tile_w = reduce_tile_size((grid.tile_h, grid.tile_w))
+        logger.info(f"Out of memory, reducing tile size to {tile_h}x{tile_w}")
@@ -2,18 +2,15 @@
 # From https://github.com/victorca25/iNNfer/blob/main/utils/utils.py
 from __future__ import annotations
 
-from typing import Callable, Tuple, Type, Union
+import sys
+from typing import TYPE_CHECKING, Callable, List, Tuple, Type, Union
 
 import numpy as np
 from sanic.log import logger
 
-try:
-    import torch
+# torch is imported lazily, so nodes that don't use it don't have to load it
+if TYPE_CHECKING:
     from torch import Tensor
-except:
-    torch = None
-    tensor = None
-    logger.info("modules not installed")
 
 MAX_VALUES_BY_DTYPE = {
     np.dtype("int8"): 127,
@@ -36,6 +33,12 @@ def get_h_w_c(image: np.ndarray) -> Tuple[int, int, int]:
     return h, w, c
 
 
+def is_tensor(x) -> bool:
+    """Returns whether the given object is a torch tensor, without importing torch"""
+    torch = sys.modules.get("torch", None)
+    return torch is not None and isinstance(x, torch.Tensor)
+
+
 def bgr_to_rgb(image: Tensor) -> Tensor:
     # flip image channels
     # https://github.com/pytorch/pytorch/issues/229
@@ -68,7 +71,7 @@ def denorm(x, min_max=(-1.0, 1.0)):
     for use with proper act in Generator output (ie. tanh)
     """
     out = (x - min_max[0]) / (min_max[1] - min_max[0])
-    if isinstance(x, Tensor):
+    if is_tensor(x):
         return out.clamp(0, 1)
     elif isinstance(x, np.ndarray):
         return np.clip(out, 0, 1)
@@ -79,7 +82,7 @@ def denorm(x, min_max=(-1.0, 1.0)):
 def norm(x):
     """Normalize (z-norm) from [0,1] range to [-1,1]"""
     out = (x - 0.5) * 2.0
-    if isinstance(x, Tensor):
+    if is_tensor(x):
         return out.clamp(-1, 1)
     elif isinstance(x, np.ndarray):
         return np.clip(out, -1, 1)
@@ -100,6 +103,12 @@ def np2tensor(
         img (numpy array): the input image numpy array
         add_batch (bool): choose if new tensor needs batch dimension added
     """
+    try:
+        import torch
+    except ImportError:
+        logger.info("modules not installed")
+        torch = None
+
     if torch is not None:
         if not isinstance(img, np.ndarray):  # images expected to be uint8 -> 255
             raise TypeError("Got unexpected object type, expected np.ndarray")
@@ -154,7 +163,7 @@ def tensor2np(
     Output:
         img (np array): 3D(H,W,C) or 2D(H,W), [0,255], np.uint8 (default)
     """
-    if not isinstance(img, Tensor):
+    if not is_tensor(img):
         raise TypeError("Got unexpected object type, expected Tensor")
     n_dim = img.dim()
 
@@ -326,12 +335,17 @@ def convenient_upscale(
     img: np.ndarray,
     input_channels: int,
     upscale: Callable[[np.ndarray], np.ndarray],
+    upscale_batch: Union[Callable[[List[np.ndarray]], List[np.ndarray]], None] = None,
 ) -> np.ndarray:
     """
     Upscales the given image in an intuitive/convenient way.
 
     This method guarantees that the `upscale` function will be called with an image with
     `input_channels` number of channels.
+
+    If the backend can upscale multiple images of the same size at once, it may pass
+    `upscale_batch`. It will then be used in cases where more than one image needs to
+    be upscaled.
     """
 
     _, _, c = get_h_w_c(img)
@@ -345,14 +359,15 @@ def convenient_upscale(
             output = upscale(img[:, :, :3])
             output = np.dstack((output, np.full(output.shape[:-1], unique[0])))
         else:
-            img1 = np.copy(img[:, :, :3])
-            img2 = np.copy(img[:, :, :3])
-            for c in range(3):
-                img1[:, :, c] *= img[:, :, 3]
-                img2[:, :, c] = (img2[:, :, c] - 1) * img[:, :, 3] + 1
-
-            output1 = upscale(img1)
-            output2 = upscale(img2)
+            alpha = img[:, :, 3:4]
+            img1 = img[:, :, :3] * alpha
+            img2 = (img[:, :, :3] - 1) * alpha + 1
+
+            if upscale_batch is not None:
+                output1, output2 = upscale_batch([img1, img2])
+            else:
+                output1 = upscale(img1)
+                output2 = upscale(img2)
             alpha = 1 - np.mean(output2 - output1, axis=2)  # type: ignore
             output = np.dstack((output1, alpha))
     else:
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+from typing import Any, Optional, Union
+
+import cv2
+import numpy as np
+from sanic.log import logger
+
+
+class VideoEncoder:
+    OPENCV = "opencv"
+    LIBX264 = "libx264"
+    LIBX265 = "libx265"
+    LIBVPX_VP9 = "libvpx-vp9"
+
+
+# Marks the end of a frame queue
+_END = object()
+
+
+class VideoReader:
+    """
+    Decodes the frames of a video on a background thread.
+
+    Decoded frames are kept in a bounded buffer, so decoding the next frames overlaps with
+    processing the current one without reading the whole video into memory.
+    """
+
+    def __init__(self, path: str, buffer_size: int = 8):
+        self.cap = cv2.VideoCapture(path)
+        self.fps = int(self.cap.get(cv2.CAP_PROP_FPS))
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        self.__frames: queue.Queue = queue.Queue(maxsize=buffer_size)
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__decode, daemon=True)
+        self.__thread.start()
+
+    def __put(self, item: Any):
+        while not self.__stopped.is_set():
+            try:
+                self.__frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def __decode(self):
+        try:
+            while not self.__stopped.is_set():
+                ret, frame = self.cap.read()
+                # if frame is read correctly ret is True
+                if not ret:
+                    break
+                self.__put(frame)
+        except Exception as e:
+            self.__put(e)
+        finally:
+            self.__put(_END)
+
+    def read(self) -> Optional[np.ndarray]:
+        """Returns the next frame, or None if the end of the video was reached"""
+        item = self.__frames.get()
+        if item is _END:
+            # Let other readers know as well
+            self.__frames.put(_END)
+            return None
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        self.__stopped.set()
+        self.__thread.join()
+        self.cap.release()
+
+
+class OpenCvVideoBackend:
+    """Writes frames using `cv2.VideoWriter`"""
+
+    def __init__(self, path: str, video_type: str, fps: float, width: int, height: int):
+        codec = "avc1" if video_type == "mp4" else "divx"
+        logger.info(f"Trying to open writer with codec: {codec}")
+        self.writer = cv2.VideoWriter(
+            filename=path,
+            fourcc=cv2.VideoWriter_fourcc(*codec),
+            fps=fps,
+            frameSize=(width, height),
+        )
+
+    def write(self, frame: np.ndarray):
+        self.writer.write(frame)
+
+    def release(self):
+        self.writer.release()
+
+
+class FfmpegVideoBackend:
+    """Pipes raw BGR frames into an FFmpeg process"""
+
+    def __init__(
+        self,
+        path: str,
+        fps: float,
+        width: int,
+        height: int,
+        codec: str,
+        crf: int,
+        pixel_format: str,
+    ):
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise RuntimeError(
+                "FFmpeg was not found. Please install FFmpeg and add it to your PATH, or use the OpenCV video encoder."
+            )
+
+        args = [
+            ffmpeg,
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "bgr24",
+            "-s",
+            f"{width}x{height}",
+            "-r",
+            str(fps),
+            "-i",
+            "-",
+            "-c:v",
+            codec,
+            "-crf",
+            str(crf),
+            "-pix_fmt",
+            pixel_format,
+        ]
+        if codec == VideoEncoder.LIBVPX_VP9:
+            # VP9 only uses the CRF value in constant quality mode
+            args.extend(["-b:v", "0"])
+        if pixel_format.startswith("yuv420"):
+            # Chroma subsampling requires even dimensions
+            args.extend(["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"])
+        args.append(path)
+
+        logger.info(f"Starting FFmpeg: {' '.join(args)}")
+        # FFmpeg may log more than fits into a pipe while frames are still written to
+        # it, so its errors go to a file that is only read once it exited
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stderr=self.log)
+
+    def write(self, frame: np.ndarray):
+        assert self.process.stdin is not None
+        self.process.stdin.write(np.ascontiguousarray(frame).tobytes())
+
+    def release(self):
+        self.process.communicate()
+        with self.log:
+            self.log.seek(0)
+            errors = self.log.read().decode("utf-8", "replace")
+        if self.process.returncode != 0:
+            raise RuntimeError(f"FFmpeg failed to encode the video: {errors}")
+
+
+class VideoWriter:
+    """
+    Encodes frames on a background thread.
+
+    `write` only blocks if the bounded frame buffer is full, so encoding overlaps with
+    processing the next frames.
+    """
+
+    def __init__(
+        self,
+        backend: Union[OpenCvVideoBackend, FfmpegVideoBackend],
+        buffer_size: int = 8,
+    ):
+        self.backend = backend
+        self.__frames: queue.Queue = queue.Queue(maxsize=buffer_size)
+        self.__error: Optional[Exception] = None
+        self.__thread = threading.Thread(target=self.__encode, daemon=True)
+        self.__thread.start()
+
+    def __encode(self):
+        while True:
+            frame = self.__frames.get()
+            if frame is _END:
+                break
+            if self.__error is not None:
+                # Keep draining the buffer so writers never block
+                continue
+            try:
+                self.backend.write(frame)
+            except Exception as e:
+                self.__error = e
+
+    def write(self, frame: np.ndarray):
+        if self.__error is not None:
+            raise self.__error
+        self.__frames.put(frame)
+
+    def close(self):
+        """Waits until all frames are encoded and closes the video file"""
+        self.__frames.put(_END)
+        self.__thread.join()
+        self.backend.release()
+        if self.__error is not None:
+            raise self.__error
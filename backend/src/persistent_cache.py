@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from sanic.log import logger
+
+# Bump this whenever the way keys are computed or entries are stored changes
+CACHE_FORMAT_VERSION = 1
+
+
+def get_value_size(value: Any) -> int:
+    """Returns the approximate number of bytes the given node output occupies"""
+    # Objects may reference each other (or themselves), so each is only counted once
+    visited: Set[int] = set()
+
+    def get_size(value: Any) -> int:
+        if id(value) in visited:
+            return 0
+        visited.add(id(value))
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (bytes, str)):
+            return len(value)
+        if isinstance(value, (list, tuple)):
+            return sum(get_size(v) for v in value)
+        parameters = getattr(value, "parameters", None)
+        if callable(parameters):
+            # PyTorch models
+            return sum(p.numel() * p.element_size() for p in parameters())
+        if hasattr(value, "__dict__"):
+            # e.g. NCNN model data
+            return sum(get_size(v) for v in vars(value).values())
+        return sys.getsizeof(value)
+
+    return get_size(value)
+
+
+def is_disk_storable(value: Any) -> bool:
+    """Returns whether the given node output can be written to the disk tier"""
+
+    def is_storable_item(item: Any) -> bool:
+        return isinstance(item, (np.ndarray, str, int, float, bool)) or item is None
+
+    if isinstance(value, tuple):
+        return all(is_storable_item(v) for v in value)
+    return is_storable_item(value)
+
+
+class CacheKeyBuilder:
+    """Computes the content-addressed key of a node output"""
+
+    def __init__(self, schema_id: str):
+        self.hasher = hashlib.sha256()
+        self.update("version", CACHE_FORMAT_VERSION)
+        self.update("schemaId", schema_id)
+        # Some nodes behave differently depending on the selected device and precision
+        self.update("device", os.environ.get("device", None))
+        self.update("isFp16", os.environ.get("isFp16", None))
+
+    def update(self, name: str, value: Any):
+        self.hasher.update(
+            json.dumps([name, value], sort_keys=True, allow_nan=True).encode("utf-8")
+        )
+
+    def add_upstream(self, key: str, index: int):
+        self.update("upstream", [key, index])
+
+    def add_literal(self, value: Any) -> bool:
+        """Adds a literal input value. Returns False if the value cannot be hashed."""
+        try:
+            self.update("literal", value)
+            return True
+        except (TypeError, ValueError):
+            return False
+
+    def add_file(self, path: str):
+        """Adds the modification time and size of a file input"""
+        try:
+            stat = os.stat(path)
+            self.update("file", [stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            self.update("file", None)
+
+    def digest(self) -> str:
+        return self.hasher.hexdigest()
+
+
+class PersistentCache:
+    """
+    A cache of node outputs that lives across runs.
+
+    Outputs are addressed by a hash of everything that determines them (see
+    `CacheKeyBuilder`). Entries live in a bounded in-memory tier and, if a directory is
+    given, in a bounded on-disk tier. Both tiers evict the least recently used entries.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int,
+        disk_directory: Optional[str] = None,
+        max_disk_bytes: int = 0,
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_directory = disk_directory
+        self.max_disk_bytes = max_disk_bytes
+
+        self.__lock = threading.Lock()
+        self.__memory: OrderedDict[str, Tuple[Any, int]] = OrderedDict()
+        self.__memory_bytes = 0
+        self.__disk: OrderedDict[str, int] = OrderedDict()
+        self.__disk_bytes = 0
+        # Entries that are being written to the disk without holding the lock
+        self.__writing: Set[str] = set()
+
+        if self.disk_directory is not None:
+            os.makedirs(self.disk_directory, exist_ok=True)
+            self.__load_disk_index()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached output for the given key, or None if there is none"""
+        with self.__lock:
+            entry = self.__memory.get(key, None)
+            if entry is not None:
+                self.__memory.move_to_end(key)
+                return entry[0]
+            if key not in self.__disk:
+                return None
+            self.__disk.move_to_end(key)
+
+        # Other threads may use the cache while the entry is read
+        try:
+            return self.__read_from_disk(key)
+        except Exception as e:
+            logger.warning(f"Failed to read cache entry {key} from disk: {e}")
+            self.__remove_from_disk(key)
+            return None
+
+    def put(self, key: str, value: Any):
+        """Caches the given output"""
+        size = get_value_size(value)
+        # Outputs that don't fit into memory are written to the disk after releasing
+        # the lock, so other threads may use the cache in the meantime
+        spilled: List[Tuple[str, Any, int]] = []
+        with self.__lock:
+            if key in self.__memory:
+                self.__memory.move_to_end(key)
+                return
+            if size > self.max_memory_bytes:
+                spilled.append((key, value, size))
+            else:
+                self.__memory[key] = (value, size)
+                self.__memory_bytes += size
+                while self.__memory_bytes > self.max_memory_bytes:
+                    old_key, (old_value, old_size) = self.__memory.popitem(last=False)
+                    self.__memory_bytes -= old_size
+                    spilled.append((old_key, old_value, old_size))
+
+        for spilled_key, spilled_value, spilled_size in spilled:
+            self.__store_on_disk(spilled_key, spilled_value, spilled_size)
+
+    def __get_entry_path(self, key: str) -> str:
+        assert self.disk_directory is not None
+        return os.path.join(self.disk_directory, key)
+
+    def __load_disk_index(self):
+        entries: List[Tuple[float, str, int]] = []
+        assert self.disk_directory is not None
+        for name in os.listdir(self.disk_directory):
+            path = os.path.join(self.disk_directory, name)
+            if name.endswith(".deleted"):
+                # Left over from a process that stopped while deleting the entry
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            meta_path = os.path.join(path, "meta.json")
+            if not os.path.isfile(meta_path):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            entries.append((os.path.getmtime(meta_path), name, size))
+        for _, key, size in sorted(entries):
+            self.__disk[key] = size
+            self.__disk_bytes += size
+        self.__delete_entries(self.__evict_from_disk())
+
+    def __store_on_disk(self, key: str, value: Any, size: int):
+        if (
+            self.disk_directory is None
+            or size > self.max_disk_bytes
+            or not is_disk_storable(value)
+        ):
+            return
+        with self.__lock:
+            if key in self.__disk or key in self.__writing:
+                return
+            self.__writing.add(key)
+
+        path = self.__get_entry_path(key)
+        try:
+            os.makedirs(path, exist_ok=True)
+            items = value if isinstance(value, tuple) else (value,)
+            meta_items = []
+            for index, item in enumerate(items):
+                if isinstance(item, np.ndarray):
+                    np.save(os.path.join(path, f"{index}.npy"), item)
+                    meta_items.append({"array": f"{index}.npy"})
+                else:
+                    meta_items.append({"value": item})
+            # The meta file is written last, so incomplete entries are never read
+            with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"tuple": isinstance(value, tuple), "items": meta_items}, f)
+        except Exception as e:
+            logger.warning(f"Failed to write cache entry {key} to disk: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+            with self.__lock:
+                self.__writing.discard(key)
+            return
+
+        with self.__lock:
+            self.__writing.discard(key)
+            self.__disk[key] = size
+            self.__disk_bytes += size
+            evicted = self.__evict_from_disk()
+        self.__delete_entries(evicted)
+
+    def __read_from_disk(self, key: str) -> Any:
+        path = self.__get_entry_path(key)
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        items = []
+        for item in meta["items"]:
+            if "array" in item:
+                # Copy-on-write, so nodes may still modify the array they are given
+                items.append(np.load(os.path.join(path, item["array"]), mmap_mode="c"))
+            else:
+                items.append(item["value"])
+        return tuple(items) if meta["tuple"] else items[0]
+
+    def __remove_from_disk(self, key: str):
+        with self.__lock:
+            size = self.__disk.pop(key, None)
+            if size is None:
+                return
+            self.__disk_bytes -= size
+            removed = [self.__move_to_trash(key)]
+        self.__delete_entries(removed)
+
+    def __move_to_trash(self, key: str) -> str:
+        """
+        Renames the files of the given entry, so they can be deleted without holding
+        the lock while the entry may be written again.
+        """
+        path = self.__get_entry_path(key)
+        trash_path = f"{path}.{uuid.uuid4().hex}.deleted"
+        try:
+            os.rename(path, trash_path)
+        except OSError:
+            return path
+        return trash_path
+
+    def __evict_from_disk(self) -> List[str]:
+        """
+        Removes the least recently used entries until the disk tier fits, and returns
+        the paths of their files. The lock has to be held.
+        """
+        removed: List[str] = []
+        while self.__disk_bytes > self.max_disk_bytes and len(self.__disk) > 0:
+            key, size = self.__disk.popitem(last=False)
+            self.__disk_bytes -= size
+            removed.append(self.__move_to_trash(key))
+        return removed
+
+    def __delete_entries(self, paths: List[str]):
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return {
+                "memoryEntries": len(self.__memory),
+                "memoryBytes": self.__memory_bytes,
+                "diskEntries": len(self.__disk),
+                "diskBytes": self.__disk_bytes,
+            }
+
+
+def create_persistent_cache() -> Optional[PersistentCache]:
+    """
+    Creates the cache configured by the environment, if any.
+
+    Outputs are only cached across runs if a cache directory or the size of the memory
+    tier is set. The memory tier keeps outputs alive, so it is small by default.
+    """
+    cache_dir = os.environ.get("CHAINNER_CACHE_DIR", None)
+    memory_mb = os.environ.get("CHAINNER_CACHE_MEMORY_MB", None)
+    if cache_dir is None and memory_mb is None:
+        return None
+    return PersistentCache(
+        max_memory_bytes=int(memory_mb or "256") * 1024**2,
+        disk_directory=cache_dir,
+        max_disk_bytes=int(os.environ.get("CHAINNER_CACHE_DISK_MB", "10240"))
+        * 1024**2,
+    )
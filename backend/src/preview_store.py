@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from nodes.utils.image_utils import EncodedPreview
+
+
+class PreviewStore:
+    """
+    A ring buffer of the most recent previews of node outputs.
+
+    Instead of embedding previews in server-sent events, the events only reference them
+    by node id and revision, and the frontend requests the encoded image separately.
+    The oldest previews are dropped once either limit is exceeded.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024**2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        self.__previews: OrderedDict[Tuple[str, int], EncodedPreview] = OrderedDict()
+        self.__size = 0
+        # Revisions are never reused, not even after a restart, so responses can be
+        # cached forever
+        self.__next_revision = int(time.time() * 1000)
+
+    def put(self, node_id: str, preview: EncodedPreview) -> Dict[str, object]:
+        """Stores the given preview and returns the reference to send to the frontend"""
+        with self.__lock:
+            revision = self.__next_revision
+            self.__next_revision += 1
+            self.__previews[(node_id, revision)] = preview
+            self.__size += len(preview.data)
+            while len(self.__previews) > 1 and (
+                len(self.__previews) > self.max_entries or self.__size > self.max_bytes
+            ):
+                _, dropped = self.__previews.popitem(last=False)
+                self.__size -= len(dropped.data)
+        return {"nodeId": node_id, "revision": revision}
+
+    def get(self, node_id: str, revision: int) -> Optional[EncodedPreview]:
+        with self.__lock:
+            return self.__previews.get((node_id, revision), None)
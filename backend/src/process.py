@@ -2,13 +2,36 @@ from __future__ import annotations
 
 import asyncio
 import functools
+import hashlib
 import os
+import time
 import uuid
-from typing import Any, Dict, List, Optional, TypedDict
+from concurrent.futures import Future
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypedDict,
+    Union,
+)
 
 from sanic.log import logger
 
+from iteration_journal import IterationJournal
+from metrics import MetricsRecorder
+from nodes.node_base import NodeBase
 from nodes.node_factory import NodeFactory
+from nodes.properties.inputs import ImageInput
+from nodes.utils.image_utils import EncodedPreview
+from persistent_cache import CacheKeyBuilder, PersistentCache
+from preview_store import PreviewStore
 
 
 class UsableData(TypedDict):
@@ -29,6 +52,232 @@ class NodeExecutionError(Exception):
         self.node = node
 
 
+def get_input_dependencies(node: UsableData) -> List[str]:
+    """Returns the ids of all nodes whose outputs are used as inputs of the given node"""
+    dependencies = []
+    for node_input in node["inputs"]:
+        if isinstance(node_input, dict) and node_input.get("id", None):
+            next_node_id = str(node_input["id"])
+            if next_node_id not in dependencies:
+                dependencies.append(next_node_id)
+    return dependencies
+
+
+def get_node_dependencies(nodes: Dict[str, UsableData], node: UsableData) -> List[str]:
+    """
+    Returns the ids of all nodes that have to run before the given node can run.
+
+    For iterators, this includes the nodes outside the iterator that its children use.
+    """
+    dependencies = get_input_dependencies(node)
+    if node["nodeType"] == "iterator":
+        children = node.get("children", [])
+        for child in children:
+            for dependency in get_input_dependencies(nodes[child]):
+                if dependency not in children and dependency not in dependencies:
+                    dependencies.append(dependency)
+    return dependencies
+
+
+def get_side_effect_order(nodes: Dict[str, UsableData]) -> List[str]:
+    """
+    Returns the ids of all top-level nodes with side effects in the order they should run.
+
+    Nodes keep the order in which they were given, unless a node (transitively) depends
+    on another one, in which case the dependency always comes first.
+    """
+    ancestors: Dict[str, Set[str]] = {}
+
+    def get_ancestors(node_id: str) -> Set[str]:
+        if node_id not in ancestors:
+            result: Set[str] = set()
+            for dependency in get_node_dependencies(nodes, nodes[node_id]):
+                if dependency in nodes:
+                    result.add(dependency)
+                    result.update(get_ancestors(dependency))
+            ancestors[node_id] = result
+        return ancestors[node_id]
+
+    remaining = [
+        node_id
+        for node_id, node in nodes.items()
+        if node["hasSideEffects"] and not node["child"]
+    ]
+    ordered: List[str] = []
+    while remaining:
+        # pick the first node that does not depend on any other remaining node
+        for node_id in remaining:
+            if not any(other in get_ancestors(node_id) for other in remaining):
+                break
+        else:
+            node_id = remaining[0]
+        ordered.append(node_id)
+        remaining.remove(node_id)
+    return ordered
+
+
+@functools.lru_cache(maxsize=None)
+def get_file_input_indexes(schema_id: str) -> Set[int]:
+    """Returns the indexes of all inputs of the given node schema that are files"""
+    node_inputs = NodeFactory.create_node(schema_id).get_inputs()
+    return {
+        idx
+        for idx, node_input in enumerate(node_inputs)
+        if not isinstance(node_input, dict) and node_input.kind == "file"
+    }
+
+
+SCALAR_INPUT_KINDS = {"number", "slider", "dropdown", "text", "text-line", "directory"}
+"""The kinds of inputs whose values are cheap to compute, e.g. unlike images"""
+
+
+def get_scalar_input_indexes(node_instance: NodeBase) -> Set[int]:
+    return {
+        idx
+        for idx, node_input in enumerate(node_instance.get_inputs())
+        if not isinstance(node_input, dict) and node_input.kind in SCALAR_INPUT_KINDS
+    }
+
+
+def get_modified_time(paths: Iterable[str]) -> float:
+    """Returns when the most recently modified of the given files was modified"""
+    modified = 0.0
+    for path in paths:
+        try:
+            modified = max(modified, os.stat(path).st_mtime)
+        except OSError:
+            pass
+    return modified
+
+
+class UnpredictableOutputError(Exception):
+    pass
+
+
+def get_consumer_counts(
+    nodes: Dict[str, UsableData], output_node_ids: List[str]
+) -> Dict[str, int]:
+    """
+    Returns how many of the nodes required to run the given output nodes use the output
+    of each node.
+    """
+    counts: Dict[str, int] = {}
+    visited: Set[str] = set()
+    stack = list(output_node_ids)
+    while stack:
+        node_id = stack.pop()
+        if node_id in visited or node_id not in nodes:
+            continue
+        visited.add(node_id)
+        for dependency in get_node_dependencies(nodes, nodes[node_id]):
+            counts[dependency] = counts.get(dependency, 0) + 1
+            stack.append(dependency)
+    return counts
+
+
+def get_loop_invariant_nodes(
+    nodes: Dict[str, UsableData], children: List[str]
+) -> List[str]:
+    """
+    Returns the children of an iterator that compute the same output in every iteration,
+    in an order in which they can be run.
+
+    A child is invariant if it has no side effects and only depends on nodes outside the
+    iterator and other invariant children, e.g. a Load Model node inside the iterator.
+    """
+    invariant: Dict[str, bool] = {}
+    ordered: List[str] = []
+
+    def is_invariant(node_id: str) -> bool:
+        if node_id not in children:
+            return True
+        if node_id not in invariant:
+            # Cycles are impossible, but don't recurse forever if there is one
+            invariant[node_id] = False
+            node = nodes[node_id]
+            result = (
+                node["nodeType"] == "regularNode"
+                and not node["hasSideEffects"]
+                and all(
+                    is_invariant(dependency)
+                    for dependency in get_input_dependencies(node)
+                )
+            )
+            invariant[node_id] = result
+            if result:
+                ordered.append(node_id)
+        return invariant[node_id]
+
+    for child in children:
+        is_invariant(child)
+    return ordered
+
+
+def get_journal_directory() -> Optional[str]:
+    """Returns where iterators record what they finished, if anywhere"""
+    cache_dir = os.environ.get("CHAINNER_CACHE_DIR", None)
+    if cache_dir is None:
+        return None
+    return os.path.join(cache_dir, "iterator-journals")
+
+
+class ExecutionPlan:
+    """
+    Everything about a set of nodes that stays the same when they are run again, e.g.
+    for every iteration of an iterator: the order of the nodes, the edges between them,
+    their node instances, and their enforced literal inputs.
+
+    Iterators only replace the inputs of their helper nodes, whose inputs are never
+    enforced, so the literal inputs of all other nodes only have to be enforced once.
+    """
+
+    def __init__(self, nodes: Dict[str, UsableData]):
+        self.side_effect_order = get_side_effect_order(nodes)
+        self.consumer_counts = get_consumer_counts(nodes, self.side_effect_order)
+        self.dependencies: Dict[str, List[str]] = {
+            node_id: get_input_dependencies(node) for node_id, node in nodes.items()
+        }
+        self.__node_instances: Dict[str, NodeBase] = {}
+        self.__enforced_literals: Dict[str, Dict[int, Any]] = {}
+
+    def get_node_instance(self, node: UsableData) -> NodeBase:
+        node_id = node["id"]
+        node_instance = self.__node_instances.get(node_id, None)
+        if node_instance is None:
+            node_instance = NodeFactory.create_node(node["schemaId"])
+            self.__node_instances[node_id] = node_instance
+        return node_instance
+
+    def get_enforced_literals(self, node: UsableData) -> Dict[int, Any]:
+        """Returns the enforced values of all inputs of the node that aren't connected"""
+        node_id = node["id"]
+        enforced = self.__enforced_literals.get(node_id, None)
+        if enforced is None:
+            enforced = {}
+            node_inputs = self.get_node_instance(node).get_inputs()
+            for idx, node_input in enumerate(node["inputs"]):
+                if isinstance(node_input, dict) and node_input.get("id", None):
+                    continue
+                # TODO: remove this when all the inputs are transitioned to classes
+                if isinstance(node_inputs[idx], dict):
+                    enforced[idx] = node_input
+                else:
+                    enforced[idx] = node_inputs[idx].enforce_(node_input)
+            self.__enforced_literals[node_id] = enforced
+        return enforced
+
+
+async def iterate_async(
+    iterable: Union[Iterable[Any], AsyncIterable[Any]]
+) -> AsyncIterator[Any]:
+    if isinstance(iterable, AsyncIterable):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
 class ExecutionContext:
     def __init__(
         self,
@@ -47,6 +296,292 @@ class ExecutionContext:
         self.iterator_id = iterator_id
         self.executor = executor
         self.percent = percent
+        self.__metrics_started = False
+        # All iterations run the same nodes. The plan is created by the first iteration,
+        # because iterators mark their children as top-level nodes before iterating.
+        self.__plan: Optional[ExecutionPlan] = None
+        self.__dependencies_modified: Optional[float] = None
+
+    def __get_plan(self) -> ExecutionPlan:
+        if self.__plan is None:
+            self.__plan = ExecutionPlan(self.nodes)
+        return self.__plan
+
+    def __with_inputs(self, node_inputs: Dict[str, List[Any]]) -> Dict[str, UsableData]:
+        nodes = dict(self.nodes)
+        for node_id, inputs in node_inputs.items():
+            nodes[node_id] = {**nodes[node_id], "inputs": inputs}  # type: ignore
+        return nodes
+
+    async def put_progress(
+        self, finished: int, total: int, running: Optional[List[str]]
+    ):
+        """Reports how many iterations have finished, along with the iterator's throughput"""
+        metrics = self.executor.metrics
+        if not self.__metrics_started:
+            metrics.start_iterator(self.iterator_id, total, finished)
+            self.__metrics_started = True
+        else:
+            metrics.set_iterator_progress(self.iterator_id, finished, total)
+
+        await self.queue.put(
+            {
+                "event": "iterator-progress-update",
+                "data": {
+                    "percent": finished / total if total > 0 else 1,
+                    "iteratorId": self.iterator_id,
+                    "running": running,
+                },
+            }
+        )
+        await self.queue.put(
+            {
+                "event": "node-metrics",
+                "data": {
+                    "nodeId": self.iterator_id,
+                    "metrics": metrics.get_node(self.iterator_id),
+                },
+            }
+        )
+
+    def get_journal(self, key: str) -> IterationJournal:
+        """
+        Returns the journal of the items (e.g. files) this iterator finished for the given
+        key (e.g. its directory).
+
+        The journal starts out empty, unless the iterator is resumed or the executor
+        was told to skip the items finished by a previous run.
+        """
+        journal_id = f"{self.iterator_id} {key}"
+        journal = self.executor.journals.get(journal_id, None)
+        if journal is None:
+            path = None
+            if self.executor.journal_directory is not None:
+                name = hashlib.sha256(journal_id.encode("utf-8")).hexdigest()
+                path = os.path.join(self.executor.journal_directory, f"{name}.jsonl")
+            journal = IterationJournal(path)
+            self.executor.journals[journal_id] = journal
+        # The iterator may have been paused and resumed, so only a new run starts over
+        if not self.executor.resumed and not self.executor.skip_finished:
+            journal.clear()
+        return journal
+
+    def __predict_output(
+        self,
+        nodes: Dict[str, UsableData],
+        node_id: str,
+        predicted: Dict[str, Any],
+    ) -> Any:
+        """
+        Returns the output of the given node without running any node that loads or
+        processes data. Raises an `UnpredictableOutputError` if that isn't possible.
+        """
+        if node_id in predicted:
+            return predicted[node_id]
+        output = self.cache.get(node_id, None)
+        if output is None:
+            node = nodes.get(node_id, None)
+            if node is None:
+                raise UnpredictableOutputError(f"Node {node_id} has no output")
+            node_instance = self.__get_plan().get_node_instance(node)
+            inputs = self.__predict_inputs(nodes, node, predicted)
+            scalar_inputs = get_scalar_input_indexes(node_instance)
+            if (
+                node["nodeType"] == "regularNode"
+                and not node["hasSideEffects"]
+                and len(scalar_inputs) == len(node["inputs"])
+            ):
+                # e.g. text and math nodes
+                output = node_instance.run(*inputs)
+            else:
+                output = node_instance.predict_outputs(*inputs)
+            if output is None:
+                raise UnpredictableOutputError(f"Node {node_id} cannot be predicted")
+        predicted[node_id] = output
+        return output
+
+    def __predict_inputs(
+        self,
+        nodes: Dict[str, UsableData],
+        node: UsableData,
+        predicted: Dict[str, Any],
+    ) -> List[Any]:
+        """Returns the inputs of the given node, with all inputs that are data as None"""
+        if node["nodeType"] == "iteratorHelper":
+            # The inputs of helper nodes are given by the iterator
+            return node["inputs"]
+        plan = self.__get_plan()
+        node_instance = plan.get_node_instance(node)
+        node_inputs = node_instance.get_inputs()
+        scalar_inputs = get_scalar_input_indexes(node_instance)
+        literals = plan.get_enforced_literals(node)
+        inputs = []
+        for idx, node_input in enumerate(node["inputs"]):
+            if idx not in scalar_inputs:
+                inputs.append(None)
+            elif idx in literals:
+                inputs.append(literals[idx])
+            else:
+                output = self.__predict_output(nodes, str(node_input["id"]), predicted)
+                if type(output) in [list, tuple]:
+                    output = output[int(node_input["index"])]
+                inputs.append(node_inputs[idx].enforce_(output))
+        return inputs
+
+    def get_written_files(
+        self, node_inputs: Dict[str, List[Any]]
+    ) -> Optional[List[str]]:
+        """
+        Returns the files an iteration with the given inputs would write, or None if they
+        can't be known before running it or it has other side effects.
+        """
+        nodes = self.__with_inputs(node_inputs)
+        children = self.executor.nodes[self.iterator_id].get("children", [])
+        plan = self.__get_plan()
+        predicted: Dict[str, Any] = {}
+        written: List[str] = []
+        for child in children:
+            node = nodes[child]
+            if not node["hasSideEffects"] or node["nodeType"] == "iteratorHelper":
+                continue
+            try:
+                files = plan.get_node_instance(node).get_written_files(
+                    *self.__predict_inputs(nodes, node, predicted)
+                )
+            except Exception as e:
+                logger.debug(f"Unable to predict the files node {child} writes: {e}")
+                return None
+            if files is None:
+                return None
+            written.extend(files)
+        return written
+
+    def is_up_to_date(
+        self, node_inputs: Dict[str, List[Any]], sources: List[str]
+    ) -> bool:
+        """
+        Returns whether all files an iteration with the given inputs would write exist and
+        are at least as new as the given source files, as well as all files the chain
+        reads through file inputs (e.g. models).
+        """
+        written = self.get_written_files(node_inputs)
+        if not written:
+            return False
+        if self.__dependencies_modified is None:
+            dependencies = []
+            for node in self.executor.nodes.values():
+                for idx in get_file_input_indexes(node["schemaId"]):
+                    node_input = node["inputs"][idx]
+                    if isinstance(node_input, str):
+                        dependencies.append(node_input)
+            self.__dependencies_modified = get_modified_time(dependencies)
+        modified = max(self.__dependencies_modified, get_modified_time(sources))
+        for path in written:
+            try:
+                if os.stat(path).st_mtime < modified:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def __create_iteration_executor(
+        self, node_inputs: Dict[str, List[Any]]
+    ) -> Executor:
+        return Executor(
+            self.__with_inputs(node_inputs),
+            self.loop,
+            self.queue,
+            self.cache.copy(),
+            parent_executor=self.executor,
+            plan=self.__get_plan(),
+        )
+
+    async def run_iteration(self, node_inputs: Dict[str, List[Any]]):
+        """Runs the nodes of the iterator once, with the inputs of the given nodes replaced"""
+        await self.__create_iteration_executor(node_inputs).run()
+
+    async def run_iterations(
+        self,
+        iterations: Union[
+            Iterable[Dict[str, List[Any]]], AsyncIterable[Dict[str, List[Any]]]
+        ],
+        length: Union[int, Callable[[], int]],
+        running: List[str],
+        start_index: int = 0,
+        on_finished: Optional[Callable[[Dict[str, List[Any]]], None]] = None,
+    ):
+        """
+        Runs the nodes of the iterator once for every given set of replaced node inputs.
+
+        Up to `max_iterations_in_flight` iterations run at the same time, so e.g. loading
+        the next image overlaps with processing the current one. The reported progress
+        only counts iterations that finished along with all iterations before them, so a
+        resumed run never skips an iteration.
+
+        Iterations may also be given as an async iterable, e.g. while files are still
+        being found. `length` may then be a function returning the number known so far.
+        `on_finished` is called with the inputs of every iteration that finished.
+        """
+        get_length = length if callable(length) else lambda: length
+        in_flight = asyncio.Semaphore(self.executor.max_iterations_in_flight)
+        pending: Set[asyncio.Task] = set()
+        failed: List[asyncio.Task] = []
+        finished: Set[int] = set()
+        finished_count = start_index
+
+        async def put_progress(is_running: bool):
+            await self.put_progress(
+                finished_count, get_length(), running if is_running else None
+            )
+
+        async def run_one(index: int, node_inputs: Dict[str, List[Any]]):
+            nonlocal finished_count
+            executor = self.__create_iteration_executor(node_inputs)
+            try:
+                await executor.process_nodes()
+            finally:
+                in_flight.release()
+            # Images of this iteration may still be written while the next one runs
+            await executor.wait_for_background_work()
+            if self.executor.should_stop_running():
+                return
+            if on_finished is not None:
+                on_finished(node_inputs)
+            finished.add(index)
+            while finished_count in finished:
+                finished.remove(finished_count)
+                finished_count += 1
+            await put_progress(len(pending) > 1)
+
+        def on_done(task: asyncio.Task):
+            pending.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                failed.append(task)
+
+        iterator = iterate_async(iterations)
+        try:
+            index = -1
+            async for node_inputs in iterator:
+                index += 1
+                if index < start_index:
+                    continue
+                await in_flight.acquire()
+                if self.executor.should_stop_running() or failed:
+                    break
+                await put_progress(True)
+                task = self.loop.create_task(run_one(index, node_inputs))
+                pending.add(task)
+                task.add_done_callback(on_done)
+            await asyncio.gather(*pending)
+            if failed:
+                await failed[0]
+            if not self.executor.should_stop_running():
+                # The number of iterations may only be known now
+                await put_progress(False)
+        finally:
+            for task in pending:
+                task.cancel()
+            await iterator.aclose()  # type: ignore
 
 
 class Executor:
@@ -61,10 +596,39 @@ class Executor:
         queue: asyncio.Queue,
         existing_cache: Dict[str, Any],
         parent_executor: Optional[Executor] = None,
+        max_workers: Optional[int] = None,
+        pinned_outputs: Iterable[str] = (),
+        persistent_cache: Optional[PersistentCache] = None,
+        max_iterations_in_flight: Optional[int] = None,
+        has_subscribers: Optional[Callable[[], bool]] = None,
+        preview_interval: Optional[float] = None,
+        preview_store: Optional[PreviewStore] = None,
+        plan: Optional[ExecutionPlan] = None,
+        journal_directory: Optional[str] = None,
+        skip_finished: bool = False,
+        incremental: bool = False,
     ):
         self.execution_id = uuid.uuid4().hex
         self.nodes = nodes
         self.output_cache = existing_cache
+        self.finished: List[str] = list(existing_cache.keys())
+        self.completed: Set[str] = set()
+
+        # Nodes that are currently being (or have already been) processed by this executor.
+        # Every node is only ever scheduled once, no matter how many nodes depend on it.
+        self.node_tasks: Dict[str, asyncio.Task] = {}
+        self.plan = plan or ExecutionPlan(nodes)
+        self.side_effect_order = self.plan.side_effect_order
+
+        # The output of a node is dropped from the cache as soon as all nodes using it
+        # have run. Outputs this executor was given, or that are pinned, are kept.
+        self.consumer_counts = dict(self.plan.consumer_counts)
+        self.pinned_outputs: Set[str] = set(existing_cache.keys())
+        self.pinned_outputs.update(pinned_outputs)
+
+        # Work that nodes left running in the background, e.g. writing images. The
+        # executor only finishes once it is done.
+        self.background_work: List[Tuple[UsableData, Future]] = []
 
         self.process_task = None
         self.killed = False
@@ -76,7 +640,58 @@ class Executor:
 
         self.parent_executor = parent_executor
 
+        # Limits how many nodes may run on worker threads at the same time.
+        # Executors of iterators share the limit and the persistent cache of the executor
+        # they were created by.
+        if parent_executor is not None:
+            self.worker_limit = parent_executor.worker_limit
+            self.persistent_cache = parent_executor.persistent_cache
+            self.cache_keys = dict(parent_executor.cache_keys)
+            self.max_iterations_in_flight = parent_executor.max_iterations_in_flight
+            self.metrics = parent_executor.metrics
+            self.has_subscribers = parent_executor.has_subscribers
+            self.preview_interval = parent_executor.preview_interval
+            self.last_broadcast = parent_executor.last_broadcast
+            self.broadcast_tasks = parent_executor.broadcast_tasks
+            self.preview_store = parent_executor.preview_store
+            self.journals = parent_executor.journals
+            self.journal_directory = parent_executor.journal_directory
+            self.skip_finished = parent_executor.skip_finished
+            self.incremental = parent_executor.incremental
+        else:
+            self.worker_limit = asyncio.Semaphore(max_workers or os.cpu_count() or 1)
+            self.persistent_cache = persistent_cache
+            self.cache_keys: Dict[str, Optional[str]] = {}
+            # How many iterations of an iterator may be processed at the same time
+            self.max_iterations_in_flight: int = max_iterations_in_flight or 1
+            self.metrics = MetricsRecorder()
+            # The data of outputs (e.g. previews) is only computed if a client is
+            # listening. Nodes inside iterators broadcast at most once per interval.
+            self.has_subscribers: Callable[[], bool] = has_subscribers or (lambda: True)
+            self.preview_interval: float = (
+                preview_interval if preview_interval is not None else 0.25
+            )
+            self.last_broadcast: Dict[str, float] = {}
+            self.broadcast_tasks: Set[asyncio.Task] = set()
+            # Encoded previews are sent as references to the store, if there is one
+            self.preview_store = preview_store
+            # What iterators have finished. Journals are kept on disk if there is a
+            # directory for them, and otherwise only for resuming a paused run.
+            self.journals: Dict[str, IterationJournal] = {}
+            self.journal_directory = journal_directory
+            self.skip_finished = skip_finished
+            # Iterations whose output files are newer than their inputs are skipped
+            self.incremental = incremental
+
     async def process(self, node: UsableData) -> Any:
+        node_id = node["id"]
+        task = self.node_tasks.get(node_id, None)
+        if task is None:
+            task = self.loop.create_task(self.__process_checked(node))
+            self.node_tasks[node_id] = task
+        return await asyncio.shield(task)
+
+    async def __process_checked(self, node: UsableData) -> Any:
         try:
             return await self.__process(node)
         except NodeExecutionError:
@@ -84,55 +699,141 @@ class Executor:
         except Exception as e:
             raise NodeExecutionError(node, str(e)) from e
 
-    async def __process(self, node: UsableData) -> Any:
-        """Process a single node"""
-        logger.debug(f"node: {node}")
+    def get_cache_key(self, node: UsableData) -> Optional[str]:
+        """
+        Returns the key of the node's output in the persistent cache.
+
+        The key is derived from the node's schema, its literal inputs, the keys of the
+        nodes connected to it, and the modification time and size of its file inputs.
+        Returns None if the output of the node cannot be cached.
+        """
         node_id = node["id"]
-        logger.debug(f"Running node {node_id}")
-        # Return cached output value from an already-run node if that cached output exists
-        if self.output_cache.get(node_id, None) is not None:
-            finish_data = {
-                "finished": [key for key in self.output_cache.keys()],
-            }
-            await self.queue.put({"event": "node-finish", "data": finish_data})
-            return self.output_cache[node_id]
+        if node_id in self.cache_keys:
+            return self.cache_keys[node_id]
+
+        key = None
+        # Nodes with side effects, iterators, and everything depending on their outputs
+        # cannot be cached
+        if node["nodeType"] == "regularNode" and not node["hasSideEffects"]:
+            builder = CacheKeyBuilder(node["schemaId"])
+            file_inputs = get_file_input_indexes(node["schemaId"])
+            for idx, node_input in enumerate(node["inputs"]):
+                if isinstance(node_input, dict) and node_input.get("id", None):
+                    next_node = self.nodes.get(str(node_input["id"]), None)
+                    next_key = None
+                    if next_node is not None:
+                        next_key = self.get_cache_key(next_node)
+                    if next_key is None:
+                        break
+                    builder.add_upstream(next_key, int(node_input["index"]))
+                else:
+                    if not builder.add_literal(node_input):
+                        break
+                    if idx in file_inputs and isinstance(node_input, str):
+                        builder.add_file(node_input)
+            else:
+                key = builder.digest()
+
+        self.cache_keys[node_id] = key
+        return key
+
+    async def __wait_for_previous_side_effect(self, node_id: str):
+        """Waits until the side-effect node scheduled before the given one has finished"""
+        if node_id not in self.side_effect_order:
+            return
+        index = self.side_effect_order.index(node_id)
+        if index > 0:
+            previous = self.side_effect_order[index - 1]
+            # Its output may already have been evicted, so it must not run again
+            if previous not in self.completed:
+                await self.process(self.nodes[previous])
+
+    async def __process_inputs(self, node: UsableData) -> List[Any]:
+        """Resolves the inputs of a node, processing independent input nodes concurrently"""
+        dependencies = self.plan.dependencies[node["id"]]
+        results = await asyncio.gather(
+            *[self.process(self.nodes[dependency]) for dependency in dependencies]
+        )
+        processed = dict(zip(dependencies, results))
 
         inputs = []
         for node_input in node["inputs"]:
-            if self.should_stop_running():
-                return None
             # If input is a dict indicating another node, use that node's output value
             if isinstance(node_input, dict) and node_input.get("id", None):
-                # Get the next node by id
                 next_node_id = str(node_input["id"])
-                next_input = self.nodes[next_node_id]
                 next_index = int(node_input["index"])
-                # Recursively get the value of the input
-                processed_input = await self.process(next_input)
+                processed_input = processed[next_node_id]
                 # Split the output if necessary and grab the right index from the output
                 if type(processed_input) in [list, tuple]:
-                    index = next_index  # next_input["outputs"].index({"id": node_id})
-                    processed_input = processed_input[index]
+                    processed_input = processed_input[next_index]
                 inputs.append(processed_input)
-                if self.should_stop_running():
-                    return None
             # Otherwise, just use the given input (number, string, etc)
             else:
                 inputs.append(node_input)
+        return inputs
+
+    async def __process(self, node: UsableData) -> Any:
+        """Process a single node"""
+        logger.debug(f"node: {node}")
+        node_id = node["id"]
+        logger.debug(f"Running node {node_id}")
+        # Return cached output value from an already-run node if that cached output exists
+        if self.output_cache.get(node_id, None) is not None:
+            finish_data = await self.check()
+            await self.queue.put({"event": "node-finish", "data": finish_data})
+            return self.output_cache[node_id]
+
+        # Return the output of a previous run if nothing the node depends on has changed
+        cache_key = None
+        if self.persistent_cache is not None:
+            cache_key = self.get_cache_key(node)
+            if cache_key is not None:
+                # Entries may have to be read from the disk
+                output = await self.loop.run_in_executor(
+                    None, self.persistent_cache.get, cache_key
+                )
+                if output is not None:
+                    logger.debug(
+                        f"Using output of node {node_id} from persistent cache"
+                    )
+                    node_instance = self.plan.get_node_instance(node)
+                    self.__broadcast_outputs(node, node_instance, output)
+                    await self.loop.run_in_executor(
+                        None, self.metrics.set_output, node_id, output
+                    )
+                    await self.__finish_node(node, output)
+                    return output
+
+        if self.should_stop_running():
+            return None
+        inputs = await self.__process_inputs(node)
+        if self.should_stop_running():
+            return None
+        await self.__wait_for_previous_side_effect(node_id)
         if self.should_stop_running():
             return None
         # Create node based on given category/name information
-        node_instance = NodeFactory.create_node(node["schemaId"])
+        node_instance = self.plan.get_node_instance(node)
 
         # Enforce that all inputs match the expected input schema
         enforced_inputs = []
         if node["nodeType"] == "iteratorHelper":
-            enforced_inputs = inputs
+            # Iterators give their helpers additional inputs, so only images are
+            # enforced. Nodes may output them in any of the compact dtypes.
+            node_inputs = node_instance.get_inputs()
+            for idx, node_input in enumerate(inputs):
+                if idx < len(node_inputs) and isinstance(node_inputs[idx], ImageInput):
+                    enforced_inputs.append(node_inputs[idx].enforce_(node_input))
+                else:
+                    enforced_inputs.append(node_input)
         else:
             node_inputs = node_instance.get_inputs()
+            literals = self.plan.get_enforced_literals(node)
             for idx, node_input in enumerate(inputs):
+                if idx in literals:
+                    enforced_inputs.append(literals[idx])
                 # TODO: remove this when all the inputs are transitioned to classes
-                if isinstance(node_inputs[idx], dict):
+                elif isinstance(node_inputs[idx], dict):
                     enforced_inputs.append(node_input)
                 else:
                     enforced_inputs.append(node_inputs[idx].enforce_(node_input))
@@ -142,21 +843,30 @@ class Executor:
             sub_nodes: Dict[str, UsableData] = {}
             for child in node["children"]:  # type: ignore
                 sub_nodes[child] = self.nodes[child]
-            sub_nodes_ids = sub_nodes.keys()
-            for v in sub_nodes.copy().values():
+            # Run all the connected nodes that are outside the iterator and cache the outputs
+            outside_node_ids: List[str] = []
+            for v in sub_nodes.values():
                 # TODO: this might be something to do in the frontend before processing instead
-                for node_input in v["inputs"]:
-                    logger.info(f"node_input, {node_input}")
-                    if isinstance(node_input, dict) and node_input.get("id", None):
-                        next_node_id = str(node_input["id"])
-                        logger.info(f"next_node_id, {next_node_id}")
-                        # Run all the connected nodes that are outside the iterator and cache the outputs
-                        if next_node_id not in sub_nodes_ids:
-                            logger.debug(f"not in sub_node_ids, caching {next_node_id}")
-                            output = await self.process(self.nodes[next_node_id])
-                            self.output_cache[next_node_id] = output
-                            # Add this to the sub node dict as well so it knows it exists
-                            sub_nodes[next_node_id] = self.nodes[next_node_id]
+                for next_node_id in get_input_dependencies(v):
+                    if (
+                        next_node_id not in sub_nodes
+                        and next_node_id not in outside_node_ids
+                    ):
+                        outside_node_ids.append(next_node_id)
+            logger.debug(f"not in sub_node_ids, caching {outside_node_ids}")
+            outputs = await asyncio.gather(
+                *[
+                    self.process(self.nodes[next_node_id])
+                    for next_node_id in outside_node_ids
+                ]
+            )
+            for next_node_id, output in zip(outside_node_ids, outputs):
+                self.output_cache[next_node_id] = output
+                # Add this to the sub node dict as well so it knows it exists
+                sub_nodes[next_node_id] = self.nodes[next_node_id]
+            # Children that compute the same output in every iteration only run once
+            hoisted = await self.__run_loop_invariant_nodes(node, sub_nodes)
+            start = time.perf_counter()
             output = await node_instance.run(
                 *enforced_inputs,
                 context=ExecutionContext(  # type: ignore
@@ -169,63 +879,191 @@ class Executor:
                     node["percent"] if self.resumed else 0,
                 ),
             )
-            # Cache the output of the node
-            self.output_cache[node_id] = output
-            finish_data = await self.check()
-            await self.queue.put({"event": "node-finish", "data": finish_data})
-            del node_instance, finish_data
+            for hoisted_id in hoisted:
+                self.output_cache.pop(hoisted_id, None)
+            if self.should_stop_running():
+                return None
+            self.metrics.add_wall_time(node_id, time.perf_counter() - start)
+            await self.loop.run_in_executor(
+                None, self.metrics.set_output, node_id, output
+            )
+            await self.__finish_node(node, output)
+            del node_instance
             return output
         else:
             # Run the node and pass in inputs as args
-            run_func = functools.partial(node_instance.run, *enforced_inputs)
-            output = await self.loop.run_in_executor(None, run_func)
-            node_outputs = node_instance.get_outputs()
-            broadcast_data: Dict[int, Any] = dict()
-            if len(node_outputs) > 0:
-                output_idxable = [output] if len(node_outputs) == 1 else output
-                for idx, node_output in enumerate(node_outputs):
-                    try:
-                        output_id = (
-                            node_output.id if node_output.id is not None else idx
-                        )
-                        broadcast_data[output_id] = node_output.get_broadcast_data(
-                            output_idxable[idx]
-                        )
-                    except Exception as e:
-                        logger.error(f"Error broadcasting output: {e}")
-                await self.queue.put(
-                    {
-                        "event": "node-output-data",
-                        "data": {"nodeId": node_id, "data": broadcast_data},
-                    }
+            run_func = functools.partial(
+                self.metrics.measure,
+                node_id,
+                functools.partial(node_instance.run, *enforced_inputs),
+            )
+            async with self.worker_limit:
+                output = await self.loop.run_in_executor(None, run_func)
+            if isinstance(output, Future):
+                self.background_work.append((node, output))
+            self.__broadcast_outputs(node, node_instance, output)
+            if cache_key is not None:
+                assert self.persistent_cache is not None
+                await self.loop.run_in_executor(
+                    None,
+                    functools.partial(self.persistent_cache.put, cache_key, output),
                 )
-            # Cache the output of the node
-            self.output_cache[node_id] = output
-            finish_data = {
-                "finished": [key for key in self.output_cache.keys()],
-            }
-            await self.queue.put({"event": "node-finish", "data": finish_data})
-            del node_instance, run_func, finish_data
+            await self.__finish_node(node, output)
+            del node_instance, run_func
             return output
 
+    async def __run_loop_invariant_nodes(
+        self, node: UsableData, sub_nodes: Dict[str, UsableData]
+    ) -> List[str]:
+        """
+        Runs the children of the iterator that don't depend on the iteration, and adds
+        their outputs to the cache every iteration starts with.
+
+        The nodes run in an executor of their own, so using the outputs of nodes outside
+        the iterator doesn't count as using them up.
+        """
+        hoisted = get_loop_invariant_nodes(sub_nodes, node["children"])
+        if len(hoisted) == 0:
+            return hoisted
+        logger.info(f"Running nodes {hoisted} only once for all iterations")
+        self.metrics.set_hoisted(node["id"], hoisted)
+
+        executor = Executor(
+            sub_nodes,
+            self.loop,
+            self.queue,
+            self.output_cache.copy(),
+            parent_executor=self,
+            pinned_outputs=hoisted,
+        )
+        outputs = await asyncio.gather(
+            *[executor.process(sub_nodes[hoisted_id]) for hoisted_id in hoisted]
+        )
+        for hoisted_id, output in zip(hoisted, outputs):
+            self.output_cache[hoisted_id] = output
+        return hoisted
+
+    def __broadcast_outputs(
+        self, node: UsableData, node_instance: NodeBase, output: Any
+    ):
+        """
+        Sends the data the frontend displays for the outputs of a node (e.g. previews).
+
+        The data is computed on a worker thread in the background, so nodes using the
+        output don't have to wait for it. Nothing is computed if no client is listening,
+        and nodes inside iterators are throttled to one broadcast per `preview_interval`.
+        """
+        node_id = node["id"]
+        node_outputs = node_instance.get_outputs()
+        if len(node_outputs) == 0 or not self.has_subscribers():
+            return
+        if self.parent_executor is not None:
+            now = time.monotonic()
+            last = self.last_broadcast.get(node_id, None)
+            if last is not None and now - last < self.preview_interval:
+                return
+            self.last_broadcast[node_id] = now
+
+        def get_broadcast_data() -> Dict[int, Any]:
+            broadcast_data: Dict[int, Any] = dict()
+            output_idxable = [output] if len(node_outputs) == 1 else output
+            for idx, node_output in enumerate(node_outputs):
+                try:
+                    output_id = node_output.id if node_output.id is not None else idx
+                    data = node_output.get_broadcast_data(output_idxable[idx])
+                    if isinstance(data, dict):
+                        data = {
+                            key: self.__get_preview_reference(node_id, value)
+                            for key, value in data.items()
+                        }
+                    broadcast_data[output_id] = data
+                except Exception as e:
+                    logger.error(f"Error broadcasting output: {e}")
+            return broadcast_data
+
+        async def broadcast():
+            broadcast_data = await self.loop.run_in_executor(None, get_broadcast_data)
+            await self.queue.put(
+                {
+                    "event": "node-output-data",
+                    "data": {"nodeId": node_id, "data": broadcast_data},
+                }
+            )
+
+        task = self.loop.create_task(broadcast())
+        self.broadcast_tasks.add(task)
+        task.add_done_callback(self.broadcast_tasks.discard)
+
+    def __get_preview_reference(self, node_id: str, value: Any) -> Any:
+        if not isinstance(value, EncodedPreview):
+            return value
+        if self.preview_store is None:
+            return value.to_data_url()
+        return self.preview_store.put(node_id, value)
+
+    async def __finish_node(self, node: UsableData, output: Any):
+        node_id = node["id"]
+        # Cache the output of the node
+        self.output_cache[node_id] = output
+        if node_id not in self.finished:
+            self.finished.append(node_id)
+        self.completed.add(node_id)
+        finish_data = await self.check()
+        await self.queue.put({"event": "node-finish", "data": finish_data})
+        await self.queue.put(
+            {
+                "event": "node-metrics",
+                "data": {"nodeId": node_id, "metrics": self.metrics.get_node(node_id)},
+            }
+        )
+        self.__release_inputs(node)
+
+    def __release_inputs(self, node: UsableData):
+        """Drops the cached outputs of input nodes once no other node needs them anymore"""
+        for dependency in get_node_dependencies(self.nodes, node):
+            remaining = self.consumer_counts.get(dependency, 0) - 1
+            self.consumer_counts[dependency] = remaining
+            if remaining <= 0 and dependency not in self.pinned_outputs:
+                logger.debug(f"Evicting output of node {dependency} from cache")
+                self.output_cache.pop(dependency, None)
+                self.node_tasks.pop(dependency, None)
+
     async def process_nodes(self):
-        # Create a list of all output nodes
-        output_nodes = []
-        for node in self.nodes.values():
-            if self.killed:
-                break
-            if (node["hasSideEffects"]) and not node["child"]:
-                output_nodes.append(node)
-        # Run each of the output nodes through processing
-        for output_node in output_nodes:
-            if self.killed:
-                break
-            await self.process(output_node)
+        # Schedule all output nodes at once. Nodes whose inputs are ready run
+        # concurrently, while output nodes still finish in their original order.
+        output_tasks = [
+            self.process(self.nodes[node_id]) for node_id in self.side_effect_order
+        ]
+        try:
+            await asyncio.gather(*output_tasks)
+        finally:
+            # Don't leave orphaned nodes running if one of the branches failed
+            for task in self.node_tasks.values():
+                if not task.done():
+                    task.cancel()
+            if self.parent_executor is None:
+                for journal in self.journals.values():
+                    journal.close()
+
+    async def wait_for_background_work(self):
+        """Waits until the work the nodes left running in the background is done"""
+        work, self.background_work = self.background_work, []
+        results = await asyncio.gather(
+            *[asyncio.wrap_future(future) for _, future in work],
+            return_exceptions=True,
+        )
+        for (node, _), result in zip(work, results):
+            if isinstance(result, Exception):
+                raise NodeExecutionError(node, str(result)) from result
 
     async def run(self):
         """Run the executor"""
         logger.debug(f"Running executor {self.execution_id}")
         await self.process_nodes()
+        await self.wait_for_background_work()
+        if self.parent_executor is None:
+            # Send the previews of the last nodes before reporting that the run is done
+            await asyncio.gather(*self.broadcast_tasks)
 
     async def resume(self):
         """Run the executor"""
@@ -233,13 +1071,19 @@ class Executor:
         self.paused = False
         self.resumed = True
         os.environ["killed"] = "False"
+        # Nodes interrupted by the pause have to be scheduled again
+        self.node_tasks = {
+            node_id: task
+            for node_id, task in self.node_tasks.items()
+            if node_id in self.completed
+        }
         await self.process_nodes()
+        await self.wait_for_background_work()
 
     async def check(self):
         """Check the executor"""
-        cached_ids = [key for key in self.output_cache.keys()]
         return {
-            "finished": cached_ids,
+            "finished": list(self.finished),
         }
 
     async def pause(self):
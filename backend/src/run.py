@@ -13,64 +13,34 @@ import cv2
 from sanic import Sanic
 from sanic.log import logger
 from sanic.request import Request
-from sanic.response import json
+from sanic.response import json, raw, text
 from sanic_cors import CORS
 
-from nodes.categories import category_order
-
 # Remove broken QT env var
 if platform.system() == "Linux":
     os.environ.pop("QT_QPA_PLATFORM_PLUGIN_PATH")
 
-# pylint: disable=ungrouped-imports,wrong-import-position
-from nodes import image_adj_nodes  # type: ignore
-from nodes import image_chan_nodes  # type: ignore
-from nodes import image_dim_nodes  # type: ignore
-from nodes import image_filter_nodes  # type: ignore
-from nodes import image_iterator_nodes  # type: ignore
-from nodes import image_nodes  # type: ignore
-from nodes import image_util_nodes  # type: ignore
-
-try:
-    import torch
-
-    # pylint: disable=unused-import,ungrouped-imports
-    from nodes import pytorch_nodes  # type: ignore
-except Exception as e:
-    torch = None
-    logger.warning(e)
-    logger.info("PyTorch most likely not installed")
-
-try:
-    import onnx
-    import onnxruntime
-
-    # pylint: disable=unused-import,ungrouped-imports
-    from nodes import onnx_nodes  # type: ignore
-except Exception as e:
-    logger.warning(e)
-    logger.info("ONNX most likely not installed")
-
-
-try:
-    # pylint: disable=unused-import
-    import ncnn_vulkan
-
-    # pylint: disable=unused-import,ungrouped-imports
-    from nodes import ncnn_nodes  # type: ignore
-except Exception as e:
-    logger.warning(e)
-    logger.info("NCNN most likely not installed")
-
-# pylint: disable=unused-import
-from nodes import utility_nodes  # type: ignore
+# pylint: disable=wrong-import-position
+from node_registry import get_schema_cache_path, load_node_registry
 from nodes.node_factory import NodeFactory
-from process import Executor, NodeExecutionError
+from persistent_cache import create_persistent_cache
+from preview_store import PreviewStore
+from process import Executor, NodeExecutionError, get_journal_directory
 
 app = Sanic("chaiNNer")
 CORS(app)
 app.ctx.executor = None
 app.ctx.cache = dict()
+# The metrics of the current or, if nothing is running, the last run
+app.ctx.metrics = None
+# The number of open /sse connections. Previews are only computed if someone listens.
+app.ctx.sse_subscribers = 0
+# Previews are sent to the frontend as references to this store
+app.ctx.preview_store = PreviewStore()
+# Node schemas don't change while the server is running, so they are only serialized once
+app.ctx.nodes_response = stringify(load_node_registry(get_schema_cache_path()))
+# Outputs of previous runs are only kept if a cache is configured
+app.ctx.persistent_cache = create_persistent_cache()
 
 app.config.REQUEST_TIMEOUT = sys.maxsize
 app.config.RESPONSE_TIMEOUT = sys.maxsize
@@ -90,39 +60,7 @@ access_logger.addFilter(SSEFilter())
 @app.route("/nodes")
 async def nodes(_):
     """Gets a list of all nodes as well as the node information"""
-    registry = NodeFactory.get_registry()
-    logger.debug(category_order)
-
-    # sort nodes in category order
-    sorted_registry = sorted(
-        registry.items(),
-        key=lambda x: category_order.index(
-            NodeFactory.create_node(x[0]).get_category()
-        ),
-    )
-    node_list = []
-    for schema_id, _node_class in sorted_registry:
-        node_object = NodeFactory.create_node(schema_id)
-        node_dict = {
-            "schemaId": schema_id,
-            "name": node_object.get_name(),
-            "category": node_object.get_category(),
-            "inputs": [
-                x.toDict() for x in node_object.get_inputs(with_implicit_ids=True)
-            ],
-            "outputs": [
-                x.toDict() for x in node_object.get_outputs(with_implicit_ids=True)
-            ],
-            "description": node_object.get_description(),
-            "icon": node_object.get_icon(),
-            "subcategory": node_object.get_sub_category(),
-            "nodeType": node_object.get_type(),
-            "hasSideEffects": node_object.get_has_side_effects(),
-        }
-        if node_object.get_type() == "iterator":
-            node_dict["defaultNodes"] = node_object.get_default_nodes()  # type: ignore
-        node_list.append(node_dict)
-    return json(node_list)
+    return text(app.ctx.nodes_response, content_type="application/json")
 
 
 @app.route("/run", methods=["POST"])
@@ -146,12 +84,29 @@ async def run(request: Request):
             os.environ["device"] = "cpu" if full_data["isCpu"] else "cuda"
             os.environ["isFp16"] = str(full_data["isFp16"])
             logger.info(f"Using device: {os.environ['device']}")
-            executor = Executor(nodes_list, app.loop, queue, app.ctx.cache.copy())
+            executor = Executor(
+                nodes_list,
+                app.loop,
+                queue,
+                app.ctx.cache.copy(),
+                max_workers=full_data.get("maxWorkers", None),
+                persistent_cache=app.ctx.persistent_cache,
+                max_iterations_in_flight=full_data.get("maxIterationsInFlight", None),
+                has_subscribers=lambda: app.ctx.sse_subscribers > 0,
+                preview_interval=full_data.get("previewIntervalMs", 250) / 1000,
+                preview_store=app.ctx.preview_store,
+                journal_directory=get_journal_directory(),
+                skip_finished=full_data.get("skipFinished", False),
+                incremental=full_data.get("incremental", False),
+            )
             request.app.ctx.executor = executor
+            request.app.ctx.metrics = executor.metrics
             await executor.run()
         if not executor.paused:
             del request.app.ctx.executor
             request.app.ctx.executor = None
+        # PyTorch is only imported once a PyTorch node has been used
+        torch = sys.modules.get("torch", None)
         if torch is not None:
             torch.cuda.empty_cache()
         gc.collect()
@@ -179,6 +134,14 @@ async def run(request: Request):
         return json(error, status=500)
 
 
+@app.route("/metrics")
+async def metrics(request: Request):
+    """Gets the time and memory each node of the current or last run needed"""
+    if request.app.ctx.metrics is None:
+        return json({"seconds": 0, "nodes": {}})
+    return json(request.app.ctx.metrics.to_dict())
+
+
 @app.route("/run/individual", methods=["POST"])
 async def run_individual(request: Request):
     """Runs a single node"""
@@ -195,7 +158,7 @@ async def run_individual(request: Request):
         output = await app.loop.run_in_executor(None, run_func)
         # Cache the output of the node
         app.ctx.cache[full_data["id"]] = output
-        extra_data = node_instance.get_extra_data()
+        extra_data = node_instance.get_extra_data(output)
         del node_instance, run_func
         return json({"success": True, "data": extra_data})
     except Exception as exception:
@@ -207,13 +170,31 @@ async def run_individual(request: Request):
 async def sse(request: Request):
     headers = {"Cache-Control": "no-cache"}
     response = await request.respond(headers=headers, content_type="text/event-stream")
-    while True:
-        message = await request.app.ctx.queue.get()
-        if not message:
-            break
-        if response is not None:
-            await response.send(f"event: {message['event']}\n")
-            await response.send(f"data: {stringify(message['data'])}\n\n")
+    request.app.ctx.sse_subscribers += 1
+    try:
+        while True:
+            message = await request.app.ctx.queue.get()
+            if not message:
+                break
+            if response is not None:
+                await response.send(f"event: {message['event']}\n")
+                await response.send(f"data: {stringify(message['data'])}\n\n")
+    finally:
+        request.app.ctx.sse_subscribers -= 1
+
+
+@app.get("/preview/<node_id:str>/<revision:int>")
+async def preview(request: Request, node_id: str, revision: int):
+    """Returns an encoded preview referenced by a node-output-data event"""
+    encoded = request.app.ctx.preview_store.get(node_id, revision)
+    if encoded is None:
+        return json({"message": "Preview not found"}, status=404)
+    return raw(
+        encoded.data,
+        content_type=encoded.mime,
+        # Revisions are never reused
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
 
 
 @app.after_server_start
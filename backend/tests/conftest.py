@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The executor and the nodes import the modules of the backend by their top-level names
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -0,0 +1,86 @@
+import pytest
+
+from ..src.chain import ChainError, apply_overrides, convert_to_usable_format
+
+LOAD = "00000000-0000-0000-0000-000000000001"
+BLUR = "00000000-0000-0000-0000-000000000002"
+SAVE = "00000000-0000-0000-0000-000000000003"
+UNUSED = "00000000-0000-0000-0000-000000000004"
+
+SCHEMATA = {
+    "load": {
+        "schemaId": "load",
+        "name": "Load",
+        "inputs": [{"id": 0}],
+        "outputs": [{"id": 0}],
+        "hasSideEffects": False,
+    },
+    "blur": {
+        "schemaId": "blur",
+        "name": "Blur",
+        "inputs": [{"id": 0}, {"id": 1}],
+        "outputs": [{"id": 0}],
+        "hasSideEffects": False,
+    },
+    "save": {
+        "schemaId": "save",
+        "name": "Save",
+        "inputs": [{"id": 0}, {"id": 1}],
+        "outputs": [],
+        "hasSideEffects": True,
+    },
+}
+
+
+def node(node_id, schema_id, input_data, **data):
+    return {
+        "id": node_id,
+        "type": "regularNode",
+        "data": {"schemaId": schema_id, "inputData": input_data, **data},
+    }
+
+
+def edge(source, output_id, target, input_id):
+    return {
+        "source": source,
+        "target": target,
+        "sourceHandle": f"{source}-{output_id}",
+        "targetHandle": f"{target}-{input_id}",
+    }
+
+
+def get_content(**blur_data):
+    return {
+        "nodes": [
+            node(LOAD, "load", {"0": "in.png"}),
+            node(BLUR, "blur", {"1": 3}, **blur_data),
+            node(SAVE, "save", {"1": "out"}),
+            node(UNUSED, "blur", {}),
+        ],
+        "edges": [edge(LOAD, 0, BLUR, 0), edge(BLUR, 0, SAVE, 0)],
+    }
+
+
+def test_convert_to_usable_format():
+    nodes = convert_to_usable_format(get_content(), SCHEMATA)
+
+    assert set(nodes) == {LOAD, BLUR, SAVE}
+    assert nodes[BLUR]["inputs"] == [{"id": LOAD, "index": 0}, 3]
+    assert nodes[BLUR]["outputs"] == [{"id": SAVE, "index": 0}]
+    assert nodes[SAVE]["inputs"] == [{"id": BLUR, "index": 0}, "out"]
+
+
+def test_disabled_nodes_are_skipped():
+    nodes = convert_to_usable_format(get_content(isDisabled=True), SCHEMATA)
+
+    assert nodes == {}
+
+
+def test_apply_overrides():
+    nodes = convert_to_usable_format(get_content(), SCHEMATA)
+    apply_overrides(nodes, SCHEMATA, [f"{BLUR}:1=5", f"{SAVE}:1=other"])
+
+    assert nodes[BLUR]["inputs"][1] == 5
+    assert nodes[SAVE]["inputs"][1] == "other"
+    with pytest.raises(ChainError):
+        apply_overrides(nodes, SCHEMATA, [f"{BLUR}:0=1"])
@@ -0,0 +1,280 @@
+import asyncio
+import os
+from typing import List
+
+import cv2
+import numpy as np
+
+from nodes.image_iterator_nodes import (
+    IMAGE_ITERATOR_NODE_ID,
+    SPRITESHEET_ITERATOR_INPUT_NODE_ID,
+    SPRITESHEET_ITERATOR_OUTPUT_NODE_ID,
+)
+from nodes.node_base import NodeBase
+from nodes.node_factory import NodeFactory
+from nodes.properties.inputs import TextInput
+from process import Executor
+
+ITERATOR = "iterator"
+LOAD = "load"
+RECORD = "record"
+
+PAUSE_AFTER = 4
+
+
+@NodeFactory.register("test:record_and_pause")
+class RecordAndPauseNode(NodeBase):
+    """Records the names of the loaded images, and pauses before the 5th one"""
+
+    names: List[str] = []
+    executor: Executor
+
+    def __init__(self):
+        super().__init__()
+        self.inputs = [TextInput("Name")]
+        self.side_effects = True
+
+    def run(self, name: str):
+        if len(self.names) == PAUSE_AFTER and not self.executor.resumed:
+            self.executor.paused = True
+            return
+        self.names.append(name)
+
+
+def get_nodes(directory: str):
+    return {
+        ITERATOR: {
+            "id": ITERATOR,
+            "schemaId": "chainner:image:file_iterator",
+            "inputs": [directory],
+            "outputs": [],
+            "child": False,
+            "nodeType": "iterator",
+            "hasSideEffects": True,
+            "children": [LOAD, RECORD],
+            "percent": 0,
+        },
+        LOAD: {
+            "id": LOAD,
+            "schemaId": IMAGE_ITERATOR_NODE_ID,
+            "inputs": [None],
+            "outputs": [None, None, None, {"id": RECORD, "index": 0}],
+            "child": True,
+            "nodeType": "iteratorHelper",
+            "hasSideEffects": True,
+        },
+        RECORD: {
+            "id": RECORD,
+            "schemaId": "test:record_and_pause",
+            "inputs": [{"id": LOAD, "index": 3}],
+            "outputs": [],
+            "child": True,
+            "nodeType": "regularNode",
+            "hasSideEffects": True,
+        },
+    }
+
+
+def test_resumed_image_iterator_skips_finished_files(tmp_path):
+    names = [f"{i}" for i in range(7)]
+    for name in names:
+        cv2.imwrite(str(tmp_path / f"{name}.png"), np.zeros((2, 2, 3), np.uint8))
+
+    async def run():
+        executor = Executor(
+            get_nodes(str(tmp_path)),
+            asyncio.get_running_loop(),
+            asyncio.Queue(),
+            {},
+            has_subscribers=lambda: False,
+        )
+        RecordAndPauseNode.names = []
+        RecordAndPauseNode.executor = executor
+        await executor.run()
+        assert executor.paused
+        assert len(RecordAndPauseNode.names) == PAUSE_AFTER
+
+        await executor.resume()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    # Every image was loaded exactly once
+    assert sorted(RecordAndPauseNode.names) == names
+
+
+def test_sprite_sheet_iterator_normalizes_compact_images(tmp_path):
+    path = str(tmp_path / "sprite.png")
+    sprite = np.full((2, 4, 3), 51, np.uint8)
+    cv2.imwrite(path, sprite)
+
+    def load(node_id: str, child: bool):
+        return {
+            "id": node_id,
+            "schemaId": "chainner:image:load",
+            "inputs": [path],
+            "outputs": [],
+            "child": child,
+            "nodeType": "regularNode",
+            "hasSideEffects": False,
+        }
+
+    # The appended image is loaded as uint8 instead of coming from the sheet
+    nodes = {
+        "sheet": load("sheet", False),
+        ITERATOR: {
+            "id": ITERATOR,
+            "schemaId": "chainner:image:spritesheet_iterator",
+            "inputs": [{"id": "sheet", "index": 0}, 1, 2],
+            "outputs": [],
+            "child": False,
+            "nodeType": "iterator",
+            "hasSideEffects": True,
+            "children": [LOAD, "sprite", "append"],
+            "percent": 0,
+        },
+        LOAD: {
+            "id": LOAD,
+            "schemaId": SPRITESHEET_ITERATOR_INPUT_NODE_ID,
+            "inputs": [None],
+            "outputs": [],
+            "child": True,
+            "nodeType": "iteratorHelper",
+            "hasSideEffects": True,
+        },
+        "sprite": load("sprite", True),
+        "append": {
+            "id": "append",
+            "schemaId": SPRITESHEET_ITERATOR_OUTPUT_NODE_ID,
+            "inputs": [{"id": "sprite", "index": 0}],
+            "outputs": [],
+            "child": True,
+            "nodeType": "iteratorHelper",
+            "hasSideEffects": True,
+        },
+    }
+
+    async def run():
+        executor = Executor(
+            nodes,
+            asyncio.get_running_loop(),
+            asyncio.Queue(),
+            {},
+            pinned_outputs=[ITERATOR],
+            has_subscribers=lambda: False,
+        )
+        await executor.run()
+        return executor.output_cache[ITERATOR]
+
+    loop = asyncio.new_event_loop()
+    try:
+        sheet = loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    assert sheet.dtype == np.float32
+    assert sheet.shape == (2, 8, 3)
+    assert np.allclose(sheet, 0.2)
+
+
+def get_save_nodes(directory: str, out_dir: str):
+    return {
+        ITERATOR: {
+            "id": ITERATOR,
+            "schemaId": "chainner:image:file_iterator",
+            "inputs": [directory],
+            "outputs": [],
+            "child": False,
+            "nodeType": "iterator",
+            "hasSideEffects": True,
+            "children": [LOAD, "save"],
+            "percent": 0,
+        },
+        LOAD: {
+            "id": LOAD,
+            "schemaId": IMAGE_ITERATOR_NODE_ID,
+            "inputs": [None],
+            "outputs": [],
+            "child": True,
+            "nodeType": "iteratorHelper",
+            "hasSideEffects": True,
+        },
+        "save": {
+            "id": "save",
+            "schemaId": "chainner:image:save",
+            "inputs": [
+                {"id": LOAD, "index": 0},
+                out_dir,
+                {"id": LOAD, "index": 2},
+                {"id": LOAD, "index": 3},
+                "png",
+                95,
+                1,
+                5,
+            ],
+            "outputs": [],
+            "child": True,
+            "nodeType": "regularNode",
+            "hasSideEffects": True,
+        },
+    }
+
+
+def test_incremental_image_iterator_skips_up_to_date_images(tmp_path):
+    in_dir = tmp_path / "in"
+    out_dir = tmp_path / "out"
+    in_dir.mkdir()
+    out_dir.mkdir()
+    names = ["a", "b", "c"]
+    for name in names:
+        cv2.imwrite(str(in_dir / f"{name}.png"), np.zeros((2, 2, 3), np.uint8))
+
+    def run(incremental: bool):
+        async def run_executor():
+            executor = Executor(
+                get_save_nodes(str(in_dir), str(out_dir)),
+                asyncio.get_running_loop(),
+                asyncio.Queue(),
+                {},
+                has_subscribers=lambda: False,
+                incremental=incremental,
+            )
+            await executor.run()
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run_executor())
+        finally:
+            loop.close()
+
+    def set_outputs_modified(offsets):
+        """Sets the modified time (in ns) of every output relative to its input"""
+        for name, offset in offsets.items():
+            modified = os.stat(in_dir / f"{name}.png").st_mtime_ns + offset
+            os.utime(out_dir / f"{name}.png", ns=(modified, modified))
+
+    def get_rewritten(offsets) -> List[str]:
+        return [
+            name
+            for name, offset in offsets.items()
+            if os.stat(out_dir / f"{name}.png").st_mtime_ns
+            != os.stat(in_dir / f"{name}.png").st_mtime_ns + offset
+        ]
+
+    # Missing outputs are written
+    run(True)
+    assert sorted(os.listdir(out_dir)) == ["a.png", "b.png", "c.png"]
+
+    # Only outputs older than their inputs are written again
+    offsets = {"a": 10**11, "b": -(10**11), "c": 0}
+    set_outputs_modified(offsets)
+    run(True)
+    assert get_rewritten(offsets) == ["b"]
+
+    # Without incremental, every image is processed
+    set_outputs_modified(offsets)
+    run(False)
+    assert get_rewritten(offsets) == names
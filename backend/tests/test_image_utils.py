@@ -0,0 +1,82 @@
+import numpy as np
+
+from ..src.nodes.utils import image_utils
+from ..src.nodes.utils.image_utils import compact, get_preview, normalize, to_uint8
+
+
+def test_normalize():
+    img = np.array([[0, 128, 255]], dtype=np.uint8)
+    result = normalize(img)
+    assert result.dtype == np.float32
+    assert np.array_equal(result, img.astype(np.float32) / 255)
+
+    img = np.array([[-0.5, 0.5, 1.5]], dtype=np.float32)
+    result = normalize(img)
+    assert result is not img
+    assert np.array_equal(result, [[0, 0.5, 1]])
+
+
+def test_compact():
+    img = np.zeros((4, 4, 3), dtype=np.uint16)
+    assert compact(img) is img
+
+    img = np.full((4, 4), 0.5, dtype=np.float16)
+    assert compact(img) is img
+
+    img = np.full((4, 4), 1.5, dtype=np.float32)
+    result = compact(img)
+    assert result.dtype == np.float32
+    assert result.max() == 1
+
+    img = np.full((4, 4), 2**31 - 1, dtype=np.int32)
+    assert compact(img).dtype == np.float32
+
+
+def test_to_uint8():
+    img = np.array([[0, 65535]], dtype=np.uint16)
+    assert np.array_equal(to_uint8(img), [[0, 255]])
+    assert np.array_equal(to_uint8(normalize(img)), to_uint8(img))
+
+
+def test_preview_format():
+    opaque = np.full((8, 8, 4), 1, dtype=np.float32)
+    assert get_preview(np.full((8, 8, 3), 0.5, dtype=np.float32)).mime == "image/jpeg"
+    assert get_preview(opaque).mime == "image/jpeg"
+
+    transparent = opaque.copy()
+    transparent[0, 0, 3] = 0
+    preview = get_preview(transparent)
+    assert preview.mime == "image/png"
+    assert preview.data.startswith(b"\x89PNG")
+
+
+def test_previews_are_memoized(monkeypatch):
+    encoded = []
+
+    def encode_preview(img, target_size):
+        encoded.append(img)
+        return image_utils.EncodedPreview(b"", "image/png")
+
+    monkeypatch.setattr(image_utils, "encode_preview", encode_preview)
+    monkeypatch.setattr(image_utils, "preview_memo", image_utils.OrderedDict())
+
+    img = np.zeros((8, 8, 3), dtype=np.float32)
+    preview = get_preview(img, 64)
+    assert get_preview(img, 64) is preview
+    assert len(encoded) == 1
+
+    # other sizes and equal images are different previews
+    get_preview(img, 32)
+    get_preview(img.copy(), 64)
+    assert len(encoded) == 3
+
+    # only the last few images are remembered
+    others = [
+        np.zeros((8, 8, 3), dtype=np.float32)
+        for _ in range(image_utils.PREVIEW_MEMO_SIZE)
+    ]
+    for other in others:
+        get_preview(other, 64)
+    assert len(image_utils.preview_memo) == image_utils.PREVIEW_MEMO_SIZE
+    get_preview(img, 64)
+    assert len(encoded) == 3 + len(others) + 1
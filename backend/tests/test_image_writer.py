@@ -0,0 +1,33 @@
+import cv2
+import numpy as np
+import pytest
+
+from ..src.nodes.utils.image_writer import ImageWriter, get_encode_params
+
+
+def test_image_writer(tmp_path):
+    writer = ImageWriter(max_workers=2, max_pending=2)
+    img = np.linspace(0, 1, 4 * 4 * 3, dtype=np.float32).reshape((4, 4, 3))
+    params = get_encode_params("png", 95, 1, 5)
+    futures = [
+        writer.write(str(tmp_path / "sub" / f"{i}.png"), img, "png", params)
+        for i in range(5)
+    ]
+    for future in futures:
+        future.result()
+    written = cv2.imread(str(tmp_path / "sub" / "4.png"), cv2.IMREAD_UNCHANGED)
+    assert np.array_equal(written, (img * 255).round().astype(np.uint8))
+
+    # The parent "directory" is a file
+    (tmp_path / "file").touch()
+    future = writer.write(str(tmp_path / "file" / "0.png"), img, "png", params)
+    with pytest.raises(OSError):
+        future.result()
+
+
+def test_encode_params():
+    assert get_encode_params("jpg", 80, 1, 5) == [cv2.IMWRITE_JPEG_QUALITY, 80]
+    # WebP is lossless at 100
+    assert get_encode_params("webp", 100, 1, 5) == [cv2.IMWRITE_WEBP_QUALITY, 101]
+    assert get_encode_params("png", 95, 9, 5) == [cv2.IMWRITE_PNG_COMPRESSION, 9]
+    assert get_encode_params("png", 95, 1, 5) == []
@@ -0,0 +1,37 @@
+from ..src.iteration_journal import IterationJournal
+
+
+def test_iteration_journal(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = IterationJournal(str(path))
+    journal.add("a.png")
+    journal.add("b.png")
+    journal.close()
+
+    # a killed process may leave an incomplete last line
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('"c.p')
+
+    resumed = IterationJournal(str(path))
+    assert resumed.is_finished("a.png")
+    assert resumed.is_finished("b.png")
+    assert not resumed.is_finished("c.png")
+
+    resumed.clear()
+    assert not path.exists()
+    assert not IterationJournal(str(path)).is_finished("a.png")
+
+
+def test_items_added_after_an_incomplete_line_are_kept(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('"a.png"\n"b.p')
+
+    journal = IterationJournal(str(path))
+    journal.add("c.png")
+    journal.close()
+
+    resumed = IterationJournal(str(path))
+    assert resumed.is_finished("a.png")
+    assert not resumed.is_finished("b.png")
+    assert resumed.is_finished("c.png")
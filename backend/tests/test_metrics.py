@@ -0,0 +1,46 @@
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from ..src.metrics import MetricsRecorder
+
+
+def test_measure_records_runs_and_output_size():
+    metrics = MetricsRecorder()
+
+    def run():
+        time.sleep(0.01)
+        return np.zeros((10, 10), np.float32)
+
+    metrics.measure("node", run)
+    metrics.measure("node", run)
+
+    node = metrics.get_node("node")
+    assert node["runs"] == 2
+    assert node["wallSeconds"] >= 0.02
+    assert node["outputBytes"] == 400
+    assert metrics.to_dict()["nodes"]["node"] == node
+
+
+def test_outputs_that_are_not_data_have_no_size():
+    metrics = MetricsRecorder()
+    metrics.measure("save", Future)
+    metrics.set_output("iterator", None)
+
+    assert metrics.get_node("save")["outputBytes"] is None
+    assert metrics.get_node("iterator")["outputBytes"] is None
+
+
+def test_iterator_progress():
+    metrics = MetricsRecorder()
+    metrics.start_iterator("iterator", 10, 2)
+    metrics.set_iterator_progress("iterator", 6, 10)
+    metrics.set_hoisted("iterator", ["model"])
+
+    iterator = metrics.to_dict()["nodes"]["iterator"]["iterator"]
+    assert iterator["finished"] == 6
+    assert iterator["total"] == 10
+    assert iterator["itemsPerSecond"] > 0
+    assert iterator["etaSeconds"] >= 0
+    assert iterator["hoistedNodes"] == ["model"]
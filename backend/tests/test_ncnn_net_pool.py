@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("ncnn_vulkan")
+
+# pylint: disable=wrong-import-position
+from ..src.nodes.utils import ncnn_net_pool
+from ..src.nodes.utils.ncnn_net_pool import NcnnNetPool
+
+
+class FakeNet:
+    loaded = 0
+
+    def __init__(self, param_path: str, bin_data: np.ndarray, gpu_index: int):
+        if bin_data.size == 0:
+            raise RuntimeError("Invalid weights")
+        FakeNet.loaded += 1
+        self.bin_data = bin_data
+
+
+@pytest.fixture
+def param_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(ncnn_net_pool, "PooledNet", FakeNet)
+    monkeypatch.setattr(ncnn_net_pool.ncnn, "get_default_gpu_index", lambda: 0)
+    FakeNet.loaded = 0
+    path = tmp_path / "model.param"
+    path.write_text("7767517")
+    return str(path)
+
+
+def test_nets_are_reused_by_weights(param_path):
+    pool = NcnnNetPool(max_nets=2)
+    weights = np.arange(10, dtype=np.float32)
+    net = pool.get_net(param_path, weights)
+    assert pool.get_net(param_path, weights.copy()) is net
+    assert pool.get_net(param_path, weights.astype(np.float16)) is not net
+    assert FakeNet.loaded == 2
+
+
+def test_least_recently_used_net_is_evicted(param_path):
+    pool = NcnnNetPool(max_nets=2)
+    a, b, c = [np.full(10, i, dtype=np.float32) for i in range(3)]
+    net_a = pool.get_net(param_path, a)
+    net_b = pool.get_net(param_path, b)
+    assert pool.get_net(param_path, a) is net_a
+    pool.get_net(param_path, c)
+
+    assert pool.get_net(param_path, a) is net_a
+    assert pool.get_net(param_path, b) is not net_b
+
+
+def test_nets_that_fail_to_load_are_not_kept(param_path):
+    pool = NcnnNetPool(max_nets=2)
+    weights = np.arange(10, dtype=np.float32)
+    net = pool.get_net(param_path, weights)
+    with pytest.raises(RuntimeError):
+        pool.get_net(param_path, np.zeros(0, dtype=np.float32))
+    assert pool.get_net(param_path, weights) is net
+    assert FakeNet.loaded == 1
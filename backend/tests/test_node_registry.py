@@ -0,0 +1,23 @@
+import os
+
+from ..src.node_registry import get_schema_cache_path
+
+
+def test_schema_cache_is_on_by_default(tmp_path, monkeypatch):
+    monkeypatch.delenv("CHAINNER_SCHEMA_CACHE", raising=False)
+    monkeypatch.delenv("CHAINNER_CACHE_DIR", raising=False)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setenv("LOCALAPPDATA", str(tmp_path))
+    path = get_schema_cache_path()
+    assert path is not None
+    assert os.path.basename(path) == "node-schemas.json"
+
+    monkeypatch.setenv("CHAINNER_CACHE_DIR", str(tmp_path / "cache"))
+    assert get_schema_cache_path() == str(tmp_path / "cache" / "node-schemas.json")
+
+    monkeypatch.setenv("CHAINNER_SCHEMA_CACHE", str(tmp_path / "schemas.json"))
+    assert get_schema_cache_path() == str(tmp_path / "schemas.json")
+
+    # An empty path turns the cache off
+    monkeypatch.setenv("CHAINNER_SCHEMA_CACHE", "")
+    assert get_schema_cache_path() is None
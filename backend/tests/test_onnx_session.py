@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+onnx = pytest.importorskip("onnx")
+
+# pylint: disable=wrong-import-position
+from ..src.nodes.utils.onnx_session import OnnxSessionCache
+
+CPU = ["CPUExecutionProvider"]
+
+
+def get_model(factor: float) -> bytes:
+    """Returns a model multiplying its input by the given factor"""
+    helper = onnx.helper
+    graph = helper.make_graph(
+        [helper.make_node("Mul", ["x", "factor"], ["y"])],
+        "multiply",
+        [helper.make_tensor_value_info("x", onnx.TensorProto.FLOAT, [1])],
+        [helper.make_tensor_value_info("y", onnx.TensorProto.FLOAT, [1])],
+        [helper.make_tensor("factor", onnx.TensorProto.FLOAT, [1], [factor])],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    return model.SerializeToString()
+
+
+def run(session, value: float) -> float:
+    return float(session.run(None, {"x": np.array([value], np.float32)})[0][0])
+
+
+def test_sessions_are_reused_by_model_content():
+    cache = OnnxSessionCache(max_sessions=2, max_bytes=1024**2)
+    a = get_model(2)
+    session = cache.get_session(a, CPU)
+    assert run(session, 3) == 6
+    # Equal bytes in another object
+    assert cache.get_session(bytes(bytearray(a)), CPU) is session
+    assert cache.get_session(a, CPU, {"session.use_env_allocators": "1"}) is not session
+
+
+def test_least_recently_used_session_is_evicted():
+    cache = OnnxSessionCache(max_sessions=2, max_bytes=1024**2)
+    a, b, c = get_model(2), get_model(3), get_model(4)
+    session_a = cache.get_session(a, CPU)
+    session_b = cache.get_session(b, CPU)
+    assert cache.get_session(a, CPU) is session_a
+    cache.get_session(c, CPU)
+
+    assert cache.get_session(a, CPU) is session_a
+    assert cache.get_session(b, CPU) is not session_b
+
+
+def test_sessions_are_bounded_by_model_size():
+    a, b = get_model(2), get_model(3)
+    cache = OnnxSessionCache(max_sessions=4, max_bytes=len(a) + len(b) - 1)
+    session_a = cache.get_session(a, CPU)
+    cache.get_session(b, CPU)
+    assert cache.get_session(a, CPU) is not session_a
+
+
+def test_optimized_models_are_stored(tmp_path):
+    a = get_model(2)
+    OnnxSessionCache(4, 1024**2, str(tmp_path)).get_session(a, CPU)
+    stored = [p.name for p in tmp_path.iterdir()]
+    assert len(stored) == 1 and stored[0].endswith(".onnx")
+
+    # A new cache, e.g. after a restart, loads the optimized model
+    session = OnnxSessionCache(4, 1024**2, str(tmp_path)).get_session(a, CPU)
+    assert run(session, 3) == 6
@@ -0,0 +1,115 @@
+import threading
+
+import numpy as np
+
+from ..src import persistent_cache
+from ..src.persistent_cache import (
+    CacheKeyBuilder,
+    PersistentCache,
+    create_persistent_cache,
+    get_value_size,
+)
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = PersistentCache(max_memory_bytes=200)
+    cache.put("a", np.zeros(100, dtype=np.uint8))
+    cache.put("b", np.zeros(100, dtype=np.uint8))
+    assert cache.get("a") is not None
+    cache.put("c", np.zeros(100, dtype=np.uint8))
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+
+
+def test_disk_tier_keeps_evicted_outputs(tmp_path):
+    cache = PersistentCache(
+        max_memory_bytes=1, disk_directory=str(tmp_path), max_disk_bytes=1024
+    )
+    img = np.arange(12, dtype=np.float32).reshape((2, 2, 3))
+    cache.put("a", (img, "dir", "name"))
+
+    reloaded = PersistentCache(
+        max_memory_bytes=1, disk_directory=str(tmp_path), max_disk_bytes=1024
+    )
+    cached_img, dirname, basename = reloaded.get("a")
+    assert np.array_equal(cached_img, img)
+    assert (dirname, basename) == ("dir", "name")
+
+
+def test_key_depends_on_literal_inputs():
+    def get_key(value):
+        builder = CacheKeyBuilder("chainner:image:blur")
+        assert builder.add_literal(value)
+        return builder.digest()
+
+    assert get_key(1) == get_key(1)
+    assert get_key(1) != get_key(2)
+    assert not CacheKeyBuilder("chainner:image:blur").add_literal(object())
+
+
+def test_value_size_of_self_referencing_output():
+    class Model:
+        def __init__(self):
+            self.weights = np.zeros((4, 4), np.float32)
+            self.parent = self
+            self.layers = [self.weights, self.weights]
+
+    assert get_value_size(Model()) == 64
+
+
+def test_disk_writes_do_not_block_reads(tmp_path, monkeypatch):
+    cache = PersistentCache(
+        max_memory_bytes=100, disk_directory=str(tmp_path), max_disk_bytes=1024
+    )
+    cache.put("a", np.zeros(100, dtype=np.uint8))
+
+    writing = threading.Event()
+    written = threading.Event()
+    save = np.save
+
+    def slow_save(*args, **kwargs):
+        writing.set()
+        assert written.wait(5)
+        save(*args, **kwargs)
+
+    monkeypatch.setattr(persistent_cache.np, "save", slow_save)
+    # Spills "a" to the disk
+    thread = threading.Thread(
+        target=cache.put, args=("b", np.zeros(100, dtype=np.uint8))
+    )
+    thread.start()
+    try:
+        assert writing.wait(5)
+        results = []
+        reader = threading.Thread(target=lambda: results.append(cache.get("b")))
+        reader.start()
+        reader.join(1)
+        assert len(results) == 1 and results[0] is not None
+    finally:
+        written.set()
+        thread.join()
+    assert cache.get("a") is not None
+
+
+def test_disk_tier_deletes_evicted_entries(tmp_path):
+    cache = PersistentCache(
+        max_memory_bytes=1, disk_directory=str(tmp_path), max_disk_bytes=250
+    )
+    for key in ["a", "b", "c"]:
+        cache.put(key, np.zeros(100, dtype=np.uint8))
+
+    assert cache.get("a") is None
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["b", "c"]
+
+
+def test_cache_is_only_created_if_configured(tmp_path, monkeypatch):
+    monkeypatch.delenv("CHAINNER_CACHE_DIR", raising=False)
+    monkeypatch.delenv("CHAINNER_CACHE_MEMORY_MB", raising=False)
+    assert create_persistent_cache() is None
+
+    monkeypatch.setenv("CHAINNER_CACHE_DIR", str(tmp_path))
+    cache = create_persistent_cache()
+    assert cache is not None
+    assert cache.max_memory_bytes == 256 * 1024**2
@@ -0,0 +1,22 @@
+from collections import namedtuple
+
+from ..src.preview_store import PreviewStore
+
+Preview = namedtuple("Preview", ["data", "mime"])
+
+
+def test_preview_store():
+    store = PreviewStore(max_entries=3, max_bytes=10)
+    first = store.put("a", Preview(b"1234", "image/png"))
+    second = store.put("a", Preview(b"5678", "image/png"))
+    assert first["nodeId"] == "a"
+    assert second["revision"] > first["revision"]
+    assert store.get("a", first["revision"]).data == b"1234"  # type: ignore
+
+    # exceeds max_bytes, so the oldest preview is dropped
+    store.put("b", Preview(b"90", "image/jpeg"))
+    third = store.put("b", Preview(b"ab", "image/jpeg"))
+    assert store.get("a", first["revision"]) is None
+    assert store.get("a", second["revision"]) is not None
+    assert store.get("b", third["revision"]).mime == "image/jpeg"  # type: ignore
+    assert store.get("b", third["revision"] + 1) is None
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Dict, List
+
+import pytest
+
+from nodes.node_base import IteratorNodeBase, NodeBase
+from nodes.node_factory import NodeFactory
+from nodes.properties.inputs import TextInput
+from nodes.properties.outputs import TextOutput
+from process import (
+    ExecutionContext,
+    Executor,
+    get_consumer_counts,
+    get_loop_invariant_nodes,
+    get_side_effect_order,
+)
+
+
+@NodeFactory.register("test:constant")
+class ConstantNode(NodeBase):
+    """Returns its input, and counts how often it ran"""
+
+    runs: List[str] = []
+
+    def __init__(self):
+        super().__init__()
+        self.inputs = [TextInput("Value")]
+
+    def run(self, value: str) -> str:
+        self.runs.append(value)
+        return value
+
+
+@NodeFactory.register("test:join")
+class JoinNode(NodeBase):
+    def __init__(self):
+        super().__init__()
+        self.inputs = [TextInput("A"), TextInput("B")]
+
+    def run(self, a: str, b: str) -> str:
+        return a + b
+
+
+@NodeFactory.register("test:record")
+class RecordNode(NodeBase):
+    """Records its input after waiting for the delay of the value, if any"""
+
+    records: List[str] = []
+    delays: Dict[str, float] = {}
+
+    def __init__(self):
+        super().__init__()
+        self.inputs = [TextInput("Value")]
+        self.outputs = [TextOutput("Value")]
+        self.side_effects = True
+
+    def run(self, value: str) -> str:
+        time.sleep(self.delays.get(value, 0))
+        self.records.append(value)
+        return value
+
+
+@NodeFactory.register("test:iterator_value")
+class IteratorValueNode(NodeBase):
+    def __init__(self):
+        super().__init__()
+        self.inputs = [TextInput("Value")]
+        self.type = "iteratorHelper"
+        self.side_effects = True
+
+    def run(self, value: str) -> str:
+        return value
+
+
+@NodeFactory.register("test:iterator")
+class ValueIteratorNode(IteratorNodeBase):
+    """Runs its children once for every comma-separated value"""
+
+    def __init__(self):
+        super().__init__()
+        self.inputs = [TextInput("Values")]
+
+    # pylint: disable=invalid-overridden-method
+    async def run(self, values: str, context: ExecutionContext) -> None:
+        value_node_id = None
+        child_nodes = []
+        for node_id, node in context.nodes.items():
+            if node["schemaId"] == "test:iterator_value":
+                value_node_id = node_id
+            if node["child"]:
+                child_nodes.append(node_id)
+            node["child"] = False
+        assert value_node_id is not None
+
+        items = values.split(",")
+        await context.run_iterations(
+            [{value_node_id: [item]} for item in items],
+            len(items),
+            child_nodes,
+            # Tests check the order of finished iterations and progress updates
+            on_finished=lambda node_inputs: context.queue.put_nowait(
+                {"event": "test:finished", "data": node_inputs[value_node_id][0]}
+            ),
+        )
+
+
+@pytest.fixture(autouse=True)
+def reset_nodes():
+    ConstantNode.runs = []
+    RecordNode.records = []
+    RecordNode.delays = {}
+
+
+def regular(node_id: str, schema_id: str, inputs: list, child=False):
+    return {
+        "id": node_id,
+        "schemaId": schema_id,
+        "inputs": inputs,
+        "outputs": [],
+        "child": child,
+        "nodeType": "regularNode",
+        "hasSideEffects": schema_id == "test:record",
+    }
+
+
+def iterator(node_id: str, values: str, children: List[str]):
+    return {
+        "id": node_id,
+        "schemaId": "test:iterator",
+        "inputs": [values],
+        "outputs": [],
+        "child": False,
+        "nodeType": "iterator",
+        "hasSideEffects": True,
+        "children": children,
+        "percent": 0,
+    }
+
+
+def iterator_value(node_id: str):
+    return {
+        "id": node_id,
+        "schemaId": "test:iterator_value",
+        "inputs": [None],
+        "outputs": [],
+        "child": True,
+        "nodeType": "iteratorHelper",
+        "hasSideEffects": True,
+    }
+
+
+def output(node_id: str):
+    return {"id": node_id, "index": 0}
+
+
+def run_executor(nodes, **kwargs) -> Executor:
+    async def run():
+        executor = Executor(
+            nodes,
+            asyncio.get_running_loop(),
+            asyncio.Queue(),
+            kwargs.pop("existing_cache", {}),
+            max_workers=4,
+            has_subscribers=kwargs.pop("has_subscribers", lambda: False),
+            **kwargs,
+        )
+        await executor.run()
+        return executor
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+def get_events(executor: Executor) -> List[dict]:
+    events = []
+    while not executor.queue.empty():
+        events.append(executor.queue.get_nowait())
+    return events
+
+
+def test_side_effects_run_in_order():
+    nodes = {
+        "c": regular("c", "test:record", [output("join")]),
+        "join": regular("join", "test:join", [output("a"), "c"]),
+        "a": regular("a", "test:record", ["a"]),
+        "b": regular("b", "test:record", ["b"]),
+    }
+    # Dependencies come first, otherwise nodes keep their order
+    assert get_side_effect_order(nodes) == ["a", "c", "b"]
+
+    # The independent node doesn't overtake the slow one before it
+    RecordNode.delays = {"a": 0.1}
+    run_executor(nodes)
+    assert RecordNode.records == ["a", "ac", "b"]
+
+
+def test_outputs_are_freed_after_last_consumer():
+    nodes = {
+        "x": regular("x", "test:constant", ["x"]),
+        "join1": regular("join1", "test:join", [output("x"), "1"]),
+        "join2": regular("join2", "test:join", [output("x"), "2"]),
+        "record1": regular("record1", "test:record", [output("join1")]),
+        "record2": regular("record2", "test:record", [output("join2")]),
+        "pinned": regular("pinned", "test:constant", ["pinned"]),
+        "record3": regular("record3", "test:record", [output("pinned")]),
+    }
+    assert get_consumer_counts(nodes, ["record1", "record2", "record3"]) == {
+        "x": 2,
+        "join1": 1,
+        "join2": 1,
+        "pinned": 1,
+    }
+
+    executor = run_executor(nodes, existing_cache={"pinned": "pinned"})
+    assert RecordNode.records == ["x1", "x2", "pinned"]
+    # The output of x was kept until both of its consumers ran
+    assert ConstantNode.runs == ["x"]
+    for node_id in ["x", "join1", "join2"]:
+        assert node_id not in executor.output_cache
+    # Outputs the executor was given are kept
+    assert executor.output_cache["pinned"] == "pinned"
+
+
+def test_iterations_finish_in_order_while_several_are_in_flight():
+    nodes = {
+        "iterator": iterator("iterator", "0,1,2,3,4", ["value", "record"]),
+        "value": iterator_value("value"),
+        "record": regular("record", "test:record", [output("value")], child=True),
+    }
+    # The first iterations take the longest, so later ones finish before them
+    RecordNode.delays = {"0": 0.15, "1": 0.1, "2": 0.05}
+    executor = run_executor(nodes, max_iterations_in_flight=3)
+    assert sorted(RecordNode.records) == ["0", "1", "2", "3", "4"]
+    assert RecordNode.records != sorted(RecordNode.records)
+
+    finished = set()
+    percents = []
+    for event in get_events(executor):
+        if event["event"] == "test:finished":
+            finished.add(event["data"])
+        elif event["event"] == "iterator-progress-update":
+            # Progress only counts iterations that finished along with all before them
+            count = round(event["data"]["percent"] * 5)
+            assert {str(i) for i in range(count)} <= finished
+            percents.append(event["data"]["percent"])
+    assert percents == sorted(percents)
+    assert percents[-1] == 1
+
+
+def test_loop_invariant_nodes_run_once():
+    nodes = {
+        "iterator": iterator(
+            "iterator", "0,1,2", ["value", "invariant", "join", "record"]
+        ),
+        "value": iterator_value("value"),
+        "invariant": regular("invariant", "test:constant", ["!"], child=True),
+        "join": regular(
+            "join", "test:join", [output("value"), output("invariant")], child=True
+        ),
+        "record": regular("record", "test:record", [output("join")], child=True),
+    }
+    assert get_loop_invariant_nodes(nodes, nodes["iterator"]["children"]) == [
+        "invariant"
+    ]
+
+    run_executor(nodes)
+    assert RecordNode.records == ["0!", "1!", "2!"]
+    assert ConstantNode.runs == ["!"]
+
+
+def get_broadcasts(executor: Executor, node_id: str) -> List[dict]:
+    return [
+        event["data"]
+        for event in get_events(executor)
+        if event["event"] == "node-output-data" and event["data"]["nodeId"] == node_id
+    ]
+
+
+def test_outputs_are_only_broadcast_to_subscribers():
+    nodes = {"record": regular("record", "test:record", ["a"])}
+
+    assert get_broadcasts(run_executor(nodes), "record") == []
+    assert (
+        len(get_broadcasts(run_executor(nodes, has_subscribers=lambda: True), "record"))
+        == 1
+    )
+
+
+@pytest.mark.parametrize("preview_interval,expected", [(60, 1), (0, 5)])
+def test_broadcasts_inside_iterators_are_throttled(preview_interval, expected):
+    nodes = {
+        "iterator": iterator("iterator", "0,1,2,3,4", ["value", "record"]),
+        "value": iterator_value("value"),
+        "record": regular("record", "test:record", [output("value")], child=True),
+    }
+
+    executor = run_executor(
+        nodes, has_subscribers=lambda: True, preview_interval=preview_interval
+    )
+    assert len(RecordNode.records) == 5
+    assert len(get_broadcasts(executor, "record")) == expected
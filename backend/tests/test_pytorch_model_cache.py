@@ -0,0 +1,42 @@
+import gc
+import weakref
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+# pylint: disable=wrong-import-position
+from ..src.nodes.utils.pytorch_model_cache import PreparedModelCache
+
+CPU = torch.device("cpu")
+
+
+def test_models_are_only_converted_once():
+    cache = PreparedModelCache()
+    model = torch.nn.Conv2d(3, 3, 3)
+
+    # Nothing to convert
+    assert cache.get(model, CPU, False) is model
+
+    half = cache.get(model, CPU, True)
+    assert half is not model
+    assert next(half.parameters()).dtype == torch.float16
+    assert cache.get(model, CPU, True) is half
+    # The given model is never modified
+    assert next(model.parameters()).dtype == torch.float32
+
+    channels_last = cache.get(model, CPU, False, channels_last=True)
+    assert channels_last is not model
+    assert cache.is_channels_last(channels_last)
+    assert not cache.is_channels_last(half)
+
+
+def test_converted_models_live_as_long_as_the_original():
+    cache = PreparedModelCache()
+    model = torch.nn.Conv2d(3, 3, 3)
+    half = cache.get(model, CPU, True)
+
+    half_ref = weakref.ref(half)
+    del model, half
+    gc.collect()
+    assert half_ref() is None
@@ -0,0 +1,92 @@
+import cv2
+import numpy as np
+import pytest
+
+from ..src.nodes.utils.tiler import (
+    SplitMemory,
+    TileBlend,
+    TileGrid,
+    auto_split,
+    check_tile_overlap,
+    get_tile_starts,
+)
+
+
+def test_tile_starts():
+    starts = get_tile_starts(100, 40, 10)
+    assert starts[0] == 0
+    assert starts[-1] == 60
+    for a, b in zip(starts, starts[1:]):
+        assert 10 <= a + 40 - b
+
+    assert get_tile_starts(30, 40, 10) == [0]
+
+
+def test_overlap_is_limited_to_half_a_tile():
+    # Before, an overlap larger than the tile made every tile advance by 1px
+    grid = TileGrid(2000, 2000, (16, 16), 32)
+    assert len(grid.y_starts) == 249
+    assert len(grid.tiles) == 249**2
+    for a, b in zip(grid.y_starts, grid.y_starts[1:]):
+        assert b - a >= 8
+
+    check_tile_overlap(16, 8)
+    check_tile_overlap(0, 32)
+    with pytest.raises(ValueError):
+        check_tile_overlap(16, 32)
+
+
+def upscale(img: np.ndarray) -> np.ndarray:
+    """Like a model: a convolution with edge padding, followed by a 2x upscale"""
+    blurred = cv2.blur(img, (5, 5), borderType=cv2.BORDER_REPLICATE)
+    return cv2.resize(blurred, None, fx=2, fy=2, interpolation=cv2.INTER_NEAREST)
+
+
+@pytest.mark.parametrize("blend", [TileBlend.LINEAR, TileBlend.COSINE])
+def test_tiles_blend_without_seams(blend):
+    img = np.random.default_rng(0).random((100, 130, 3), dtype=np.float32)
+    result, _ = auto_split(
+        img, upscale, lambda _: False, tile_size=(40, 40), overlap=16, blend=blend
+    )
+    # The pixels at the edges of tiles, which are affected by padding, are not used
+    assert np.abs(result - upscale(img)).max() < 1e-5
+
+
+class Model:
+    pass
+
+
+def test_split_memory_is_kept_per_key_and_resolution_bucket():
+    memory = SplitMemory()
+    model = Model()
+    memory.set(model, "cpu", 100, 200, (64, 64))
+
+    assert memory.get(model, "cpu", 100, 200) == (64, 64)
+    # Same powers of 2
+    assert memory.get(model, "cpu", 128, 129) == (64, 64)
+    assert memory.get(model, "cpu", 129, 129) is None
+    assert memory.get(model, "cuda", 100, 200) is None
+    assert memory.get(Model(), "cpu", 100, 200) is None
+
+
+def test_auto_split_starts_with_the_split_that_worked():
+    model = Model()
+    attempts = []
+
+    def upscale(img: np.ndarray) -> np.ndarray:
+        attempts.append(img.shape[:2])
+        if max(img.shape[:2]) > 40:
+            raise RuntimeError("out of memory")
+        return img
+
+    img = np.zeros((100, 100, 3), np.float32)
+    _, tile_size = auto_split(
+        img, upscale, lambda e: "memory" in str(e), overlap=8, model=model
+    )
+    assert tile_size == (25, 25)
+    assert len([shape for shape in attempts if max(shape) > 40]) > 0
+
+    # An image of similar size doesn't run out of memory again
+    attempts.clear()
+    auto_split(img[:90], upscale, lambda e: "memory" in str(e), overlap=8, model=model)
+    assert all(max(shape) <= 40 for shape in attempts)
@@ -0,0 +1,35 @@
+import cv2
+import numpy as np
+
+from ..src.nodes.utils.utils import convenient_upscale
+
+
+def upscale(img: np.ndarray) -> np.ndarray:
+    return cv2.resize(img, None, fx=2, fy=2, interpolation=cv2.INTER_NEAREST)
+
+
+def test_transparency_variants_are_upscaled_in_one_batch():
+    rng = np.random.default_rng(0)
+    img = rng.random((8, 8, 4), dtype=np.float32)
+    batches = []
+
+    def upscale_batch(imgs):
+        batches.append(len(imgs))
+        return [upscale(i) for i in imgs]
+
+    batched = convenient_upscale(img, 3, upscale, upscale_batch)
+    assert batches == [2]
+    assert np.allclose(batched, convenient_upscale(img, 3, upscale))
+    # The alpha channel is recovered from the difference of the variants
+    assert np.allclose(batched[:, :, 3], upscale(img)[:, :, 3], atol=1e-5)
+
+
+def test_single_color_alpha_is_not_batched():
+    img = np.dstack((np.zeros((4, 4, 3), np.float32), np.full((4, 4), 0.5)))
+
+    def upscale_batch(_):
+        raise AssertionError("Only one image has to be upscaled")
+
+    output = convenient_upscale(img, 3, upscale, upscale_batch)
+    assert output.shape == (8, 8, 4)
+    assert np.all(output[:, :, 3] == 0.5)
@@ -0,0 +1,48 @@
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+from ..src.nodes.utils.video_utils import FfmpegVideoBackend, VideoWriter
+
+FAKE_FFMPEG = """#!{python}
+import sys
+# More than fits into a pipe, before reading any frame
+sys.stderr.write("x" * 1000000 + "\\n")
+sys.stderr.flush()
+sys.stdin.buffer.read()
+sys.stderr.write("failed\\n")
+sys.exit(1)
+"""
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="The fake FFmpeg is a script")
+def test_ffmpeg_errors_do_not_block_writing(tmp_path, monkeypatch):
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    ffmpeg.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    writer = VideoWriter(
+        FfmpegVideoBackend(
+            str(tmp_path / "out.mp4"), 30, 64, 64, "libx264", 23, "yuv420p"
+        )
+    )
+    errors = []
+
+    def write():
+        try:
+            for _ in range(50):
+                writer.write(np.zeros((64, 64, 3), np.uint8))
+            writer.close()
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    thread = threading.Thread(target=write, daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive(), "Writing the video blocked"
+    assert len(errors) == 1
+    assert errors[0].endswith("failed\n")
@@ -666,6 +666,46 @@ const removeEmptyStrings = (data) => {
     return data;
 };
 
+const addVideoEncoderQuality = (data) => {
+    data.nodes.forEach((node) => {
+        if (node.data.schemaId === 'chainner:image:simple_video_frame_iterator_save') {
+            node.data.inputData['5'] ??= 23;
+        }
+    });
+
+    return data;
+};
+
+const addTileInputs = (data) => {
+    data.nodes.forEach((node) => {
+        if (node.data.schemaId === 'chainner:pytorch:upscale_image') {
+            node.data.inputData['2'] ??= 0;
+        }
+        if (
+            node.data.schemaId === 'chainner:pytorch:upscale_image' ||
+            node.data.schemaId === 'chainner:onnx:upscale_image' ||
+            node.data.schemaId === 'chainner:ncnn:upscale_image'
+        ) {
+            node.data.inputData['3'] ??= 16;
+        }
+    });
+
+    return data;
+};
+
+const addImageEncoderSettings = (data) => {
+    data.nodes.forEach((node) => {
+        if (node.data.schemaId === 'chainner:image:save') {
+            // WebP images used to be lossless
+            node.data.inputData['5'] ??= node.data.inputData['4'] === 'webp' ? 100 : 95;
+            node.data.inputData['6'] ??= 1;
+            node.data.inputData['7'] ??= 5;
+        }
+    });
+
+    return data;
+};
+
 // ==============
 
 const versionToMigration = (version) => {
@@ -702,6 +742,9 @@ const migrations = [
     fixDropDownNumberValues,
     onnxConvertUpdate,
     removeEmptyStrings,
+    addVideoEncoderQuality,
+    addTileInputs,
+    addImageEncoderSettings,
 ];
 
 export const currentMigration = migrations.length;
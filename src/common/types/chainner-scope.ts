@@ -57,7 +57,11 @@ struct OverflowMethod;
 struct ReciprocalScalingFactor;
 struct RotateInterpolationMode;
 struct ThresholdType;
+struct TiffCompression;
+struct TileBlend;
 struct TileMode;
+struct VideoEncoder;
+struct VideoPixelFormat;
 struct VideoType;
 
 enum Orientation { Horizontal, Vertical }